@@ -1,28 +1,56 @@
 """
     Sample code for Multi-Threaded Server
     Python 3
-    Usage: python3 TCPServer3.py SERVER_PORT ATTEMPTS_BEFORE_LOCK
+    Usage: python3 TCPServer3.py SERVER_PORT ATTEMPTS_BEFORE_LOCK [--threaded | --workers N | --cluster-link HOST:PORT --cluster-peer HOST:PORT ...]
     coding: utf-8
     
     Author: Jerry Yeh (z5362570) - Adapted from Wei Song (Tutor for COMP3331/9331)
 """
 
 from socket import *
-from threading import Thread
+from threading import Thread, Lock
 import sys, select
+import os
+import gc
+import argparse
+import signal
+import asyncio
 import time
-import json
+import zlib
+import queue
+import logging
+from logging.handlers import QueueHandler, QueueListener
+
+from protocol import FrameDecoder, FrameError, RECV_BUFFER_SIZE, HEARTBEAT_INTERVAL
+from codec import CODECS, DEFAULT_CODEC, EncodedPush, encode_json, decode_json, stored_push_frames
+from compression import FrameCompressor, COMPRESSORS, DEFAULT_COMPRESS_THRESHOLD
+from presence import PresenceTable
+from interconnect import OpLink, drain_links
+from credential_store import CredentialStore, DEFAULT_RELOAD_INTERVAL
+from ratelimit import RateLimiter, TOO_MANY_REQUESTS, COMMAND_CLASSES, parse_limit
+from metrics import Metrics, LATENCY_BUCKETS, FANOUT_BUCKETS
+from logwriter import LogWriter, FSYNC_POLICIES, DEFAULT_FLUSH_INTERVAL, DEFAULT_FSYNC_POLICY
+from offline_mailbox import Mailbox, MAILBOX_DIR
+from group_store import GroupStore, GROUP_STATE_DIR
+from timerwheel import TimerWheel
+from outbound import (ThreadedOutboundQueue, AsyncOutboundQueue, OVERFLOW_POLICIES,
+                      DEFAULT_OVERFLOW_POLICY, DEFAULT_MAX_FRAMES, DEFAULT_MAX_BYTES)
 
 
 ##################################################
 #                 Helper Functions               #
 ##################################################
 # Socket and Server Constants:
-SOCKET_BUFFER_SIZE = 1024
+SOCKET_BUFFER_SIZE = RECV_BUFFER_SIZE
+SENDMSG_MAX_BUFFERS = 512  # stays under the kernel's IOV_MAX per sendmsg()
+WORKER_RESTART_DELAY = 1.0  # seconds before a crashed --workers process is started again
+WORKER_STOP_TIMEOUT = 5.0  # seconds the broker waits for stopped workers' links to close
+LISTEN_BACKLOG = 1024  # room for connection bursts from many clients logging in at once
+CLUSTER_RETRY_DELAY = 1.0  # seconds between attempts to reach a cluster node that is down
+DEFAULT_IDLE_TIMEOUT = 3 * HEARTBEAT_INTERVAL  # seconds of silence before a connection is dropped
 
 # File Paths:
 CREDENTIALS_FILE = 'credentials.txt'
-USER_LOG_FILE = 'userlog.txt'
 MESSAGE_LOG_FILE = 'messagelog.txt'
 
 # Status Code Constants:
@@ -34,162 +62,331 @@ NOT_FOUND = 404
 CONFLICT = 409
 INTERNAL_SERVER_ERROR = 500
 
+# Group History Constants:
+DEFAULT_HISTORY_LIMIT = 20  # messages per /grouphistory page when no LIMIT is given
+MAX_HISTORY_LIMIT = 200
+
+# Logging Constants:
+LOG_LEVELS = ("debug", "info", "warning", "error")
+DEFAULT_LOG_LEVEL = "info"  # per-request lines are debug, so they cost nothing by default
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+
+log = logging.getLogger("tessenger")
+
 ##################################################
 #             Global Helper Functions            #
 ##################################################
 def generate_response(command, statusCode, clientMessage = "", data={}):
+    # kept as a dict until it is sent, so logging it needs no parsing
     response = {
         "command": command,
         "statusCode": statusCode,
         "clientMessage": clientMessage,
         "data": data
     }
-    return json.dumps(response)
+    return response
+
+def parse_login_options(words):
+    # NAME=VALUE words after the [loginpassword] fields, e.g. codec=binary
+    return dict(word.partition("=")[::2] for word in words if "=" in word)
+
+def history_response(group_name, records):
+    # records are (sequence, log line) pairs, oldest first
+    messages = []
+    for sequence, record in records:
+        fields = record.split("; ", 3)
+        if len(fields) == 4:
+            messages.append([sequence, fields[1], fields[2], fields[3]])
+    if not messages:
+        return generate_response("grouphistory", SUCCESS, f"No earlier messages in group chat {group_name}.",
+                                 {"group": group_name, "messages": []})
+    data = {"group": group_name, "messages": messages}
+    if messages[0][0] > 1:
+        # BEFORE_SEQ for the page before this one
+        data["before"] = messages[0][0]
+    return generate_response("grouphistory", SUCCESS, "\n".join(record for _, record in records), data)
 
 def generate_formatted_time():
     return f"{time.strftime('%d %b %Y %H:%M:%S', time.localtime())}"
 
 def display_response(response):
-    response_data = json.loads(response)
-    command = response_data.get("command")
-    status_code = response_data.get("statusCode")
-    message = response_data.get("clientMessage")
-    data = response_data.get("data")
-    
-    if data:
-        print("[send] " + f"Response for command {command}, issued with status code [{status_code}] and message '{message}'. Additional data attached.")
-    else:
-        print("[send] " + f"Response for command {command}, issued with status code [{status_code}] and message '{message}'. No additional data.")
-    
+    if not log.isEnabledFor(logging.DEBUG):
+        return
+    log.debug("[send] Response for command %s, issued with status code [%s] and message '%s'. %s",
+              response["command"], response["statusCode"], response["clientMessage"],
+              "Additional data attached." if response["data"] else "No additional data.")
 
-##################################################
-#                Setup Host and Port             #
-##################################################
-if len(sys.argv) != 3:
-    print("\n===== Error usage, python3 TCPServer3.py SERVER_PORT ATTEMPTS_BEFORE_LOCK ======\n")
-    exit(0)
-server_host = "127.0.0.1"
-server_port = int(sys.argv[1])
-server_address = (server_host, server_port)
-
-try:
-    attempts_cap = int(sys.argv[2])
-except ValueError:
-    print("Error: ATTEMPTS_BEFORE_LOCK must be an integer.")
-    sys.exit(1)
-
-if not 1 <= attempts_cap <= 5:
-    print(f"Error: Invalid number of allowed failed consecutive attempt: {attempts_cap}")
-    sys.exit(1)
-
-# define socket for the server side and bind address
-server_socket = socket(AF_INET, SOCK_STREAM)
-server_socket.bind(server_address)
+def connection_handler(handler):
+    """Wrap a start_server() callback so that cancelling it on shutdown just closes
+    the connection; asyncio logs a cancelled callback task as an error."""
+    async def handle(reader, writer):
+        try:
+            await handler(reader, writer)
+        except asyncio.CancelledError:
+            writer.close()
+    return handle
+
+class DeferredQueueHandler(QueueHandler):
+    """Queues records as they are; the listener thread formats them."""
+    def prepare(self, record):
+        # the stock handler formats in the caller's thread, which is what we want to avoid;
+        # records only hold plain values and never leave the process
+        return record
+
+def setup_logging(level):
+    """Send log records through a queue to a background thread that writes stdout."""
+    records = queue.SimpleQueue()
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    listener = QueueListener(records, handler)
+    root = logging.getLogger()
+    root.addHandler(DeferredQueueHandler(records))
+    root.setLevel(level.upper())
+    listener.start()
+    return listener
+    
 
 ##################################################
 #               Setup Datastructures             #
 ##################################################
-# load in credentials .txt into a dict
-credentials = {}
+# credentials.txt is opened as an indexed store in main()
+credentials = None
+# only users with failed logins since their last success have an entry
 failed_attempts = {}
 blocked_users = {}
-with open(CREDENTIALS_FILE) as file:
-    for l in file.readlines():
-        username = l.split()[0]
-        password = l.split()[1]
-        credentials[username] = password
-        failed_attempts[username] = 0
-
-# threads datastructure - maps username to thread object
+attempts_cap = 1
+
+# per-connection outbound queue limits, set in main()
+outbound_max_frames = DEFAULT_MAX_FRAMES
+outbound_max_bytes = DEFAULT_MAX_BYTES
+overflow_policy = DEFAULT_OVERFLOW_POLICY
+
+# threads datastructure - maps username to session object (ClientThread or AsyncClientSession)
 threads = {}
 
-# maps username to timestamp since active
-active_users = {}
+# who is online, since when and where - also maintains userlog.txt
+active_users = PresenceTable()
 
 # maps groupname to group
 groups = {}
 
+# maps username to the names of the groups they have joined, to find their groups at login and logout
+joined_groups = {}
+
+# journal and snapshots of the groups, opened in main() by the process that owns them
+group_store = None
+
+# messages waiting for users who are offline, opened in main()
+mailbox = Mailbox()
+
+# token buckets per user and command class, configured in main()
+rate_limiter = RateLimiter()
+
+# users allowed to run admin commands such as /metrics, set in main()
+admins = set()
+
+# smallest write batch compressed for clients that asked for compression, set in main()
+compress_threshold = DEFAULT_COMPRESS_THRESHOLD
+
+# one timer per connection, to drop the ones that stopped sending; None when
+# --idle-timeout is 0. The lock is for the threaded mode's reader threads.
+idle_timeout = DEFAULT_IDLE_TIMEOUT
+idle_timers = None
+idle_timers_lock = Lock()
+
+# in a worker of the multi-process mode, the link to the broker that owns the
+# shared state; in cluster mode, this node's ClusterNode, which plays the broker
+# for the local sessions; None when this process serves on its own
+broker_link = None
+
 ##################################################
-#                LOGGING FUNCTIONS               #
+#                     METRICS                    #
 ##################################################
-#reset user log
-with open('userlog.txt', 'w') as file:
-    pass
+# recorded by the sessions, rendered for /metrics and --metrics-port
+metrics = Metrics()
+metrics.describe("requests_total", "counter", "Requests handled, by command", label="command")
+metrics.describe("request_seconds", "histogram", "Time from reading a request to queueing its response",
+                 label="command", buckets=LATENCY_BUCKETS)
+metrics.describe("group_fanout", "histogram", "Recipients of each group message", buckets=FANOUT_BUCKETS)
+metrics.describe("bytes_received_total", "counter", "Bytes read from client connections")
+metrics.describe("bytes_sent_total", "counter", "Bytes written to client connections")
+metrics.describe("pushes_dropped_total", "counter", "Pushes refused by a full outbound queue")
+metrics.describe("connections_open", "gauge", "Client connections currently open")
+metrics.describe("compression_input_bytes_total", "counter", "Bytes of frames compressed for clients that asked for it")
+metrics.describe("compression_output_bytes_total", "counter", "Bytes those frames were compressed to")
+metrics.describe("compression_seconds_total", "counter", "CPU time spent compressing")
+metrics.describe("compression_skipped_total", "counter", "Write batches sent uncompressed for being under the threshold")
+metrics.describe("idle_disconnects_total", "counter", "Connections dropped for sending nothing within the idle timeout")
 
-active_user_no = 1
-def write_user_log(username, client_ip, udp_port):
-    global active_user_no
-    with open(USER_LOG_FILE, 'a') as file:
-        file.write(f"{active_user_no}; {generate_formatted_time()}; {username}; {client_ip}; {udp_port}\n")
-    active_user_no += 1
+def register_collected_metrics():
+    # read when rendering, so they cost nothing while serving
+    metrics.collect("logged_in_sessions", "gauge", "Logged in users connected to this process", lambda: len(threads))
+    metrics.collect("active_users", "gauge", "Users online, on any worker or cluster node", lambda: len(active_users))
+    metrics.collect("groups", "gauge", "Group chats", lambda: len(groups))
+    metrics.collect("outbound_queued_frames", "gauge", "Frames waiting in all outbound queues",
+                    lambda: sum(session.outbound.depth() for session in list(threads.values())))
+    metrics.collect("outbound_queue_max_frames", "gauge", "Frames waiting in the fullest outbound queue",
+                    lambda: max([session.outbound.depth() for session in list(threads.values())], default=0))
+    metrics.collect("log_writer_lag_seconds", "gauge", "Age of the oldest log line not yet written",
+                    lambda: log_writer.lag())
+    metrics.collect("log_writer_backlog", "gauge", "Log lines queued but not yet written",
+                    lambda: log_writer.backlog())
+    metrics.collect("rate_limit_allowed_total", "counter", "Requests let through by the rate limiter, by class",
+                    lambda: {command_class: counts["allowed"] for command_class, counts in rate_limiter.counters().items()},
+                    label="class")
+    metrics.collect("rate_limit_refused_total", "counter", "Requests refused by the rate limiter, by class",
+                    lambda: {command_class: counts["limited"] for command_class, counts in rate_limiter.counters().items()},
+                    label="class")
+    metrics.collect("link_ops_sent_total", "counter", "Ops sent to the broker or other cluster nodes",
+                    lambda: sum(link.ops_sent for link in broker_links()))
+    metrics.collect("link_frames_sent_total", "counter", "Batched frames those ops were sent in",
+                    lambda: sum(link.frames_sent for link in broker_links()))
+    metrics.collect("compression_ratio", "gauge", "Bytes compressed per byte sent for them",
+                    lambda: compression_ratio())
+    metrics.collect("idle_timers", "gauge", "Idle timeout timers pending, including those of closed connections",
+                    lambda: 0 if idle_timers is None else len(idle_timers))
+    metrics.collect("uptime_seconds", "gauge", "Seconds since the server started", lambda: time.time() - metrics.started)
 
-#reset user log
-with open(MESSAGE_LOG_FILE, 'w') as file:
-    pass
+def broker_links():
+    return [] if broker_link is None else broker_link.links()
+
+def compression_ratio():
+    sent = metrics.read("compression_output_bytes_total")[0][1]
+    return metrics.read("compression_input_bytes_total")[0][1] / sent if sent else 0
+
+def request_label(command):
+    # anything a client makes up is counted together, to keep the label set small
+    return command if command in COMMAND_CLASSES else "unknown"
+
+##################################################
+#                LOGGING FUNCTIONS               #
+##################################################
+# message and group logs are written by a background thread, configured in main()
+log_writer = LogWriter()
 
 message_counter = 1
 def write_message_log(username_to, timestamp, message):
-    global active_user_no
-    with open(MESSAGE_LOG_FILE, 'a') as file:
-        file.write(f"{message_counter}; {timestamp}; {username_to}; {message}")
-    active_user_no += 1
-
-def update_user_log(username_to_remove):
-    global active_user_no
-    lines = []
-
-    # Read the current user log file
-    with open(USER_LOG_FILE, 'r') as file:
-        lines = file.readlines()
-
-    # Rewrite the file without the removed user and adjust sequence numbers
-    with open(USER_LOG_FILE, 'w') as file:
-        new_user_no = 1
-        for line in lines:
-            parts = line.strip().split('; ')
-            if len(parts) < 4 or parts[2] != username_to_remove:
-                file.write(f"{new_user_no}; {parts[1]}; {parts[2]}; {parts[3]}; {parts[4]}\n")
-                new_user_no += 1
-
-    # Update the global active_user_no
-    active_user_no = new_user_no
+    if broker_link is not None:
+        # numbered and written by the broker, so every worker shares one sequence
+        broker_link.send(["msglog", username_to, timestamp, message])
+        return
+    record_message_log(username_to, timestamp, message)
+
+def record_message_log(username_to, timestamp, message):
+    global message_counter
+    log_writer.append(MESSAGE_LOG_FILE, f"{message_counter}; {timestamp}; {username_to}; {message}")
+    message_counter += 1
 
 ##################################################
 #                   Group Class                  #
 ##################################################
+def add_group(group):
+    # every new or rebuilt group goes through here, so the group store and member indexes see it
+    groups[group.name] = group
+    for user, joined in group.users_joined.items():
+        if joined:
+            joined_groups.setdefault(user, set()).add(group.name)
+    if group_store is not None:
+        group_store.create(group.name, group.users_joined)
+    return group
+
+def restore_groups(members_by_group):
+    # groups an earlier run saved or the broker sent over: already stored, so only built and indexed
+    rebuilt = [GroupChat.from_members(name, users_joined) for name, users_joined in members_by_group]
+    groups.update((group.name, group) for group in rebuilt)
+    index = joined_groups
+    for group in rebuilt:
+        name = group.name
+        for user, joined in group.users_joined.items():
+            if joined:
+                names = index.get(user)
+                if names is None:
+                    index[user] = {name}
+                else:
+                    names.add(name)
+
+def recover_groups(directory):
+    """Open the group store in directory and rebuild its groups; returns the store."""
+    # all of this lives as long as the server, so the collector is kept from rescanning it while it grows
+    gc.disable()
+    try:
+        store = GroupStore(directory)
+        restore_groups(store.open().items())
+    finally:
+        gc.enable()
+    gc.freeze()
+    return store
+
+def member_online(username):
+    for name in list(joined_groups.get(username, ())):
+        group = groups.get(name)
+        if group is not None:
+            group.online.add(username)
+
+def member_offline(username):
+    for name in list(joined_groups.get(username, ())):
+        group = groups.get(name)
+        if group is not None:
+            group.online.discard(username)
+
+# the presence table tells the groups when their members come and go
+active_users.on_login = member_online
+active_users.on_logout = member_offline
+
 class GroupChat():
     def __init__(self, name, owner, users):
         # Initialise Variables
         self.name = name
         self.users_joined = {}
         self.users_joined[owner] = True
+        # number of the next log line; from_members() leaves it None until the log has been looked at
         self.message_number = 1
         for user in users:
             self.users_joined[user] = False
+        # joined members who are online here or on another worker or node; fan-out only looks at these
+        self.online = {owner} if owner in active_users else set()
         
         self.log_file_name = f"{self.name}_messagelog.txt"
-        with open(self.log_file_name, 'w') as log_file:
-            pass
-    
-    def send_message(self, sender, message, timestamp):
-        # send to everyone but the sender
-        global threads
-        global active_users
-        for username, joined in self.users_joined.items(): # for every user invited
-            if joined and username in active_users and username != sender: # if user is joined, and user is active, and is not equal to sender
-                recipient_thread = threads.get(username)
-                response = generate_response("incominggroupmsg", SUCCESS, f"{sender} issued a message in group chat {self.name}:\n{timestamp}; {sender}; {message}").encode()
-                recipient_thread.client_socket.send(response)# send the message to the recipient
     
     def log_message(self, timestamp, sender, message):
-        log_line = f"{self.message_number}; {timestamp}; {sender}; {message}"
-        with open(self.log_file_name, 'a') as log_file:
-            log_file.write(log_line)
-            
+        if broker_link is not None:
+            broker_link.send(["grouplog", self.name, timestamp, sender, message])
+            return
+        self.record_message(timestamp, sender, message)
+
+    def record_message(self, timestamp, sender, message):
+        if self.message_number is None:
+            # carry on from the newest message in the log kept from before
+            self.message_number = log_writer.last_sequence(self.log_file_name) + 1
+        # a record, which the log writer keeps on one line whatever newlines the message holds
+        text = message.removesuffix("\n")
+        record = f"{self.message_number}; {timestamp}; {sender}; {text}"
+        log_writer.append(self.log_file_name, record, self.message_number)
         self.message_number += 1
 
+    def read_history(self, before, limit):
+        """Up to limit (sequence, log line) pairs numbered below before, oldest first."""
+        return log_writer.read_page(self.log_file_name, before, limit)
+
+    @classmethod
+    def from_members(cls, name, users_joined):
+        # rebuild a group another process or an earlier run created; the owner is the first member
+        group = cls.__new__(cls)
+        group.name = name
+        group.users_joined = dict(users_joined)
+        group.message_number = None
+        # nobody is online yet when the server starts
+        group.online = {user for user, joined in group.users_joined.items() if joined and user in active_users} if len(active_users) else set()
+        group.log_file_name = f"{name}_messagelog.txt"
+        return group
+
     def accept_invite(self, user):
         self.users_joined[user] = True
+        joined_groups.setdefault(user, set()).add(self.name)
+        if user in active_users:
+            self.online.add(user)
+        if group_store is not None:
+            group_store.join(self.name, user)
         
     def has_user_joined(self, user):
         return self.users_joined.get(user, False)
@@ -198,90 +395,235 @@ class GroupChat():
         return True if user in self.users_joined.keys() else False
 
 ##################################################
-#                  Thread Class                  #
+#                  Session Class                 #
 ##################################################
-class ClientThread(Thread):
-    def __init__(self, client_address, client_socket):
-        Thread.__init__(self)
+class ClientSession():
+    """Per-connection state and command handlers, shared by every I/O model.
+
+    Subclasses own the socket: they feed received bytes into handle_data(),
+    provide an outbound queue and run a writer that drains it, and implement
+    abort() to drop the connection when the overflow policy asks for it.
+    """
+    def __init__(self, client_address):
         self.client_address = client_address
-        self.client_socket = client_socket
         self.client_alive = False
         self.username = None
         self.password = None
+        self.decoder = FrameDecoder()
+        self.outbound = self.create_outbound_queue()
+        # frames a handler wants sent right after its own response
+        self.deferred_frames = []
+        # rate limit buckets for login attempts and anything sent before logging in
+        self.connection_buckets = {}
+        # id of the request being handled, for handlers that answer later
+        self.request_id = 0
+        # how responses and pushes are encoded, chosen by the client at login
+        self.codec = DEFAULT_CODEC
+        # compresses what the writer sends, if the client asked for it at login
+        self.compressor = None
+        # maps the id of a request answered later to (command, start time), for its latency
+        self.deferred_requests = {}
+        # when data last arrived, which the idle timer checks when it fires
+        self.last_activity = time.monotonic()
+        watch_idle(self)
+        metrics.increment("connections_open")
         
-        print("===== New connection created for: ", client_address)
+        log.info("New connection created for: %s", client_address)
         self.client_alive = True
-        
-    def run(self):
-        request = ''
-        
-        while self.client_alive:
-            # use recv() to receive message from the client
-            data = self.client_socket.recv(SOCKET_BUFFER_SIZE)
-            request = data.decode()
 
-            # if the message from client is empty, the client would be off-line then set the client as offline (alive=Flase)
-            if request == '\n' or request == '':
+    def create_outbound_queue(self):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def abort(self):
+        raise NotImplementedError
+
+    def send_raw(self, data):
+        # responses to our own requests, never dropped
+        self.outbound.put(data, droppable=False)
+
+    def prepare_batch(self, batch):
+        """The buffers the writer sends for batch, compressed if this client asked for it."""
+        compressor = self.compressor
+        if compressor is not None:
+            # CPU time of this thread, so the cost is the same whichever thread writes
+            started = time.thread_time()
+            batch, compressed = compressor.compress(batch)
+            if compressed:
+                metrics.increment("compression_seconds_total", amount=time.thread_time() - started)
+                metrics.increment("compression_input_bytes_total", amount=compressed)
+                metrics.increment("compression_output_bytes_total", amount=sum(map(len, batch)))
+            else:
+                metrics.increment("compression_skipped_total")
+        metrics.increment("bytes_sent_total", amount=sum(map(len, batch)))
+        return batch
+
+    def push(self, response):
+        """Queue a message from another user; never blocks the caller."""
+        return self.push_frame(self.codec.push_frame(response))
+
+    def push_encoded(self, push):
+        """Queue an EncodedPush shared with other recipients."""
+        return self.push_frame(push.frame(self.codec))
+
+    def push_frame(self, frame):
+        """Queue an already-encoded frame, which may be shared with other recipients."""
+        queued = self.outbound.put(frame)
+        if not queued:
+            metrics.increment("pushes_dropped_total")
+        if not queued and self.outbound.overflowed:
+            log.warning("Outbound queue overflow, disconnecting %s", self.username)
+            self.abort()
+        return queued
+
+    def handle_data(self, data):
+        """Decode every complete frame in data, handle them in order and return
+        the framed responses, each carrying its request's id, joined into one
+        buffer (empty if there are none)."""
+        metrics.increment("bytes_received_total", amount=len(data))
+        self.last_activity = time.monotonic()
+        responses = []
+        for request_id, _, payload in self.decoder.feed(data):
+            request = payload.decode()
+
+            # an empty request line means the client is leaving
+            if request.strip() == '':
                 self.end_client_session()
                 break
             
-            # get the type of message
-            requestCommand = request.split()[0]
+            self.request_id = request_id
+            response = self.handle_request(request)
+            # None means the handler will answer later through complete_request()
+            if response is not None:
+                responses.append(self.codec.frame(response, request_id))
+            if self.deferred_frames:
+                responses.extend(self.deferred_frames)
+                self.deferred_frames = []
+            if not self.client_alive:
+                break
+        
+        return b''.join(responses)
+
+    def handle_request(self, request):
+        started = time.perf_counter()
+        command = request_label(request.split()[0])
+        # registered first, in case the handler's callback answers before it returns
+        self.deferred_requests[self.request_id] = (command, started)
+        response = self.dispatch_request(request)
+        if response is not None:
+            del self.deferred_requests[self.request_id]
+            self.record_request(command, started)
+        return response
+
+    def record_request(self, command, started):
+        metrics.increment("requests_total", command)
+        metrics.observe("request_seconds", time.perf_counter() - started, command)
+
+    def dispatch_request(self, request):
+        # get the type of message
+        requestCommand = request.split()[0]
+        
+        # charge the request to its rate limit before doing any work for it
+        retry_after = self.check_rate_limit(requestCommand)
+        if retry_after:
+            response = self.process_rate_limited(requestCommand, retry_after)
+            display_response(response)
+            return response
+
+        # handle message from the client
+        if requestCommand == '[loginusername]':
+            log.debug("[recv] New login request for user: %s", request.split()[1])
+            response = self.process_username(request.split()[1])
             
-            # handle message from the client
-            if requestCommand == '[loginusername]':
-                print("[recv] New login request for user: " + request.split()[1])
-                response = self.process_username(request.split()[1])
-                
-            elif requestCommand == '[loginpassword]':
-                print("[recv] New password attempt for user: " + self.username)
-                response = self.process_password(request)
-                         
-            elif requestCommand == '/msgto':
-                print("[recv] New message send attempt by user: " + self.username)
-                response = self.process_msgto(request)
-                
-            elif requestCommand == '/activeuser':
-                print("[recv] New active user request by user: " + self.username)
-                response = self.process_activeuser()
-                
-            elif requestCommand == '/creategroup':
-                print("[recv] New create group user request by user: " + self.username)
-                response = self.process_creategroup(request)
-                
-            elif requestCommand == '/joingroup':
-                print("[recv] New create group join request by user: " + self.username)
-                response = self.process_joingroup(request)
-                
-            elif requestCommand == '/groupmsg':
-                print("[recv] New create group message request by user: " + self.username)
-                response = self.process_groupmsg(request)
-                
-            elif requestCommand == '/logout':
-                print("[recv] New logout request by user: " + self.username)
-                response = self.end_client_session()
-                
-            else:
-                response = self.process_invalid_command()
+        elif requestCommand == '[loginpassword]':
+            log.debug("[recv] New password attempt for user: %s", self.username)
+            response = self.process_password(request)
+                     
+        elif requestCommand == '/msgto':
+            log.debug("[recv] New message send attempt by user: %s", self.username)
+            response = self.process_msgto(request)
+            
+        elif requestCommand == '/activeuser':
+            log.debug("[recv] New active user request by user: %s", self.username)
+            response = self.process_activeuser()
             
+        elif requestCommand == '/creategroup':
+            log.debug("[recv] New create group user request by user: %s", self.username)
+            response = self.process_creategroup(request)
+            
+        elif requestCommand == '/joingroup':
+            log.debug("[recv] New create group join request by user: %s", self.username)
+            response = self.process_joingroup(request)
+            
+        elif requestCommand == '/groupmsg':
+            log.debug("[recv] New create group message request by user: %s", self.username)
+            response = self.process_groupmsg(request)
+            
+        elif requestCommand == '/grouphistory':
+            log.debug("[recv] New group history request by user: %s", self.username)
+            response = self.process_grouphistory(request)
+            
+        elif requestCommand == '/logout':
+            log.debug("[recv] New logout request by user: %s", self.username)
+            response = self.end_client_session()
+            
+        elif requestCommand == '/heartbeat':
+            response = self.process_heartbeat()
+            
+        elif requestCommand == '/metrics':
+            log.debug("[recv] New metrics request by user: %s", self.username)
+            response = self.process_metrics()
+            
+        else:
+            response = self.process_invalid_command()
+        
+        if response is not None:
             display_response(response)
-            self.client_socket.send(response.encode())
+        return response
+
+    def complete_request(self, request_id, response):
+        """Send the response of a request whose handler returned None."""
+        deferred = self.deferred_requests.pop(request_id, None)
+        if deferred is not None:
+            self.record_request(*deferred)
+        display_response(response)
+        self.send_raw(self.codec.frame(response, request_id))
     
     #################### HELPER FUNCTIONS ####################
+    def check_rate_limit(self, command):
+        # per-user buckets only once the password has been accepted
+        username = self.username if threads.get(self.username) is self else None
+        return rate_limiter.check(command, username, self.connection_buckets)
+
     def end_client_session(self):
-        print("===== the user disconnected - ", client_address)
+        log.info("The user disconnected - %s", self.client_address)
         self.client_alive = False
 
         global active_users
-        active_users.pop(self.username, None)
-        
         global threads
-        threads.pop(self.username, None)
-
-        update_user_log(self.username)
+        if broker_link is None:
+            active_users.logout(self.username)
+            threads.pop(self.username, None)
+        elif threads.get(self.username) is self:
+            # a newer login of this user may live on another worker, the broker sorts that out
+            threads.pop(self.username)
+            active_users.logout(self.username)
+            broker_link.send(["logout", self.username])
 
         return generate_response("logout", SUCCESS, "Logout successful. Goodbye!")
 
+    def replay_mailbox(self):
+        # in a worker, the broker owns the mailbox and replays it when it sees the login
+        if broker_link is not None:
+            return
+        # everything stored while we were offline goes out as one write after the login response
+        pending = mailbox.take(self.username)
+        if pending:
+            log.debug("Delivering %d stored message(s) to %s", len(pending), self.username)
+            self.deferred_frames.append(stored_push_frames(pending, self.codec))
+
     def is_user_blocked(self):
         if self.username == None or self.username not in blocked_users:
             return False
@@ -294,9 +636,10 @@ class ClientThread(Thread):
     #################### CUSTOM API's ####################
     def process_username(self, username):
         # check if the username is in the list of usernames, if not, then return user not found, else return user found. 
-        if username in credentials.keys():
+        password = credentials.get(username)
+        if password is not None:
             self.username = username
-            self.password = credentials.get(username)
+            self.password = password
             response = generate_response("loginusername", SUCCESS, "")
         else:
             response = generate_response("loginusername", NOT_FOUND, "Invalid Username, please try again.") 
@@ -307,34 +650,51 @@ class ClientThread(Thread):
     def process_password(self, request):
         parts = request.split()
         
-        if len(request.split()) != 4:
-            print(f"Bad password request {request}")
+        if len(parts) < 4:
+            log.warning("Bad password request %s", request)
             return generate_response("loginpassword", INTERNAL_SERVER_ERROR, "Server Error: Malformed password request")
         
         password = parts[1]
         client_ip = parts[2]
         udp_port = parts[3]
+        options = parse_login_options(parts[4:])
         
         if self.is_user_blocked(): # if the user is blocked
             self.client_alive = False
             response = generate_response("loginpassword", FORBIDDEN, "Your account is blocked due to multiple login failures. Please try again later")
             
         elif password == self.password: # if the password is correct
-            response = generate_response("loginpassword", SUCCESS, "") 
-            write_user_log(self.username, client_ip, udp_port)
-            failed_attempts[self.username] = 0
+            # an unknown codec falls back to JSON, and the response says which one is in use
+            self.codec = CODECS.get(options.get("codec"), DEFAULT_CODEC)
+            data = {"codec": self.codec.name} if "codec" in options else {}
+            # likewise compression: only what the client asked for and we know
+            if "compress" in options:
+                if options["compress"] in COMPRESSORS:
+                    self.compressor = FrameCompressor(compress_threshold)
+                data["compress"] = options["compress"] if self.compressor else "none"
+            response = generate_response("loginpassword", SUCCESS, "", data)
+            failed_attempts.pop(self.username, None)
             global threads
             threads[self.username] = self
-            active_users[self.username] = generate_formatted_time()
+            since = active_users.login(self.username, client_ip, udp_port)
+            if broker_link is not None:
+                # answer once the broker has the login, so every worker already knows about it
+                request_id = self.request_id
+                broker_link.request(["login", self.username, client_ip, udp_port, since],
+                                    lambda: self.complete_request(request_id, response))
+                return None
+            self.replay_mailbox()
             
         else: # if the password is incorrect
             response = generate_response("loginpassword", UNAUTHORIZED, "Invalid Password.")
-            failed_attempts[self.username] += 1
+            failed_attempts[self.username] = failed_attempts.get(self.username, 0) + 1
             
             if failed_attempts[self.username] == attempts_cap:
                 self.client_alive = False
-                failed_attempts[self.username] = 0
+                del failed_attempts[self.username]
                 blocked_users[self.username] = time.time()
+                if broker_link is not None:
+                    broker_link.send(["block", self.username, blocked_users[self.username]])
                 response = generate_response("loginpassword", FORBIDDEN, "Invalid Password. Your account has been blocked. Please try again later")
 
         return response
@@ -353,35 +713,48 @@ class ClientThread(Thread):
         content = parts[2]
         
         # check if the recipient exists
-        if username_to not in threads.keys():
+        if username_to not in credentials:
             # self.client_socket.send(generate_response("msgto", NOT_FOUND, "Error: Recipient Not Found!").encode())
             return generate_response("msgto", NOT_FOUND, "Error: Recipient Not Found!")
     
-        # find the client thread, send a message to that client
         timestamp = generate_formatted_time()
-        recipient_thread = threads[username_to]
-        recipient_thread.client_socket.send(generate_response("incomingmessage", SUCCESS, f"{timestamp}, {username_from}: {content}").encode()) # send the message to the recipient
+        push = generate_response("incomingmessage", SUCCESS, f"{timestamp}, {username_from}: {content}")
+        
+        # on another worker or offline - the broker routes or stores it and tells us which
+        if username_to not in threads.keys() and broker_link is not None:
+            request_id = self.request_id
+            broker_link.request(["route", username_to, push],
+                                lambda online: self.complete_request(request_id, self.msgto_response(online, username_to)))
+            write_message_log(username_to, timestamp, content)
+            return None
+
+        # hold the message until the recipient logs in
+        if username_to not in threads.keys():
+            mailbox.store(username_to, encode_json(push))
+            write_message_log(username_to, timestamp, content)
+            return self.msgto_response(False, username_to)
+    
+        # find the client thread, send a message to that client
+        recipient_session = threads[username_to]
+        recipient_session.push(push) # send the message to the recipient
         write_message_log(username_to, timestamp, content)
     
+        return self.msgto_response(True, username_to)
+
+    def msgto_response(self, online, username_to):
+        if not online:
+            return generate_response("msgto", SUCCESS, f"{username_to} is offline, message will be delivered when they log in.")
         return generate_response("msgto", SUCCESS, f"message sent at {generate_formatted_time()}.")
     
     def process_activeuser(self):
-        #assuming log file is kept correctly
         client_ips = {}
         udp_ports = {}
         messages = []
-        with open("userlog.txt", "r") as file:
-            for line in file:
-                parts = line.strip().split('; ')
-                if len(parts) < 5:  # Ensuring that each line has enough parts
-                    print("Server Error: bad userlog line")
-                    continue
-                user, timestamp, ip, port = parts[2], parts[1], parts[3], parts[4].strip()
-
-                if user != self.username:
-                    messages.append(f"{user}, active since {timestamp}. Client IP is {ip} with UDP recieving port: {port}")
-                    client_ips[user] = ip
-                    udp_ports[user] = port
+        for entry in active_users.snapshot():
+            if entry.username != self.username:
+                messages.append(f"{entry.username}, active since {entry.since}. Client IP is {entry.client_ip} with UDP recieving port: {entry.udp_port}")
+                client_ips[entry.username] = entry.client_ip
+                udp_ports[entry.username] = entry.udp_port
         
         if len(messages) == 0:
             return generate_response("activeuser", SUCCESS, "no other active user")
@@ -391,7 +764,7 @@ class ClientThread(Thread):
         
     def process_creategroup(self, request):
         global groups
-        print(request)
+        log.debug("%s", request)
         parts = request.split()
         
         if len(parts) < 3:
@@ -404,20 +777,37 @@ class ClientThread(Thread):
         # check if any of the recipients are not in active users
         global active_users
         for r in recipients:
-            if r not in active_users.keys():
+            if r not in active_users:
                 return generate_response("creategroup", NOT_FOUND, f"Error: {r} is offline, or an invalid username.")
 
         # check if the groupname already exists
         if chat_name in groups.keys():
-            return generate_response("creategroup", CONFLICT, f"Error: a group chat (Name: {chat_name}) already exist.")
+            return self.creategroup_response(False, chat_name, owner, recipients)
         
         # if the groupname is invalid (contains letters otuside of a-z, A-Z and digit 0-9)
         if not chat_name.isalnum():
             return generate_response("creategroup", CLIENT_ERROR, "Error: Group name is invalid. Use only letters and digits.")
         
+        # another worker may be creating the same name, only the broker can tell
+        if broker_link is not None:
+            request_id = self.request_id
+
+            def created(created):
+                if created:
+                    add_group(GroupChat(chat_name, owner, recipients))
+                self.complete_request(request_id, self.creategroup_response(created, chat_name, owner, recipients))
+
+            broker_link.request(["creategroup", chat_name, owner, recipients], created)
+            return None
+
         # initialise a group object
-        group = GroupChat(chat_name, owner, recipients)
-        groups[chat_name] = group
+        group = add_group(GroupChat(chat_name, owner, recipients))
+        log_writer.reset(group.log_file_name)
+        return self.creategroup_response(True, chat_name, owner, recipients)
+
+    def creategroup_response(self, created, chat_name, owner, recipients):
+        if not created:
+            return generate_response("creategroup", CONFLICT, f"Error: a group chat (Name: {chat_name}) already exist.")
         
         # Send response for success
         recipients_with_owner = [owner] + recipients
@@ -451,6 +841,8 @@ class ClientThread(Thread):
 
         # Add the user to the group and send appropriate message to client
         group.accept_invite(username)
+        if broker_link is not None:
+            broker_link.send(["join", group_name, username])
         return generate_response("joingroup", SUCCESS, f"You have successfully joined the group chat '{group_name}'.")
 
     def process_groupmsg(self, request):
@@ -479,26 +871,1122 @@ class ClientThread(Thread):
         
         timestamp = generate_formatted_time()
         
+        # build the push once, every recipient with the same codec queues the same immutable frame
+        push = generate_response("incominggroupmsg", SUCCESS, f"{timestamp}, {group_name}, {self.username}: {message}")
+        encoded = EncodedPush(push)
+        
         global threads
-        for user in group.users_joined: # for all the users invited
-            if group.has_user_joined(user): # if the user has joined
-                if user == self.username or user not in threads.keys(): # skip if self, or if they are not online
-                    continue
-                recipient_thread = threads[user]
-                recipient_thread.client_socket.send(generate_response("incominggroupmsg", SUCCESS, f"{timestamp}, {group_name}, {self.username}: {message}").encode()) # send the message to the recipient
+        remote_recipients = []
+        local_recipients = 0
+        # only the joined members who are online, however many more are invited
+        for user in list(group.online):
+            if user == self.username: # skip the sender
+                continue
+            recipient_session = threads.get(user)
+            if recipient_session is None:
+                # online on another worker or node
+                if broker_link is not None:
+                    remote_recipients.append(user)
+                continue
+            recipient_session.push_encoded(encoded) # send the message to the recipient
+            local_recipients += 1
+        metrics.observe("group_fanout", local_recipients + len(remote_recipients))
+        
+        # members connected to other workers get the push through the broker
+        if remote_recipients:
+            broker_link.send(["deliver", remote_recipients, push])
         
         group.log_message(timestamp, self.username, message)
         return generate_response("groupmsg", SUCCESS, "Group chat message sent.")
     
+    def process_grouphistory(self, request):
+        parts = request.split()
+
+        if not 2 <= len(parts) <= 4:
+            return generate_response("grouphistory", CLIENT_ERROR, "Error: Invalid command format. Usage: /grouphistory groupname [before_seq] [limit]")
+
+        group_name = parts[1]
+        try:
+            before = int(parts[2]) if len(parts) > 2 else 0
+            limit = int(parts[3]) if len(parts) > 3 else DEFAULT_HISTORY_LIMIT
+        except ValueError:
+            return generate_response("grouphistory", CLIENT_ERROR, "Error: before_seq and limit must be whole numbers.")
+        if before < 0 or not 1 <= limit <= MAX_HISTORY_LIMIT:
+            return generate_response("grouphistory", CLIENT_ERROR, f"Error: before_seq cannot be negative and limit must be between 1 and {MAX_HISTORY_LIMIT}.")
+        # a before_seq of 0 (or none) means the newest messages
+        before = before or None
+
+        global groups
+        if group_name not in groups:
+            return generate_response("grouphistory", NOT_FOUND, f"Error: The group chat {group_name} does not exist.")
+
+        group = groups[group_name]
+        if not group.is_user_invited(self.username):
+            return generate_response("grouphistory", UNAUTHORIZED, "Error: You are not in this group chat.")
+        if not group.has_user_joined(self.username):
+            return generate_response("grouphistory", UNAUTHORIZED, "Error: Please join the group before reading its history.")
+
+        if broker_link is not None:
+            # the log is kept by the broker, or in cluster mode by the group's home node
+            request_id = self.request_id
+            broker_link.request(["grouphistory", group_name, before, limit],
+                                lambda records: self.complete_request(request_id, history_response(group_name, records)))
+            return None
+        return history_response(group_name, group.read_history(before, limit))
+
+    def process_metrics(self):
+        if self.username not in admins:
+            return generate_response("metrics", FORBIDDEN, "Error: /metrics is only available to administrators.")
+        return generate_response("metrics", SUCCESS, metrics.render(buckets=False))
+
+    def process_heartbeat(self):
+        # receiving it was the point, handle_data() has already noted the activity
+        return generate_response("heartbeat", SUCCESS)
+
     def process_invalid_command(self):
         return generate_response("unknown", NOT_FOUND, "Error: Invalid command!")
+
+    def expire(self, idle):
+        log.warning("Nothing from %s for %.0fs, dropping the connection", self.username or self.client_address, idle)
+        metrics.increment("idle_disconnects_total")
+        # the reader sees the connection end and goes through end_client_session()
+        self.abort()
+
+    def process_rate_limited(self, command, retry_after):
+        # a flood being refused should not turn into a log flood; rate_limit_refused_total counts them
+        log.debug("[limit] %s from %s refused, retry in %.2fs", command, self.username or self.client_address, retry_after)
+        retry_after = round(retry_after, 3)
+        return generate_response(command.strip("/[]"), TOO_MANY_REQUESTS,
+                                 f"Error: Too many {command} requests, please try again in {retry_after} seconds.",
+                                 {"retry_after": retry_after})
     
-print("\n===== Server is running =====")
-print("===== Waiting for connection request from clients...=====")
 
+##################################################
+#                  Thread Class                  #
+##################################################
+def send_frames(client_socket, frames):
+    # scatter-gather send so shared broadcast frames are not copied per recipient
+    buffers = [memoryview(frame) for frame in frames]
+    first = 0
+    while first < len(buffers):
+        sent = client_socket.sendmsg(buffers[first:first + SENDMSG_MAX_BUFFERS])
+        while sent:
+            if sent >= len(buffers[first]):
+                sent -= len(buffers[first])
+                first += 1
+            else:
+                buffers[first] = buffers[first][sent:]
+                sent = 0
+
+class ClientThread(ClientSession, Thread):
+    """Thread-per-connection model: one OS thread blocked in recv() per client,
+    plus a writer thread draining its outbound queue."""
+    def __init__(self, client_address, client_socket):
+        # a daemon, so an open connection does not hold up shutting down
+        Thread.__init__(self, daemon=True)
+        self.client_socket = client_socket
+        ClientSession.__init__(self, client_address)
+        self.writer_thread = Thread(target=self.write_loop, daemon=True)
+
+    def create_outbound_queue(self):
+        return ThreadedOutboundQueue(outbound_max_frames, outbound_max_bytes, overflow_policy)
+
+    def close(self):
+        self.client_socket.close()
+
+    def abort(self):
+        self.outbound.close()
+        try:
+            # wakes our reader thread with an empty recv()
+            self.client_socket.shutdown(SHUT_RDWR)
+        except OSError:
+            pass
+
+    def start(self):
+        Thread.start(self)
+        self.writer_thread.start()
+
+    def write_loop(self):
+        while True:
+            batch = self.outbound.wait_batch()
+            if batch is None:
+                return
+            batch = self.prepare_batch(batch)
+            try:
+                send_frames(self.client_socket, batch)
+            except OSError:
+                self.abort()
+                return
+
+    def run(self):
+        while self.client_alive:
+            # use recv() to receive message from the client
+            try:
+                data = self.client_socket.recv(SOCKET_BUFFER_SIZE)
+            except OSError:
+                data = b''
+
+            # if the message from client is empty, the client would be off-line then set the client as offline (alive=Flase)
+            if data == b'':
+                self.end_client_session()
+                break
+            
+            try:
+                responses = self.handle_data(data)
+            except FrameError as e:
+                log.warning("Bad frame from %s: %s", self.client_address, e)
+                self.end_client_session()
+                break
+            if responses:
+                self.send_raw(responses)
+                # stop reading while the client is not keeping up with its own responses
+                self.outbound.wait_below(outbound_max_bytes)
+        
+        # let the writer flush what is queued (e.g. the logout response) first
+        self.outbound.close()
+        self.writer_thread.join()
+        self.close()
+        metrics.increment("connections_open", amount=-1)
+
+##################################################
+#               Event Loop Session               #
+##################################################
+class AsyncClientSession(ClientSession):
+    """Event-loop model: every connection is a coroutine on a single asyncio loop.
+
+    The command handlers never block on the network (they only append to
+    outbound queues), so they run inline on the loop thread; each connection
+    has a second coroutine that drains its queue into the transport.
+    """
+    def __init__(self, client_address, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        ClientSession.__init__(self, client_address)
+
+    def create_outbound_queue(self):
+        return AsyncOutboundQueue(outbound_max_frames, outbound_max_bytes, overflow_policy)
+
+    def close(self):
+        self.writer.close()
+
+    def abort(self):
+        self.outbound.close()
+        self.writer.transport.abort()
+
+    async def write_loop(self):
+        while True:
+            batch = await self.outbound.wait_batch()
+            if batch is None:
+                return
+            batch = self.prepare_batch(batch)
+            try:
+                self.writer.writelines(batch)
+                await self.writer.drain()
+            except ConnectionError:
+                self.abort()
+                return
+
+    async def run(self):
+        writer_task = asyncio.create_task(self.write_loop())
+        try:
+            await self.read_loop()
+        finally:
+            # let the writer flush what is queued (e.g. the logout response) first
+            self.outbound.close()
+            await writer_task
+            self.close()
+            metrics.increment("connections_open", amount=-1)
+
+    async def read_loop(self):
+        while self.client_alive:
+            try:
+                data = await self.reader.read(SOCKET_BUFFER_SIZE)
+            except OSError:
+                data = b''
+
+            # an empty read means the client has gone away
+            if data == b'':
+                self.end_client_session()
+                break
+            
+            try:
+                responses = self.handle_data(data)
+            except FrameError as e:
+                log.warning("Bad frame from %s: %s", self.client_address, e)
+                self.end_client_session()
+                break
+            if responses:
+                self.send_raw(responses)
+                # stop reading while the client is not keeping up with its own responses
+                await self.outbound.wait_below(outbound_max_bytes)
+            # or while the broker or other nodes are not keeping up with what it sent them
+            await drain_links(broker_links())
+
+##################################################
+#                  Broker Class                  #
+##################################################
+class Broker():
+    """Shared state of the multi-process mode, kept by the supervisor.
+
+    Workers own the client connections and keep replicas of the presence
+    table, groups and blocked users. Every change a worker makes is sent here,
+    applied to the authoritative copy (which also writes userlog.txt, the
+    message logs and the mailbox) and forwarded to the other workers. Pushes
+    for users connected to another worker are routed to that worker, or stored
+    in the mailbox if the user has gone offline.
+    """
+    def __init__(self):
+        # maps worker id to its OpLink
+        self.workers = {}
+        # maps username to the id of the worker holding the user's connection
+        self.routes = {}
+
+    async def handle_worker(self, reader, writer):
+        link = OpLink(reader, writer)
+        ops = await link.receive()
+        if not ops or ops[0][0] != "hello":
+            link.close()
+            return
+        worker_id = ops[0][1]
+        self.workers[worker_id] = link
+        log.info("Worker %s connected to the broker", worker_id)
+        link.send(["snapshot",
+                   [[entry.username, entry.client_ip, entry.udp_port, entry.since] for entry in active_users.snapshot()],
+                   [[name, group.users_joined] for name, group in groups.items()],
+                   blocked_users])
+
+        ops = ops[1:]
+        while ops is not None:
+            for op in ops:
+                self.apply(worker_id, op)
+            # stop reading from this worker while the ones it feeds are behind
+            await drain_links(self.workers.values())
+            ops = await link.receive()
+
+        # the worker is gone, and so are the users connected to it
+        log.warning("Worker %s disconnected from the broker", worker_id)
+        if self.workers.get(worker_id) is link:
+            del self.workers[worker_id]
+        for username in [username for username, route in self.routes.items() if route == worker_id]:
+            self.apply(worker_id, ["logout", username])
+
+    async def wait_disconnected(self, timeout):
+        deadline = time.monotonic() + timeout
+        while self.workers and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+
+    def send(self, worker_id, op):
+        link = self.workers.get(worker_id)
+        if link is not None:
+            link.send(op)
+
+    def broadcast(self, origin, op):
+        for worker_id, link in self.workers.items():
+            if worker_id != origin:
+                link.send(op)
+
+    def apply(self, worker_id, op):
+        kind = op[0]
+        if kind == "login":
+            _, reference, username, client_ip, udp_port, since = op
+            self.routes[username] = worker_id
+            active_users.login(username, client_ip, udp_port, since)
+            self.broadcast(worker_id, ["login", username, client_ip, udp_port, since])
+            self.send(worker_id, ["reply", reference])
+            pending = mailbox.take(username)
+            if pending:
+                self.send(worker_id, ["replay", username, [body.decode() for body in pending]])
+
+        elif kind == "logout":
+            username = op[1]
+            # ignore a stale logout from a worker the user has already moved away from
+            if self.routes.get(username) == worker_id:
+                del self.routes[username]
+                active_users.logout(username)
+                self.broadcast(worker_id, op)
+
+        elif kind == "route":
+            # a direct message: pass it to the recipient's worker, or keep it for them
+            _, reference, username, payload = op
+            route = self.routes.get(username)
+            if route is not None:
+                self.send(route, ["deliver", [username], payload])
+            else:
+                mailbox.store(username, encode_json(payload))
+            self.send(worker_id, ["reply", reference, route is not None])
+
+        elif kind == "deliver":
+            # group messages: members who are offline miss them, as with one process
+            _, usernames, payload = op
+            by_worker = {}
+            for username in usernames:
+                route = self.routes.get(username)
+                if route is not None:
+                    by_worker.setdefault(route, []).append(username)
+            for route, recipients in by_worker.items():
+                self.send(route, ["deliver", recipients, payload])
+
+        elif kind == "creategroup":
+            _, reference, name, owner, recipients = op
+            created = name not in groups
+            if created:
+                group = add_group(GroupChat(name, owner, recipients))
+                log_writer.reset(group.log_file_name)
+                self.broadcast(worker_id, ["group", name, group.users_joined])
+            self.send(worker_id, ["reply", reference, created])
+
+        elif kind == "join":
+            _, name, username = op
+            if name in groups:
+                groups[name].accept_invite(username)
+                self.broadcast(worker_id, op)
+
+        elif kind == "block":
+            _, username, blocked_at = op
+            blocked_users[username] = blocked_at
+            self.broadcast(worker_id, op)
+
+        elif kind == "msglog":
+            _, username_to, timestamp, message = op
+            record_message_log(username_to, timestamp, message)
+
+        elif kind == "grouplog":
+            _, name, timestamp, sender, message = op
+            if name in groups:
+                groups[name].record_message(timestamp, sender, message)
+
+        elif kind == "grouphistory":
+            _, reference, name, before, limit = op
+            records = groups[name].read_history(before, limit) if name in groups else []
+            self.send(worker_id, ["reply", reference, records])
+
+        else:
+            log.warning("Broker ignoring unknown op %s from worker %s", kind, worker_id)
+
+##################################################
+#                Broker Link Class               #
+##################################################
+class BrokerLink():
+    """A worker's connection to the broker.
+
+    Applies the changes other workers made to this worker's replicas and hands
+    pushes routed here to the local sessions.
+    """
+    def __init__(self, worker_id):
+        self.worker_id = worker_id
+        self.link = None
+        # set once the broker's snapshot of the shared state has been applied
+        self.ready = asyncio.Event()
+        # maps reference to the callback waiting for the broker's reply
+        self.pending = {}
+        self.last_reference = 0
+
+    async def connect(self, path):
+        reader, writer = await asyncio.open_unix_connection(path)
+        self.link = OpLink(reader, writer)
+        self.link.send(["hello", self.worker_id])
+
+    def send(self, op):
+        self.link.send(op)
+
+    def links(self):
+        return [self.link]
+
+    def request(self, op, callback):
+        """Send op with a fresh reference; callback(*result) runs when the broker replies."""
+        self.last_reference += 1
+        self.pending[self.last_reference] = callback
+        self.send([op[0], self.last_reference] + op[1:])
+
+    async def run(self):
+        while True:
+            ops = await self.link.receive()
+            if ops is None:
+                log.error("Worker %s lost the broker, shutting down", self.worker_id)
+                return
+            for op in ops:
+                self.apply(op)
+            await self.link.drain()
+
+    def apply(self, op):
+        kind = op[0]
+        if kind == "snapshot":
+            _, entries, group_members, blocked = op
+            for username, client_ip, udp_port, since in entries:
+                active_users.login(username, client_ip, udp_port, since)
+            restore_groups(group_members)
+            blocked_users.update(blocked)
+            self.ready.set()
+
+        elif kind == "login":
+            _, username, client_ip, udp_port, since = op
+            active_users.login(username, client_ip, udp_port, since)
+
+        elif kind == "logout":
+            # a login of the same user on this worker is newer than the logout
+            if op[1] not in threads:
+                active_users.logout(op[1])
+
+        elif kind == "deliver":
+            _, usernames, payload = op
+            push = EncodedPush(payload)
+            for username in usernames:
+                session = threads.get(username)
+                if session is not None:
+                    session.push_encoded(push)
+
+        elif kind == "replay":
+            _, username, payloads = op
+            session = threads.get(username)
+            if session is None:
+                # gone again before the replay arrived, back to the mailbox
+                for payload in payloads:
+                    self.request(["route", username, decode_json(payload)], lambda online: None)
+                return
+            log.debug("Delivering %d stored message(s) to %s", len(payloads), username)
+            session.send_raw(stored_push_frames([payload.encode() for payload in payloads], session.codec))
+
+        elif kind == "reply":
+            self.pending.pop(op[1])(*op[2:])
+
+        elif kind == "group":
+            _, name, users_joined = op
+            add_group(GroupChat.from_members(name, users_joined))
+
+        elif kind == "join":
+            _, name, username = op
+            if name in groups:
+                groups[name].accept_invite(username)
+
+        elif kind == "block":
+            _, username, blocked_at = op
+            blocked_users[username] = blocked_at
+
+##################################################
+#               Cluster Node Class               #
+##################################################
+class ClusterNode():
+    """This server's part in cluster mode.
+
+    Every node is a whole server with its own port and working directory, and
+    links to every other node. Each node announces the logins and logouts of
+    its own users, so every node knows who is online anywhere and on which
+    node, and /activeuser shows the whole cluster. Pushes for users on another
+    node are forwarded straight to that node; the ops queued for one node
+    during a turn of the event loop go out as one batch.
+
+    Messages for offline users stay in the mailbox of the node that received
+    them, and every node replays its share when it sees the user log in.
+    Group names are partitioned over the nodes: a group's home node decides
+    whether it can be created and writes its message log, while every node
+    keeps a replica of its members. All nodes must be given the same set of
+    node addresses so they agree on the homes.
+
+    To the local sessions the node stands in for the broker: it takes the
+    same ops as BrokerLink and answers requests through the same callbacks.
+    """
+    def __init__(self, node_id, peers):
+        # a node is known by the HOST:PORT of its cluster link
+        self.node_id = node_id
+        self.nodes = sorted(set([node_id] + peers))
+        # maps node id to the OpLink we send on, None while it is unreachable
+        self.peers = {peer: None for peer in self.nodes if peer != node_id}
+        # maps node id to the OpLink it sends to us on
+        self.inbound = {}
+        # maps username to the id of the node holding the user's connection
+        self.routes = {}
+        # maps reference to (node id, callback waiting for its reply, fallback if the node is lost)
+        self.pending = {}
+        self.last_reference = 0
+
+    def home(self, name):
+        # crc32 rather than hash(), which differs between processes
+        return self.nodes[zlib.crc32(name.encode()) % len(self.nodes)]
+
+    async def start(self):
+        host, port = split_address(self.node_id)
+        await asyncio.start_server(connection_handler(self.handle_peer), host, port)
+        for peer in self.peers:
+            asyncio.create_task(self.connect(peer))
+
+    async def connect(self, peer):
+        """Keep a link to peer open, reconnecting whenever it is lost."""
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(*split_address(peer))
+            except OSError:
+                await asyncio.sleep(CLUSTER_RETRY_DELAY)
+                continue
+            link = OpLink(reader, writer)
+            link.send(["hello", self.node_id])
+            # what the peer may have missed: our users, our groups and blocks
+            for entry in active_users.snapshot():
+                if self.routes.get(entry.username) == self.node_id:
+                    link.send(["login", entry.username, entry.client_ip, entry.udp_port, entry.since])
+            for name, group in groups.items():
+                if self.home(name) == self.node_id:
+                    link.send(["group", name, group.users_joined])
+            for username, blocked_at in blocked_users.items():
+                link.send(["block", username, blocked_at])
+            self.peers[peer] = link
+            log.info("Linked to cluster node %s", peer)
+
+            # nothing comes back on this link, reading only notices the peer going away
+            while await link.receive() is not None:
+                pass
+            self.peers[peer] = None
+            log.warning("Lost the link to cluster node %s", peer)
+            await asyncio.sleep(CLUSTER_RETRY_DELAY)
+
+    async def handle_peer(self, reader, writer):
+        link = OpLink(reader, writer)
+        ops = await link.receive()
+        if not ops or ops[0][0] != "hello" or ops[0][1] not in self.peers:
+            link.close()
+            return
+        peer = ops[0][1]
+        self.inbound[peer] = link
+
+        ops = ops[1:]
+        while ops is not None:
+            for op in ops:
+                self.apply(peer, op)
+            await drain_links(self.links())
+            ops = await link.receive()
+
+        # the node is gone, and so are the users connected to it
+        if self.inbound.get(peer) is link:
+            del self.inbound[peer]
+            self.drop_node(peer)
+
+    def drop_node(self, peer):
+        for username in [username for username, route in self.routes.items() if route == peer]:
+            del self.routes[username]
+            if username not in threads:
+                active_users.logout(username)
+        # requests the node will never answer are decided here instead
+        for reference in [reference for reference, (node, _, _) in self.pending.items() if node == peer]:
+            _, _, fallback = self.pending.pop(reference)
+            fallback()
+
+    def send_to(self, node, op):
+        """Send op to node; False if there is no link to it at the moment."""
+        link = self.peers.get(node)
+        if link is None:
+            return False
+        link.send(op)
+        return True
+
+    def links(self):
+        return [link for link in self.peers.values() if link is not None]
+
+    def broadcast(self, op, skip=None):
+        for peer, link in self.peers.items():
+            if link is not None and peer != skip:
+                link.send(op)
+
+    #################### LOCAL SESSIONS ####################
+    def send(self, op):
+        self.handle_local(op, None)
+
+    def request(self, op, callback):
+        self.handle_local(op, callback)
+
+    def handle_local(self, op, callback):
+        kind = op[0]
+        if kind == "login":
+            _, username, client_ip, udp_port, since = op
+            self.routes[username] = self.node_id
+            self.broadcast(["login", username, client_ip, udp_port, since])
+            callback()
+            # messages stored on other nodes arrive as they see the login
+            pending = mailbox.take(username)
+            if pending:
+                self.replay(username, [body.decode() for body in pending])
+
+        elif kind == "logout":
+            username = op[1]
+            if self.routes.get(username) == self.node_id:
+                del self.routes[username]
+                self.broadcast(op)
+
+        elif kind == "route":
+            _, username, payload = op
+            route = self.routes.get(username)
+            online = route is not None and self.send_to(route, ["deliver", [username], payload, True])
+            if not online:
+                mailbox.store(username, encode_json(payload))
+            callback(online)
+
+        elif kind == "deliver":
+            _, usernames, payload = op
+            by_node = {}
+            for username in usernames:
+                route = self.routes.get(username)
+                if route is not None:
+                    by_node.setdefault(route, []).append(username)
+            for route, recipients in by_node.items():
+                self.send_to(route, ["deliver", recipients, payload, False])
+
+        elif kind == "creategroup":
+            _, name, owner, recipients = op
+            home = self.home(name)
+            fallback = lambda: self.create_group(name, callback)
+            if home == self.node_id or self.peers[home] is None:
+                # our group, or its home is unreachable and this node decides alone
+                fallback()
+                return
+            self.last_reference += 1
+            self.pending[self.last_reference] = (home, callback, fallback)
+            self.send_to(home, ["creategroup", self.last_reference, name, owner, recipients])
+
+        elif kind in ("join", "block"):
+            self.broadcast(op)
+
+        elif kind == "msglog":
+            # each node numbers the direct messages its own users send
+            _, username_to, timestamp, message = op
+            record_message_log(username_to, timestamp, message)
+
+        elif kind == "grouplog":
+            _, name, timestamp, sender, message = op
+            if self.home(name) == self.node_id or not self.send_to(self.home(name), op):
+                groups[name].record_message(timestamp, sender, message)
+
+        elif kind == "grouphistory":
+            _, name, before, limit = op
+            home = self.home(name)
+            # with its home down, the messages this node logged meanwhile are what there is
+            fallback = lambda: callback(groups[name].read_history(before, limit))
+            if home == self.node_id or self.peers[home] is None:
+                fallback()
+                return
+            self.last_reference += 1
+            self.pending[self.last_reference] = (home, callback, fallback)
+            self.send_to(home, ["grouphistory", self.last_reference, name, before, limit])
+
+    def create_group(self, name, callback):
+        created = name not in groups
+        # the session's callback adds the group to groups
+        callback(created)
+        if created:
+            group = groups[name]
+            log_writer.reset(group.log_file_name)
+            self.broadcast(["group", name, group.users_joined])
+
+    def replay(self, username, payloads):
+        log.debug("Delivering %d stored message(s) to %s", len(payloads), username)
+        session = threads[username]
+        session.send_raw(stored_push_frames([payload.encode() for payload in payloads], session.codec))
+
+    #################### OTHER NODES ####################
+    def apply(self, peer, op):
+        kind = op[0]
+        if kind == "login":
+            _, username, client_ip, udp_port, since = op
+            self.routes[username] = peer
+            active_users.login(username, client_ip, udp_port, since)
+            pending = mailbox.take(username)
+            if pending:
+                self.send_to(peer, ["replay", username, [body.decode() for body in pending]])
+
+        elif kind == "logout":
+            username = op[1]
+            if self.routes.get(username) == peer:
+                del self.routes[username]
+                if username not in threads:
+                    active_users.logout(username)
+
+        elif kind == "deliver":
+            # store is set for direct messages, which must not be lost if the user has just left
+            _, usernames, payload, store = op
+            push = EncodedPush(payload)
+            for username in usernames:
+                session = threads.get(username)
+                if session is not None:
+                    session.push_encoded(push)
+                elif store:
+                    mailbox.store(username, encode_json(payload))
+
+        elif kind == "replay":
+            _, username, payloads = op
+            if username in threads:
+                self.replay(username, payloads)
+            else:
+                # gone again before the replay arrived, keep them here
+                for payload in payloads:
+                    mailbox.store(username, payload.encode())
+
+        elif kind == "creategroup":
+            # we are the group's home
+            _, reference, name, owner, recipients = op
+            created = name not in groups
+            if created:
+                group = add_group(GroupChat(name, owner, recipients))
+                log_writer.reset(group.log_file_name)
+                self.broadcast(["group", name, group.users_joined], skip=peer)
+            self.send_to(peer, ["reply", reference, created])
+
+        elif kind == "reply":
+            entry = self.pending.pop(op[1], None)
+            if entry is not None:
+                entry[1](*op[2:])
+
+        elif kind == "group":
+            _, name, users_joined = op
+            add_group(GroupChat.from_members(name, users_joined))
+
+        elif kind == "join":
+            _, name, username = op
+            if name in groups:
+                groups[name].accept_invite(username)
+
+        elif kind == "block":
+            _, username, blocked_at = op
+            blocked_users[username] = blocked_at
+
+        elif kind == "grouplog":
+            _, name, timestamp, sender, message = op
+            if name in groups:
+                groups[name].record_message(timestamp, sender, message)
+
+        elif kind == "grouphistory":
+            # we are the group's home, and keep its log
+            _, reference, name, before, limit = op
+            records = groups[name].read_history(before, limit) if name in groups else []
+            self.send_to(peer, ["reply", reference, records])
+
+        else:
+            log.warning("Cluster node ignoring unknown op %s from %s", kind, peer)
+
+##################################################
+#               Idle Connections                 #
+##################################################
+def watch_idle(session):
+    """Have the idle timer look at session once its timeout since its last activity is up."""
+    if idle_timers is None:
+        return
+    with idle_timers_lock:
+        idle_timers.schedule(session.last_activity + idle_timeout, session)
+
+def check_idle_sessions():
+    now = time.monotonic()
+    with idle_timers_lock:
+        due = idle_timers.advance(now)
+    for session in due:
+        if not session.client_alive:
+            # closed since it was scheduled, the timer just lapses
+            continue
+        idle = now - session.last_activity
+        if idle >= idle_timeout:
+            session.expire(idle)
+        else:
+            # active since, look again when its time is up counting from then
+            watch_idle(session)
+
+async def run_idle_checks():
+    while True:
+        await asyncio.sleep(idle_timers.tick)
+        check_idle_sessions()
+
+def start_idle_checks():
+    # in the event loop modes the checks run on the loop, like the sessions they abort;
+    # the caller holds on to the task, as the loop only keeps a weak reference
+    if idle_timers is not None:
+        return asyncio.create_task(run_idle_checks())
+
+def start_idle_check_thread():
+    def run():
+        while True:
+            time.sleep(idle_timers.tick)
+            check_idle_sessions()
+
+    if idle_timers is not None:
+        Thread(target=run, name="idle-checks", daemon=True).start()
+
+##################################################
+#                  Server Loops                  #
+##################################################
+def serve_threaded(server_socket):
+    start_idle_check_thread()
+    while True:
+        server_socket.listen(LISTEN_BACKLOG)
+        clientSockt, client_address = server_socket.accept()
+        clientThread = ClientThread(client_address, clientSockt)
+        clientThread.start()
+
+def cancel_on_signal():
+    # on an event loop, SIGTERM cancels the serving task as Ctrl-C does, rather
+    # than raising in whatever callback the loop happens to be running
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+
+async def serve_async(server_socket):
+    async def on_connect(reader, writer):
+        session = AsyncClientSession(writer.get_extra_info("peername"), reader, writer)
+        await session.run()
+
+    cancel_on_signal()
+    idle_task = start_idle_checks()
+    server_socket.listen(LISTEN_BACKLOG)
+    server = await asyncio.start_server(connection_handler(on_connect), sock=server_socket, backlog=LISTEN_BACKLOG)
+    async with server:
+        await server.serve_forever()
+
+def broker_socket_path(server_port):
+    return f"tessenger-broker-{server_port}.sock"
+
+async def serve_worker(server_socket, worker_id, broker_path):
+    global broker_link
+    cancel_on_signal()
+    broker_link = BrokerLink(worker_id)
+    await broker_link.connect(broker_path)
+    link_task = asyncio.create_task(broker_link.run())
+    await broker_link.ready.wait()
+
+    async def on_connect(reader, writer):
+        session = AsyncClientSession(writer.get_extra_info("peername"), reader, writer)
+        await session.run()
+
+    idle_task = start_idle_checks()
+    server_socket.listen(LISTEN_BACKLOG)
+    server = await asyncio.start_server(connection_handler(on_connect), sock=server_socket, backlog=LISTEN_BACKLOG)
+    async with server:
+        # serve for as long as the broker is there
+        await link_task
+
+def split_address(address):
+    host, _, port = address.rpartition(":")
+    return host, int(port)
+
+def parse_node_address(spec):
+    """Check a cluster node address given as HOST:PORT."""
+    host, _, port = spec.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError("expected HOST:PORT")
+    return spec
+
+async def serve_cluster(server_socket, node_id, peers):
+    global broker_link
+    cancel_on_signal()
+    broker_link = ClusterNode(node_id, peers)
+    await broker_link.start()
+    await serve_async(server_socket)
+
+async def run_broker(server_port, workers, argv):
+    cancel_on_signal()
+    broker = Broker()
+    path = broker_socket_path(server_port)
+    if os.path.exists(path):
+        os.remove(path)
+    server = await asyncio.start_unix_server(connection_handler(broker.handle_worker), path)
+
+    async def supervise(worker_id):
+        # workers are this script again, told which one they are
+        while True:
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__), *argv, "--worker-id", str(worker_id))
+            try:
+                status = await process.wait()
+            except asyncio.CancelledError:
+                # shutting down: the worker goes first, so its link ends before the loop does
+                try:
+                    process.terminate()
+                except ProcessLookupError:
+                    pass
+                await process.wait()
+                raise
+            log.error("Worker %s exited with status %s, restarting it", worker_id, status)
+            await asyncio.sleep(WORKER_RESTART_DELAY)
+
+    async with server:
+        try:
+            await asyncio.gather(*[supervise(worker_id) for worker_id in range(workers)])
+        except asyncio.CancelledError:
+            # apply whatever the stopped workers sent last before the logs are closed
+            await broker.wait_disconnected(WORKER_STOP_TIMEOUT)
+            raise
+
+##################################################
+#                      MAIN                      #
+##################################################
+def parse_args(argv):
+    parser = argparse.ArgumentParser(usage="python3 TCPServer3.py SERVER_PORT ATTEMPTS_BEFORE_LOCK [--threaded | --workers N | --cluster-link HOST:PORT --cluster-peer HOST:PORT ...]")
+    parser.add_argument("server_port", type=int)
+    parser.add_argument("attempts_cap")
+    parser.add_argument("--threaded", action="store_true",
+                        help="use one OS thread per connection instead of the asyncio event loop")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="serve from this many processes sharing the port, with a broker for the shared state")
+    parser.add_argument("--worker-id", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--cluster-link", type=parse_node_address, metavar="HOST:PORT",
+                        help="run as a cluster node, linking to the other nodes on this address; give each node its own directory")
+    parser.add_argument("--cluster-peer", action="append", type=parse_node_address, default=[], metavar="HOST:PORT",
+                        help="cluster link address of another node; repeat for every node in the cluster")
+    parser.add_argument("--log-flush-interval", type=float, default=DEFAULT_FLUSH_INTERVAL,
+                        help="seconds the log writer waits to batch message log lines (default %(default)s)")
+    parser.add_argument("--log-fsync", choices=FSYNC_POLICIES, default=DEFAULT_FSYNC_POLICY,
+                        help="when message logs are fsynced: never, once per batch (group commit) or on an interval; "
+                             "replies do not wait for it, so this only bounds what a crash loses")
+    parser.add_argument("--outbound-queue-size", type=int, default=DEFAULT_MAX_FRAMES,
+                        help="pushes queued per connection before the overflow policy applies (default %(default)s)")
+    parser.add_argument("--mailbox-dir", default=MAILBOX_DIR,
+                        help="directory holding messages for offline users (default %(default)s)")
+    parser.add_argument("--group-dir", default=GROUP_STATE_DIR,
+                        help="directory holding the group journal and snapshots (default %(default)s)")
+    parser.add_argument("--credentials-reload", type=float, default=DEFAULT_RELOAD_INTERVAL,
+                        help="seconds between checks of credentials.txt for changes, 0 to disable (default %(default)s)")
+    parser.add_argument("--rate-limit", action="append", type=parse_limit, default=[], metavar="CLASS=RATE/BURST",
+                        help="token bucket for a command class (login, message, group, query, membership, other); repeatable, classes without one are not limited")
+    parser.add_argument("--admin", action="append", default=[], metavar="USERNAME",
+                        help="user allowed to run /metrics; repeatable")
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve metrics as plain text on http://127.0.0.1:PORT/metrics; with --workers, worker N uses PORT+1+N")
+    parser.add_argument("--log-level", choices=LOG_LEVELS, default=DEFAULT_LOG_LEVEL,
+                        help="lowest level logged; debug adds a line per request and response (default %(default)s)")
+    parser.add_argument("--compress-threshold", type=int, default=DEFAULT_COMPRESS_THRESHOLD, metavar="BYTES",
+                        help="write batches smaller than this go out uncompressed to clients that asked for compression (default %(default)s)")
+    parser.add_argument("--overflow-policy", choices=OVERFLOW_POLICIES, default=DEFAULT_OVERFLOW_POLICY,
+                        help="what to do when a slow recipient's queue is full (default %(default)s)")
+    parser.add_argument("--idle-timeout", type=float, default=DEFAULT_IDLE_TIMEOUT, metavar="SECONDS",
+                        help="drop connections that send nothing, not even a heartbeat, for this long; 0 to disable (default %(default)s)")
+    return parser.parse_args(argv)
+
+def load_credentials(reload_interval):
+    # accounts are looked up on demand, and the store follows edits to credentials.txt
+    global credentials
+    credentials = CredentialStore(CREDENTIALS_FILE)
+    credentials.open()
+    credentials.start(reload_interval)
+
+def stop_on_signal(signum, frame):
+    # --threaded: unwinds the accept loop through main()'s finally, as Ctrl-C does
+    raise SystemExit(0)
+
+def shutdown(log_listener):
+    """Stop the background writers, last started first, writing out whatever they still hold."""
+    if group_store is not None:
+        group_store.stop()
+    mailbox.close()
+    # writes and fsyncs every queued log line before returning
+    log_writer.stop()
+    active_users.stop()
+    if credentials is not None:
+        credentials.close()
+    log.info("Server stopped")
+    log_listener.stop()
+
+def main(argv):
+    global attempts_cap
+    if len(argv) < 2:
+        print("\n===== Error usage, python3 TCPServer3.py SERVER_PORT ATTEMPTS_BEFORE_LOCK ======\n")
+        exit(0)
+    args = parse_args(argv)
+    
+    try:
+        attempts_cap = int(args.attempts_cap)
+    except ValueError:
+        print("Error: ATTEMPTS_BEFORE_LOCK must be an integer.")
+        sys.exit(1)
+
+    if not 1 <= attempts_cap <= 5:
+        print(f"Error: Invalid number of allowed failed consecutive attempt: {attempts_cap}")
+        sys.exit(1)
+
+    if args.workers and args.threaded:
+        print("Error: --workers runs an event loop in every worker and cannot be combined with --threaded.")
+        sys.exit(1)
+
+    if args.cluster_link and (args.threaded or args.workers):
+        print("Error: a cluster node serves from one event loop and cannot be combined with --threaded or --workers.")
+        sys.exit(1)
+
+    if args.cluster_peer and not args.cluster_link:
+        print("Error: --cluster-peer needs --cluster-link, the address other nodes reach this one on.")
+        sys.exit(1)
+
+    log_listener = setup_logging(args.log_level)
+    signal.signal(signal.SIGTERM, stop_on_signal)
+    try:
+        run(args, argv)
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    finally:
+        shutdown(log_listener)
+
+def run(args, argv):
+    global log_writer
+    global outbound_max_frames, overflow_policy
+    global mailbox
+    global group_store
+    global rate_limiter
+    global admins
+    global compress_threshold
+    global idle_timeout, idle_timers
+    outbound_max_frames = args.outbound_queue_size
+    overflow_policy = args.overflow_policy
+
+    load_credentials(args.credentials_reload)
+    rate_limiter = RateLimiter(dict(args.rate_limit))
+    admins = set(args.admin)
+    compress_threshold = args.compress_threshold
+    if args.idle_timeout > 0:
+        idle_timeout = args.idle_timeout
+        idle_timers = TimerWheel(time.monotonic())
+
+    register_collected_metrics()
+    if args.metrics_port:
+        metrics_port = args.metrics_port
+        if args.worker_id is not None:
+            metrics_port += 1 + args.worker_id
+        metrics.serve(metrics_port)
+
+    # define socket for the server side and bind address
+    server_host = "127.0.0.1"
+    server_address = (server_host, args.server_port)
+
+    if args.worker_id is not None:
+        # a worker of --workers: it shares the port, the broker keeps the shared state and logs
+        server_socket = socket(AF_INET, SOCK_STREAM)
+        server_socket.setsockopt(SOL_SOCKET, SO_REUSEPORT, 1)
+        server_socket.bind(server_address)
+        asyncio.run(serve_worker(server_socket, args.worker_id, broker_socket_path(args.server_port)))
+        return
+
+    # resets userlog.txt and starts rewriting it in the background
+    active_users.start()
+
+    #reset message log
+    with open(MESSAGE_LOG_FILE, 'w') as file:
+        pass
+    log_writer = LogWriter(args.log_flush_interval, args.log_fsync)
+    log_writer.start()
+
+    # unlike the logs, stored messages survive a restart
+    mailbox = Mailbox(args.mailbox_dir)
+    mailbox.open()
+
+    # so do groups, and their logs are carried on rather than truncated
+    group_store = recover_groups(args.group_dir)
+    group_store.start()
+
+    if args.workers:
+        log.info("Server is running with %d workers", args.workers)
+        asyncio.run(run_broker(args.server_port, args.workers, argv))
+        return
+
+    server_socket = socket(AF_INET, SOCK_STREAM)
+    server_socket.bind(server_address)
+
+    log.info("Server is running")
+    log.info("Waiting for connection request from clients...")
+
+    if args.cluster_link:
+        log.info("Cluster node %s, %d other node(s)", args.cluster_link, len(args.cluster_peer))
+        asyncio.run(serve_cluster(server_socket, args.cluster_link, args.cluster_peer))
+    elif args.threaded:
+        serve_threaded(server_socket)
+    else:
+        asyncio.run(serve_async(server_socket))
 
-while True:
-    server_socket.listen()
-    clientSockt, client_address = server_socket.accept()
-    clientThread = ClientThread(client_address, clientSockt)
-    clientThread.start()
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,78 @@
+"""
+    Response codec microbenchmark
+    Python 3
+    Usage: python3 benchmarks/bench_codec.py [--iterations N] [--active-users N]
+    coding: utf-8
+
+    Encodes and decodes a typical response for every command type with the
+    JSON and binary codecs of codec.py and reports the time per call and the
+    payload size on the wire (the 9-byte frame header is the same for both).
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from codec import JSON_CODEC, BINARY_CODEC
+
+
+TIMESTAMP = "18 Oct 2026 14:21:20"
+
+def response(command, statusCode, clientMessage="", data={}):
+    return {"command": command, "statusCode": statusCode, "clientMessage": clientMessage, "data": data}
+
+def sample_responses(active_users):
+    users = [f"user{i}" for i in range(active_users)]
+    return [
+        ("loginusername", response("loginusername", 200)),
+        ("loginpassword", response("loginpassword", 200, "", {"codec": "binary"})),
+        ("msgto", response("msgto", 200, f"message sent at {TIMESTAMP}.")),
+        ("msgto (429)", response("msgto", 429, "Error: Too many requests, try again in 0.02 seconds.", {"retry_after": 0.0173})),
+        ("activeuser", response("activeuser", 200,
+                                "\n".join(f"{user}, active since {TIMESTAMP}. Client IP is 127.0.0.1 with UDP recieving port: {40000 + i}"
+                                          for i, user in enumerate(users)),
+                                {"client_ips": {user: "127.0.0.1" for user in users},
+                                 "udp_ports": {user: str(40000 + i) for i, user in enumerate(users)}})),
+        ("creategroup", response("creategroup", 200, "Group chat room has been created, room name: team, users in this room: alice bob carol")),
+        ("joingroup", response("joingroup", 200, "You have successfully joined the group chat 'team'.")),
+        ("groupmsg", response("groupmsg", 200, "Group chat message sent.")),
+        ("logout", response("logout", 200, "Logout successful. Goodbye!")),
+        ("incomingmessage", response("incomingmessage", 200, f"{TIMESTAMP}, alice: see you at the meeting\n")),
+        ("incominggroupmsg", response("incominggroupmsg", 200, f"{TIMESTAMP}, team, alice: see you all at the meeting\n")),
+    ]
+
+def measure(codec, sample, iterations):
+    payload = codec.encode(sample)
+    if codec.decode(payload) != sample:
+        raise AssertionError(f"{codec.name} does not round-trip {sample['command']}")
+    encode = timeit.timeit(lambda: codec.encode(sample), number=iterations) / iterations
+    decode = timeit.timeit(lambda: codec.decode(payload), number=iterations) / iterations
+    return encode, decode, len(payload)
+
+def run(iterations, active_users):
+    print(f"{'response':<18} {'codec':<7} {'encode us':>10} {'decode us':>10} {'bytes':>7}")
+    results = []
+    for name, sample in sample_responses(active_users):
+        measured = {}
+        for codec in (JSON_CODEC, BINARY_CODEC):
+            encode, decode, size = measured[codec.name] = measure(codec, sample, iterations)
+            print(f"{name:<18} {codec.name:<7} {encode * 1e6:>10.2f} {decode * 1e6:>10.2f} {size:>7}")
+        json_size = measured["json"][2]
+        binary_size = measured["binary"][2]
+        print(f"{'':<18} {'':<7} {'':>10} {'':>10} {(json_size - binary_size) * 100 / json_size:>6.0f}% smaller")
+        results.append((name, measured))
+    return results
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="JSON and binary codec cost and size per response type")
+    parser.add_argument("--iterations", type=int, default=20000,
+                        help="encodes and decodes timed per response (default %(default)s)")
+    parser.add_argument("--active-users", type=int, default=10,
+                        help="other users listed in the /activeuser response (default %(default)s)")
+    args = parser.parse_args(argv)
+    run(args.iterations, args.active_users)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
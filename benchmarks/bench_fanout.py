@@ -0,0 +1,142 @@
+"""
+    Group message fan-out microbenchmark
+    Python 3
+    Usage: python3 benchmarks/bench_fanout.py [--sizes 10,100,1000,10000] [--messages N] [--invited N]
+    coding: utf-8
+
+    Runs process_groupmsg against in-memory sessions (no sockets) for groups of
+    different sizes and reports server CPU time per message and per recipient.
+    Each change is timed against the path it replaced:
+      "per-recipient" re-encodes the push for every member, as fan-out used to;
+      "member-walk" encodes once but still walks every joined member;
+      "online-index" is the current process_groupmsg, walking only the online
+      members. The encode-once ratio is per-recipient over member-walk, the
+    index ratio member-walk over online-index. With --invited, each group also
+    has that many joined members who are offline, which only the index skips.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import TCPServer3 as server
+from protocol import encode_push
+from codec import encode_json
+from outbound import ThreadedOutboundQueue
+
+
+class BenchSession(server.ClientSession):
+    """Session whose outbound queue is simply emptied by the benchmark."""
+    def __init__(self, username):
+        server.ClientSession.__init__(self, ("bench", 0))
+        self.username = username
+
+    def create_outbound_queue(self):
+        return ThreadedOutboundQueue(max_frames=1 << 30, max_bytes=1 << 40)
+
+    def close(self):
+        pass
+
+    def abort(self):
+        pass
+
+def per_recipient_groupmsg(session, group_name, message):
+    # the fan-out loop before encode-once, kept here as the baseline
+    group = server.groups[group_name]
+    timestamp = server.generate_formatted_time()
+    for user in group.users_joined:
+        if group.has_user_joined(user):
+            if user == session.username or user not in server.threads.keys():
+                continue
+            recipient_session = server.threads[user]
+            recipient_session.push_frame(encode_push(encode_json(server.generate_response(
+                "incominggroupmsg", server.SUCCESS, f"{timestamp}, {group_name}, {session.username}: {message}"))))
+    group.log_message(timestamp, session.username, message)
+
+def member_walk_groupmsg(session, group_name, message):
+    # encode-once over every joined member, before the online-member index
+    group = server.groups[group_name]
+    timestamp = server.generate_formatted_time()
+    encoded = server.EncodedPush(server.generate_response(
+        "incominggroupmsg", server.SUCCESS, f"{timestamp}, {group_name}, {session.username}: {message}"))
+    for user in group.users_joined:
+        if group.has_user_joined(user):
+            if user == session.username or user not in server.threads.keys():
+                continue
+            server.threads[user].push_encoded(encoded)
+    group.log_message(timestamp, session.username, message)
+
+def build_group(size, invited):
+    for username in list(server.threads):
+        server.active_users.logout(username)
+    server.threads.clear()
+    server.groups.clear()
+    server.joined_groups.clear()
+    members = [f"user{i}" for i in range(max(size, invited))]
+    sessions = [BenchSession(name) for name in members[:size]]
+    for session in sessions:
+        server.threads[session.username] = session
+        server.active_users.login(session.username, "127.0.0.1", "0")
+
+    group = server.GroupChat("benchgroup", members[0], members[1:])
+    for name in members[1:]:
+        group.accept_invite(name)
+    server.add_group(group)
+    return sessions
+
+def run(sizes, messages, invited=0):
+    request = "/groupmsg benchgroup " + "hello everyone, this is a benchmark message\n"
+    message = request.split(' ', 2)[2]
+    variants = {
+        "per-recipient": lambda sender: per_recipient_groupmsg(sender, "benchgroup", message),
+        "member-walk": lambda sender: member_walk_groupmsg(sender, "benchgroup", message),
+        "online-index": lambda sender: sender.process_groupmsg(request),
+    }
+    results = []
+    for size in sizes:
+        sessions = build_group(size, invited)
+        sender = sessions[0]
+        # keep the total amount of work per size roughly constant
+        rounds = max(5, messages * 10 // size)
+
+        timings = {}
+        for variant, send in variants.items():
+            start = time.process_time()
+            for _ in range(rounds):
+                send(sender)
+                for session in sessions:
+                    session.outbound.take_batch()
+            timings[variant] = (time.process_time() - start) / rounds
+
+        results.append((size, rounds, timings))
+        columns = "  ".join(f"{variant} {timings[variant] * 1e6:>10.1f} us/msg ({timings[variant] * 1e9 / size:>6.0f} ns/recipient)"
+                            for variant in variants)
+        print(f"{size:>6} online  {rounds:>5} msgs  {columns}  "
+              f"encode-once x{timings['per-recipient'] / timings['member-walk']:.2f}  "
+              f"index x{timings['member-walk'] / timings['online-index']:.2f}")
+    return results
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Group message fan-out CPU cost")
+    parser.add_argument("--sizes", default="10,100,1000,10000",
+                        help="comma separated group sizes (default %(default)s)")
+    parser.add_argument("--messages", type=int, default=1000,
+                        help="messages sent to a 10 member group; larger groups get proportionally fewer")
+    parser.add_argument("--invited", type=int, default=0,
+                        help="members per group in total, the ones beyond the group size being offline")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        server.log_writer.start()
+        try:
+            run(sizes, args.messages, args.invited)
+        finally:
+            server.log_writer.stop()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
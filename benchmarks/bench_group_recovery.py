@@ -0,0 +1,69 @@
+"""
+    Group state recovery benchmark
+    Python 3
+    Usage: python3 benchmarks/bench_group_recovery.py [--groups N] [--members N] [--journal-fraction F]
+    coding: utf-8
+
+    Fills a group store in a temporary directory with groups of the given size,
+    snapshots all but the last fraction of them (which stay in the journal, as
+    they would between two snapshots) and times what the server does at
+    startup, through the same recover_groups() call: loading the snapshot,
+    replaying the journal tail, rebuilding the GroupChat objects and indexing
+    their members.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import TCPServer3 as server
+from group_store import GroupStore
+
+
+def fill(directory, groups, members, journal_fraction):
+    store = GroupStore(directory)
+    store.open()
+    snapshotted = int(groups * (1 - journal_fraction))
+    for number in range(groups):
+        if number == snapshotted:
+            store.snapshot()
+        usernames = [f"user{(number + offset) % 100000}" for offset in range(members)]
+        users_joined = {username: True for username in usernames[:1]}
+        users_joined.update((username, False) for username in usernames[1:])
+        store.create(f"group{number}", users_joined)
+        # half the invited members have joined since
+        for username in usernames[1:members // 2 + 1]:
+            store.join(f"group{number}", username)
+    store.journal.close()
+
+def recover(directory):
+    server.groups.clear()
+    server.joined_groups.clear()
+    started = time.perf_counter()
+    store = server.recover_groups(directory)
+    seconds = time.perf_counter() - started
+    store.journal.close()
+    return len(server.groups), seconds
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Startup time of the group store")
+    parser.add_argument("--groups", type=int, default=100000, help="groups to recover (default %(default)s)")
+    parser.add_argument("--members", type=int, default=5, help="members per group (default %(default)s)")
+    parser.add_argument("--journal-fraction", type=float, default=0.1,
+                        help="share of the groups only in the journal, not the snapshot (default %(default)s)")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        fill(directory, args.groups, args.members, args.journal_fraction)
+        sizes = {name: os.path.getsize(os.path.join(directory, name)) for name in sorted(os.listdir(directory))}
+        count, seconds = recover(directory)
+
+    for name, size in sizes.items():
+        print(f"{name:<20} {size / 1e6:>8.2f} MB")
+    print(f"{count} groups recovered in {seconds * 1e3:.0f} ms")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,472 @@
+"""
+    Headless load generator for TCPServer3.py
+    Python 3
+    Usage: python3 benchmarks/loadgen.py [--spawn | --port PORT --credentials FILE] [options]
+    coding: utf-8
+
+    Simulates many users over localhost with the real framed wire protocol:
+    every user logs in ([loginusername]/[loginpassword]), joins a group, then
+    issues a configurable mix of /msgto, /groupmsg, /activeuser, /creategroup and
+    /joingroup at a configurable rate. Reports throughput and p50/p99/p999
+    latency per command, plus delivery latency of incomingmessage and
+    incominggroupmsg pushes, and writes the numbers to a JSON results file that a
+    later run can be compared against with --compare.
+
+    Examples:
+        python3 benchmarks/loadgen.py --spawn --users 2000 --duration 30
+        python3 benchmarks/loadgen.py --spawn --server-args=--threaded --output threaded.json
+        python3 benchmarks/loadgen.py --spawn --compare baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from protocol import FrameDecoder, encode_frame, next_request_id, FLAG_PUSH, NO_REQUEST_ID, RECV_BUFFER_SIZE
+from codec import decode_payload, CODECS, DEFAULT_CODEC
+from compression import FrameDecompressor, COMPRESSORS
+
+
+##################################################
+#                    CONSTANTS                   #
+##################################################
+DEFAULT_MIX = "msgto=50,groupmsg=30,activeuser=5,creategroup=5,joingroup=10"
+MIX_COMMANDS = ("msgto", "groupmsg", "activeuser", "creategroup", "joingroup")
+
+SUCCESS = 200
+CONFLICT = 409
+
+# Connections opened at once while ramping up
+CONNECT_CONCURRENCY = 200
+SERVER_START_TIMEOUT = 10.0
+# Marker placed in message bodies so receivers can compute delivery latency
+SENT_AT_MARKER = "sent@"
+
+
+##################################################
+#                   Statistics                   #
+##################################################
+class LatencyRecorder():
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+
+    def record(self, command, seconds):
+        self.samples.setdefault(command, []).append(seconds)
+
+    def error(self, command):
+        self.errors[command] = self.errors.get(command, 0) + 1
+
+    def summary(self, duration):
+        results = {}
+        for command in sorted(set(self.samples) | set(self.errors)):
+            samples = sorted(self.samples.get(command, []))
+            results[command] = {
+                "count": len(samples),
+                "errors": self.errors.get(command, 0),
+                "throughput_per_s": len(samples) / duration if duration else 0.0,
+                "mean_ms": 1000 * sum(samples) / len(samples) if samples else None,
+                "p50_ms": percentile(samples, 0.50),
+                "p99_ms": percentile(samples, 0.99),
+                "p999_ms": percentile(samples, 0.999),
+                "max_ms": 1000 * samples[-1] if samples else None,
+            }
+        return results
+
+def percentile(sorted_samples, fraction):
+    if not sorted_samples:
+        return None
+    index = min(len(sorted_samples) - 1, int(fraction * len(sorted_samples)))
+    return 1000 * sorted_samples[index]
+
+
+##################################################
+#                 Simulated User                 #
+##################################################
+class SimulatedUser():
+    def __init__(self, index, username, password, run):
+        self.index = index
+        self.username = username
+        self.password = password
+        self.run = run
+        self.group = None
+        self.reader = None
+        self.writer = None
+        self.decoder = FrameDecoder()
+        self.decompressor = FrameDecompressor()
+        # maps request id to the future waiting for its response
+        self.waiting = {}
+        self.last_request_id = NO_REQUEST_ID
+        self.reader_task = None
+
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.reader_task = asyncio.create_task(self.read_loop())
+
+    async def read_loop(self):
+        try:
+            while True:
+                data = await self.reader.read(RECV_BUFFER_SIZE)
+                if not data:
+                    break
+                for request_id, flags, payload in self.decompressor.expand(self.decoder.feed(data)):
+                    self.dispatch(request_id, flags, decode_payload(flags, payload))
+        except (ConnectionError, OSError):
+            pass
+        for future in self.waiting.values():
+            if not future.done():
+                future.set_exception(ConnectionError("connection closed"))
+        self.waiting.clear()
+
+    def dispatch(self, request_id, flags, response):
+        if flags & FLAG_PUSH:
+            self.run.record_delivery(response.get("command"), response.get("clientMessage", ""))
+            return
+        future = self.waiting.pop(request_id, None)
+        if future is not None and not future.done():
+            future.set_result(response)
+
+    async def request(self, command, line):
+        self.last_request_id = next_request_id(self.last_request_id)
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[self.last_request_id] = future
+        started = time.perf_counter()
+        self.writer.write(encode_frame(line.encode(), self.last_request_id))
+        try:
+            response = await future
+        except ConnectionError:
+            self.run.stats.error(command)
+            raise
+        elapsed = time.perf_counter() - started
+
+        status = response.get("statusCode")
+        # joining a group twice is expected in the mix and still exercises the handler
+        if status == SUCCESS or (command == "joingroup" and status == CONFLICT):
+            self.run.stats.record(command, elapsed)
+        else:
+            self.run.stats.error(command)
+        return response
+
+    async def login(self):
+        response = await self.request("loginusername", f"[loginusername] {self.username}")
+        if response.get("statusCode") != SUCCESS:
+            raise RuntimeError(f"{self.username}: {response.get('clientMessage')}")
+        options = f"codec={self.run.args.codec}" + (f" compress={COMPRESSORS[0]}" if self.run.args.compress else "")
+        response = await self.request("loginpassword", f"[loginpassword] {self.password} 127.0.0.1 {40000 + self.index % 20000} {options}")
+        if response.get("statusCode") != SUCCESS:
+            raise RuntimeError(f"{self.username}: {response.get('clientMessage')}")
+
+    def message_body(self):
+        return f"{SENT_AT_MARKER}{time.perf_counter():.6f} {'x' * self.run.args.message_size}"
+
+    async def issue(self, command):
+        run = self.run
+        if command == "msgto":
+            peer = run.users[random.randrange(len(run.users))]
+            await self.request(command, f"/msgto {peer.username} {self.message_body()}\n")
+        elif command == "groupmsg":
+            await self.request(command, f"/groupmsg {self.group} {self.message_body()}\n")
+        elif command == "activeuser":
+            await self.request(command, "/activeuser")
+        elif command == "creategroup":
+            members = " ".join(random.choice(run.users).username for _ in range(2))
+            await self.request(command, f"/creategroup {run.next_group_name()} {members}")
+        elif command == "joingroup":
+            await self.request(command, f"/joingroup {self.group}")
+
+    async def steady_state(self, deadline):
+        # Poisson arrivals at the configured per-user rate, one request in flight
+        run = self.run
+        while True:
+            pause = random.expovariate(run.args.rate)
+            if time.perf_counter() + pause >= deadline:
+                break
+            await asyncio.sleep(pause)
+            await self.issue(run.pick_command())
+
+    async def logout(self):
+        try:
+            await self.request("logout", "/logout")
+        except ConnectionError:
+            pass
+        self.writer.close()
+
+
+##################################################
+#                   Load Run                     #
+##################################################
+class LoadRun():
+    def __init__(self, args, accounts):
+        self.args = args
+        self.stats = LatencyRecorder()
+        self.deliveries = LatencyRecorder()
+        self.users = [SimulatedUser(index, username, password, self)
+                      for index, (username, password) in enumerate(accounts[:args.users])]
+        self.mix = parse_mix(args.mix)
+        self.mix_commands = list(self.mix)
+        self.mix_weights = [self.mix[command] for command in self.mix_commands]
+        self.group_counter = 0
+
+    def pick_command(self):
+        return random.choices(self.mix_commands, self.mix_weights)[0]
+
+    def next_group_name(self):
+        self.group_counter += 1
+        return f"lg{os.getpid()}g{self.group_counter}"
+
+    def record_delivery(self, command, client_message):
+        marker = client_message.find(SENT_AT_MARKER)
+        if marker < 0:
+            return
+        end = client_message.find(" ", marker)
+        try:
+            sent_at = float(client_message[marker + len(SENT_AT_MARKER):end if end > 0 else None])
+        except ValueError:
+            return
+        self.deliveries.record(command, time.perf_counter() - sent_at)
+
+    async def connect_all(self):
+        semaphore = asyncio.Semaphore(CONNECT_CONCURRENCY)
+
+        async def connect(user):
+            async with semaphore:
+                await user.connect(self.args.host, self.args.port)
+                await user.login()
+
+        await asyncio.gather(*[connect(user) for user in self.users])
+
+    async def setup_groups(self):
+        # partition users into groups; owners create, members join
+        size = max(2, self.args.group_size)
+        groups = [self.users[start:start + size] for start in range(0, len(self.users), size)]
+        creates = []
+        for members in groups:
+            name = self.next_group_name()
+            for user in members:
+                user.group = name
+            if len(members) > 1:
+                invitees = " ".join(user.username for user in members[1:])
+                creates.append(members[0].request("creategroup", f"/creategroup {name} {invitees}"))
+        await asyncio.gather(*creates)
+        await asyncio.gather(*[user.request("joingroup", f"/joingroup {user.group}")
+                               for members in groups for user in members[1:]])
+
+    async def execute(self):
+        # each phase records into its own recorder so only the steady state counts towards the mix
+        started = time.perf_counter()
+        await self.connect_all()
+        login_seconds = time.perf_counter() - started
+        login_stats = self.stats
+
+        self.stats = LatencyRecorder()
+        started = time.perf_counter()
+        await self.setup_groups()
+        setup_seconds = time.perf_counter() - started
+        setup_stats = self.stats
+
+        self.stats = LatencyRecorder()
+        self.deliveries = LatencyRecorder()
+        started = time.perf_counter()
+        deadline = started + self.args.duration
+        await asyncio.gather(*[user.steady_state(deadline) for user in self.users])
+        duration = time.perf_counter() - started
+        command_stats = self.stats
+        # give in-flight pushes a moment to land
+        await asyncio.sleep(0.2)
+
+        self.stats = LatencyRecorder()
+        await asyncio.gather(*[user.logout() for user in self.users])
+        return {
+            "login_seconds": login_seconds,
+            "setup_seconds": setup_seconds,
+            "duration_seconds": duration,
+            "login": login_stats.summary(login_seconds),
+            "setup": setup_stats.summary(setup_seconds),
+            "commands": command_stats.summary(duration),
+            "deliveries": self.deliveries.summary(duration),
+        }
+
+
+##################################################
+#                 Server Handling                #
+##################################################
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+def spawn_server(args, directory):
+    accounts = [(f"loaduser{i}", f"pass{i}") for i in range(args.users)]
+    with open(os.path.join(directory, "credentials.txt"), "w") as file:
+        file.writelines(f"{username} {password}\n" for username, password in accounts)
+
+    command = [sys.executable, os.path.join(REPO_ROOT, "TCPServer3.py"), str(args.port), "5"] + args.server_args.split()
+    log = open(os.path.join(directory, "server.log"), "w")
+    process = subprocess.Popen(command, cwd=directory, stdout=log, stderr=subprocess.STDOUT,
+                               preexec_fn=raise_fd_limit)
+
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited early, see {log.name}")
+        try:
+            socket.create_connection((args.host, args.port), timeout=0.2).close()
+            return process, accounts
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("server did not start listening in time")
+
+def read_accounts(path):
+    with open(path) as file:
+        return [tuple(line.split()[:2]) for line in file if line.strip()]
+
+
+##################################################
+#                Results Handling                #
+##################################################
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        command, _, weight = part.partition("=")
+        command = command.strip().lstrip("/")
+        if command not in MIX_COMMANDS:
+            raise ValueError(f"unknown command '{command}' in mix, expected one of {', '.join(MIX_COMMANDS)}")
+        mix[command] = float(weight or 1)
+    return mix
+
+def print_table(title, summary):
+    print(f"\n{title}")
+    print(f"  {'command':<16}{'count':>9}{'errors':>8}{'ops/s':>11}{'p50 ms':>10}{'p99 ms':>10}{'p999 ms':>10}")
+    for command, row in summary.items():
+        cells = [f"{row[key]:>10.2f}" if row[key] is not None else f"{'-':>10}" for key in ("p50_ms", "p99_ms", "p999_ms")]
+        print(f"  {command:<16}{row['count']:>9}{row['errors']:>8}{row['throughput_per_s']:>11.1f}{''.join(cells)}")
+
+def compare(results, baseline, tolerance):
+    """Return a list of regressions of results against baseline."""
+    regressions = []
+    for section in ("login", "commands", "deliveries"):
+        for command, old in baseline.get(section, {}).items():
+            new = results.get(section, {}).get(command)
+            if new is None:
+                continue
+            if old["throughput_per_s"] and new["throughput_per_s"] < old["throughput_per_s"] * (1 - tolerance):
+                regressions.append(f"{section}/{command}: throughput {old['throughput_per_s']:.1f} -> {new['throughput_per_s']:.1f} ops/s")
+            for key in ("p50_ms", "p99_ms"):
+                if old[key] and new[key] and new[key] > old[key] * (1 + tolerance):
+                    regressions.append(f"{section}/{command}: {key} {old[key]:.2f} -> {new[key]:.2f}")
+    return regressions
+
+
+##################################################
+#                      MAIN                      #
+##################################################
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Load generator for the Tessenger server")
+    target = parser.add_argument_group("target server")
+    target.add_argument("--spawn", action="store_true",
+                        help="start TCPServer3.py in a temporary directory with generated accounts")
+    target.add_argument("--server-args", default="",
+                        help="extra arguments for a spawned server, e.g. --server-args=--threaded")
+    target.add_argument("--host", default="127.0.0.1")
+    target.add_argument("--port", type=int, default=0, help="server port (a free one when spawning)")
+    target.add_argument("--credentials", help="credentials file listing the accounts of a running server")
+
+    load = parser.add_argument_group("load shape")
+    load.add_argument("--users", type=int, default=1000, help="simulated users (default %(default)s)")
+    load.add_argument("--duration", type=float, default=20.0, help="steady-state seconds (default %(default)s)")
+    load.add_argument("--rate", type=float, default=1.0, help="requests per second per user (default %(default)s)")
+    load.add_argument("--mix", default=DEFAULT_MIX, help="command weights (default %(default)s)")
+    load.add_argument("--group-size", type=int, default=20, help="users per group (default %(default)s)")
+    load.add_argument("--message-size", type=int, default=32, help="filler bytes per message (default %(default)s)")
+    load.add_argument("--seed", type=int, default=None)
+    load.add_argument("--codec", choices=CODECS, default=DEFAULT_CODEC.name,
+                      help="response codec the users ask for at login (default %(default)s)")
+    load.add_argument("--compress", action="store_true", help="users ask for zlib compression at login")
+
+    output = parser.add_argument_group("results")
+    output.add_argument("--output", default="loadgen_results.json", help="JSON results file (default %(default)s)")
+    output.add_argument("--compare", help="previous results file to check for regressions")
+    output.add_argument("--tolerance", type=float, default=0.10,
+                        help="allowed relative slowdown before --compare fails (default %(default)s)")
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parse_args(argv)
+    if args.seed is not None:
+        random.seed(args.seed)
+    if not args.spawn and not (args.port and args.credentials):
+        print("Error: pass --spawn, or --port and --credentials for a running server.")
+        return 2
+    parse_mix(args.mix)
+    raise_fd_limit()
+
+    directory = None
+    process = None
+    try:
+        if args.spawn:
+            directory = tempfile.mkdtemp(prefix="tessenger-loadgen-")
+            args.port = args.port or free_port()
+            process, accounts = spawn_server(args, directory)
+        else:
+            accounts = read_accounts(args.credentials)
+        if len(accounts) < args.users:
+            print(f"Error: only {len(accounts)} accounts available for {args.users} users.")
+            return 2
+
+        results = asyncio.run(LoadRun(args, accounts).execute())
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("compare", "output")},
+        **results,
+    }
+    print(f"{args.users} users logged in in {results['login_seconds']:.2f}s, groups set up in {results['setup_seconds']:.2f}s, "
+          f"steady state {results['duration_seconds']:.1f}s")
+    print_table("Login", results["login"])
+    print_table("Group setup", results["setup"])
+    print_table("Commands", results["commands"])
+    print_table("Push delivery (send to receipt)", results["deliveries"])
+
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        if regressions:
+            print(f"\nRegressions against {args.compare}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"\nNo regressions against {args.compare} (tolerance {args.tolerance:.0%})")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
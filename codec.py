@@ -0,0 +1,292 @@
+"""
+    Response codecs shared by TCPServer3.py and tessenger_client.py
+    Python 3
+    coding: utf-8
+
+    Responses and pushes are dicts with a command, a status code, a client
+    message and a data dict. They go on the wire as JSON unless the client
+    asked for the binary codec when logging in ("codec=binary" after the
+    [loginpassword] fields). The binary form is a fixed header followed by
+    msgpack-style tagged values:
+
+        command code (1 byte, 0 = command name follows as a string)
+        status code (2 bytes)
+        client message (string)
+        data (any value)
+
+    Strings are a 1-byte length (or 0xFF and a 4-byte length) and UTF-8
+    bytes; other values start with a type tag. Frames in the binary codec
+    have FLAG_BINARY set, so every frame says how to decode it and a client
+    needs no bookkeeping around the switch. Request lines stay plain text.
+"""
+import json
+import struct
+from itertools import accumulate
+
+from protocol import FLAG_BINARY, encode_frame, encode_push
+
+
+##################################################
+#                    CONSTANTS                   #
+##################################################
+# Commands with a one-byte code; anything else is sent by name
+COMMAND_CODES = ("loginusername", "loginpassword", "msgto", "activeuser", "creategroup", "joingroup",
+                 "groupmsg", "logout", "metrics", "unknown", "incomingmessage", "incominggroupmsg",
+                 "grouphistory", "heartbeat")
+COMMAND_BY_CODE = {code: command for code, command in enumerate(COMMAND_CODES, 1)}
+CODE_BY_COMMAND = {command: code for code, command in COMMAND_BY_CODE.items()}
+NAMED_COMMAND = 0
+
+RESPONSE_HEADER = struct.Struct("!BH")
+LONG_LENGTH = struct.Struct("!I")
+LONG_LENGTH_MARKER = 0xFF
+INT = struct.Struct("!q")
+FLOAT = struct.Struct("!d")
+
+# Value tags
+TAG_NONE = 0
+TAG_FALSE = 1
+TAG_TRUE = 2
+TAG_INT = 3
+TAG_FLOAT = 4
+TAG_STRING = 5
+TAG_LIST = 6
+TAG_DICT = 7
+TAG_STRING_MAP = 8  # dict of strings to strings: count, all lengths, then all bytes
+
+# Largest string, in bytes, a string map can hold, and the fewest entries
+# worth one (smaller dicts are quicker tag by tag)
+MAX_MAP_STRING = 0xFFFF
+MIN_MAP_ENTRIES = 8
+
+EMPTY_DICT = bytes([TAG_DICT, 0])
+
+
+class CodecError(ValueError):
+    pass
+
+
+##################################################
+#                      JSON                      #
+##################################################
+def encode_json(response):
+    return json.dumps(response).encode()
+
+def decode_json(payload):
+    return json.loads(payload)
+
+
+##################################################
+#                     BINARY                     #
+##################################################
+def encode_binary(response):
+    command = response["command"]
+    code = CODE_BY_COMMAND.get(command, NAMED_COMMAND)
+    parts = [RESPONSE_HEADER.pack(code, response["statusCode"])]
+    if code == NAMED_COMMAND:
+        append_string(parts, command)
+    append_string(parts, response["clientMessage"])
+    data = response["data"]
+    if data:
+        append_value(parts, data)
+    else:
+        parts.append(EMPTY_DICT)
+    return b''.join(parts)
+
+def append_string(parts, text):
+    encoded = text.encode()
+    if len(encoded) < LONG_LENGTH_MARKER:
+        parts.append(bytes((len(encoded),)))
+    else:
+        parts.append(bytes((LONG_LENGTH_MARKER,)))
+        parts.append(LONG_LENGTH.pack(len(encoded)))
+    parts.append(encoded)
+
+def append_length(parts, tag, length):
+    if length < LONG_LENGTH_MARKER:
+        parts.append(bytes((tag, length)))
+    else:
+        parts.append(bytes((tag, LONG_LENGTH_MARKER)))
+        parts.append(LONG_LENGTH.pack(length))
+
+def append_value(parts, value):
+    # strings first: they are nearly everything in a response's data
+    if type(value) is str:
+        encoded = value.encode()
+        if len(encoded) < LONG_LENGTH_MARKER:
+            parts.append(bytes((TAG_STRING, len(encoded))))
+        else:
+            parts.append(bytes((TAG_STRING, LONG_LENGTH_MARKER)))
+            parts.append(LONG_LENGTH.pack(len(encoded)))
+        parts.append(encoded)
+    elif value is None:
+        parts.append(bytes((TAG_NONE,)))
+    elif value is True:
+        parts.append(bytes((TAG_TRUE,)))
+    elif value is False:
+        parts.append(bytes((TAG_FALSE,)))
+    elif isinstance(value, int):
+        parts.append(bytes((TAG_INT,)))
+        parts.append(INT.pack(value))
+    elif isinstance(value, float):
+        parts.append(bytes((TAG_FLOAT,)))
+        parts.append(FLOAT.pack(value))
+    elif isinstance(value, str):
+        append_value(parts, str(value))
+    elif isinstance(value, (list, tuple)):
+        append_length(parts, TAG_LIST, len(value))
+        for item in value:
+            append_value(parts, item)
+    elif isinstance(value, dict):
+        if append_string_map(parts, value):
+            return
+        append_length(parts, TAG_DICT, len(value))
+        for key, item in value.items():
+            append_value(parts, key)
+            append_value(parts, item)
+    else:
+        raise CodecError(f"cannot encode {type(value).__name__} values")
+
+def append_string_map(parts, value):
+    """Encode a dict of strings to strings in one go; False if value is not one."""
+    if len(value) < MIN_MAP_ENTRIES or not all(type(key) is str and type(item) is str for key, item in value.items()):
+        return False
+    strings = [text.encode() for pair in value.items() for text in pair]
+    lengths = [len(encoded) for encoded in strings]
+    if lengths and max(lengths) > MAX_MAP_STRING:
+        return False
+    parts.append(bytes((TAG_STRING_MAP,)))
+    parts.append(LONG_LENGTH.pack(len(value)))
+    parts.append(struct.pack(f"!{len(lengths)}H", *lengths))
+    parts.append(b''.join(strings))
+    return True
+
+def read_string_map(payload, offset):
+    count = LONG_LENGTH.unpack_from(payload, offset)[0]
+    offset += LONG_LENGTH.size
+    lengths = struct.unpack_from(f"!{2 * count}H", payload, offset)
+    offset += 4 * count
+    ends = list(accumulate(lengths, initial=offset))
+    if ends[-1] > len(payload):
+        raise IndexError("string map runs past the end of the payload")
+    strings = [payload[start:end].decode() for start, end in zip(ends, ends[1:])]
+    return dict(zip(strings[::2], strings[1::2])), ends[-1]
+
+def decode_binary(payload):
+    try:
+        code, status = RESPONSE_HEADER.unpack_from(payload, 0)
+        offset = RESPONSE_HEADER.size
+        if code == NAMED_COMMAND:
+            command, offset = read_string(payload, offset)
+        else:
+            command = COMMAND_BY_CODE[code]
+        message, offset = read_string(payload, offset)
+        data, offset = read_value(payload, offset)
+    except (struct.error, IndexError, KeyError, UnicodeDecodeError) as e:
+        raise CodecError(f"malformed binary response: {e!r}") from None
+    return {"command": command, "statusCode": status, "clientMessage": message, "data": data}
+
+def read_length(payload, offset):
+    length = payload[offset]
+    if length == LONG_LENGTH_MARKER:
+        return LONG_LENGTH.unpack_from(payload, offset + 1)[0], offset + 1 + LONG_LENGTH.size
+    return length, offset + 1
+
+def read_string(payload, offset):
+    length, offset = read_length(payload, offset)
+    end = offset + length
+    if end > len(payload):
+        raise IndexError("string runs past the end of the payload")
+    return payload[offset:end].decode(), end
+
+def read_value(payload, offset):
+    tag = payload[offset]
+    if tag == TAG_STRING:
+        length = payload[offset + 1]
+        if length != LONG_LENGTH_MARKER:
+            end = offset + 2 + length
+            if end > len(payload):
+                raise IndexError("string runs past the end of the payload")
+            return payload[offset + 2:end].decode(), end
+        return read_string(payload, offset + 1)
+    offset += 1
+    if tag == TAG_INT:
+        return INT.unpack_from(payload, offset)[0], offset + INT.size
+    if tag == TAG_DICT:
+        length, offset = read_length(payload, offset)
+        value = {}
+        for _ in range(length):
+            key, offset = read_value(payload, offset)
+            value[key], offset = read_value(payload, offset)
+        return value, offset
+    if tag == TAG_STRING_MAP:
+        return read_string_map(payload, offset)
+    if tag == TAG_LIST:
+        length, offset = read_length(payload, offset)
+        value = []
+        for _ in range(length):
+            item, offset = read_value(payload, offset)
+            value.append(item)
+        return value, offset
+    if tag == TAG_FLOAT:
+        return FLOAT.unpack_from(payload, offset)[0], offset + FLOAT.size
+    if tag == TAG_NONE:
+        return None, offset
+    if tag == TAG_TRUE:
+        return True, offset
+    if tag == TAG_FALSE:
+        return False, offset
+    raise KeyError(f"unknown value tag {tag}")
+
+
+##################################################
+#                   Codec Class                  #
+##################################################
+class Codec():
+    __slots__ = ("name", "flags", "encode", "decode")
+
+    def __init__(self, name, flags, encode, decode):
+        self.name = name
+        self.flags = flags
+        self.encode = encode
+        self.decode = decode
+
+    def frame(self, response, request_id):
+        return encode_frame(self.encode(response), request_id, self.flags)
+
+    def push_frame(self, response):
+        return encode_push(self.encode(response), self.flags)
+
+JSON_CODEC = Codec("json", 0, encode_json, decode_json)
+BINARY_CODEC = Codec("binary", FLAG_BINARY, encode_binary, decode_binary)
+
+CODECS = {codec.name: codec for codec in (JSON_CODEC, BINARY_CODEC)}
+DEFAULT_CODEC = JSON_CODEC
+
+def decode_payload(flags, payload):
+    """Decode a response or push frame in whichever codec its flags name."""
+    return decode_binary(payload) if flags & FLAG_BINARY else decode_json(payload)
+
+
+##################################################
+#               EncodedPush Class                #
+##################################################
+class EncodedPush():
+    """A push encoded at most once per codec, however many recipients share it."""
+    __slots__ = ("response", "frames")
+
+    def __init__(self, response):
+        self.response = response
+        self.frames = {}
+
+    def frame(self, codec):
+        frame = self.frames.get(codec.name)
+        if frame is None:
+            frame = self.frames[codec.name] = codec.push_frame(self.response)
+        return frame
+
+def stored_push_frames(bodies, codec):
+    """Frames for pushes kept in the mailbox, which stores them as JSON."""
+    if codec is JSON_CODEC:
+        return b''.join([encode_push(body) for body in bodies])
+    return b''.join([codec.push_frame(decode_json(body)) for body in bodies])
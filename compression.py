@@ -0,0 +1,99 @@
+"""
+    Per-connection compression for the Tessenger protocol
+    Python 3
+    coding: utf-8
+
+    A client that adds "compress=zlib" to its [loginpassword] fields gets the
+    server's frames compressed. Compression happens in the connection's
+    writer, on whatever batch of frames it is about to send: the batch is
+    deflated as one piece and goes out as a single frame with FLAG_COMPRESSED,
+    whose payload inflates back to the original run of frames. Batches below
+    the size threshold are sent as they are.
+
+    Each connection keeps one deflate stream for its whole life, primed with
+    a dictionary of the strings every response repeats, and every batch ends
+    with a sync flush. Later batches can therefore refer back to earlier
+    ones (the same timestamps, group names and senders), while the client can
+    still inflate each frame as it arrives. As with permessage-deflate, the
+    4-byte tail every sync flush ends with is left off the wire.
+
+    Only frames that are actually written pass through the stream, so pushes
+    the outbound queue drops never leave the two ends out of step.
+"""
+import zlib
+
+from protocol import FLAG_COMPRESSED, FrameDecoder, encode_frame, MAX_FRAME_SIZE
+
+
+##################################################
+#                    CONSTANTS                   #
+##################################################
+COMPRESSORS = ("zlib",)
+
+# Batches smaller than this many bytes are not worth compressing
+DEFAULT_COMPRESS_THRESHOLD = 256
+COMPRESS_LEVEL = 6
+
+# Raw deflate, 32 KiB window
+WINDOW_BITS = -15
+SYNC_FLUSH_TAIL = b"\x00\x00\xff\xff"
+
+# Input bytes per compressed frame, well below MAX_FRAME_SIZE even if incompressible
+MAX_COMPRESSED_CHUNK = min(1024 * 1024, MAX_FRAME_SIZE // 2)
+
+# Strings that turn up in most responses, the most common last as zlib prefers
+ZLIB_DICTIONARY = (
+    b"Error: Invalid command! Error: Group chat does not exist. Error: You are not in this group chat. "
+    b"Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec "
+    b"Group chat room has been created, room name: , users in this room: "
+    b"You have successfully joined the group chat 'loginusernameloginpasswordactiveusercreategroupjoingrouplogout"
+    b"is offline, message will be delivered when they log in. "
+    b"Client IP is 127.0.0.1 with UDP recieving port: , active since "
+    b"{\"client_ips\": {\"udp_ports\": {\"codec\": \"binary\"}"
+    b"Group chat message sent.message sent at ."
+    b"{\"command\": \"msgto\", \"statusCode\": 200, \"clientMessage\": \"\", \"data\": {}}"
+    b"{\"command\": \"incomingmessage\", \"statusCode\": 200, \"clientMessage\": \"\\n\", \"data\": {}}"
+    b"{\"command\": \"incominggroupmsg\", \"statusCode\": 200, \"clientMessage\": \"\\n\", \"data\": {}}"
+)
+
+
+##################################################
+#             FrameCompressor Class              #
+##################################################
+class FrameCompressor():
+    """Server side: turns a connection's write batches into compressed frames."""
+    def __init__(self, threshold=DEFAULT_COMPRESS_THRESHOLD, level=COMPRESS_LEVEL):
+        self.threshold = threshold
+        self.deflate = zlib.compressobj(level, zlib.DEFLATED, WINDOW_BITS, zdict=ZLIB_DICTIONARY)
+
+    def compress(self, buffers):
+        """The buffers to write instead of buffers, and the number of input bytes compressed."""
+        size = sum(map(len, buffers))
+        if size < self.threshold:
+            return buffers, 0
+
+        frames = []
+        data = b''.join(buffers)
+        for start in range(0, len(data), MAX_COMPRESSED_CHUNK):
+            chunk = data[start:start + MAX_COMPRESSED_CHUNK]
+            compressed = self.deflate.compress(chunk) + self.deflate.flush(zlib.Z_SYNC_FLUSH)
+            frames.append(encode_frame(compressed[:-len(SYNC_FLUSH_TAIL)], flags=FLAG_COMPRESSED))
+        return frames, size
+
+
+##################################################
+#            FrameDecompressor Class             #
+##################################################
+class FrameDecompressor():
+    """Client side: replaces compressed frames by the frames inside them."""
+    def __init__(self):
+        self.inflate = zlib.decompressobj(WINDOW_BITS, zdict=ZLIB_DICTIONARY)
+        self.decoder = FrameDecoder()
+
+    def expand(self, frames):
+        """Yield the (request_id, flags, payload) tuples of frames, unpacking compressed ones."""
+        for request_id, flags, payload in frames:
+            if flags & FLAG_COMPRESSED:
+                yield from self.decoder.feed(self.inflate.decompress(payload + SYNC_FLUSH_TAIL))
+            else:
+                yield request_id, flags, payload
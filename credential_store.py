@@ -0,0 +1,195 @@
+"""
+    Credential store for TCPServer3.py
+    Python 3
+    coding: utf-8
+
+    credentials.txt stays the file administrators edit ("username password" per
+    line), but the server never loads it into memory. The file is compiled into
+    an indexed SQLite database next to it, and logins look single accounts up
+    on demand through an LRU cache. The database is only rebuilt when the text
+    file has changed since it was compiled, so restarts with a large, unchanged
+    file are immediate.
+
+    A background thread polls the text file and, when it changes, compiles a
+    new database on the side and swaps it in, so accounts can be added or
+    removed without restarting the server.
+"""
+import os
+import sqlite3
+import logging
+from collections import OrderedDict
+from threading import Thread, Lock, Event
+
+
+##################################################
+#                    CONSTANTS                   #
+##################################################
+CREDENTIALS_FILE = 'credentials.txt'
+CREDENTIALS_DB_SUFFIX = '.db'
+
+# Accounts (including unknown usernames) whose lookup result is kept in memory
+DEFAULT_CACHE_SIZE = 65536
+
+# Seconds between checks of credentials.txt for changes; 0 disables reloading
+DEFAULT_RELOAD_INTERVAL = 1.0
+
+# Rows inserted per executemany() while compiling the database
+BUILD_BATCH_SIZE = 50000
+
+MISSING = object()
+
+log = logging.getLogger(__name__)
+
+
+##################################################
+#              CredentialStore Class             #
+##################################################
+class CredentialStore():
+    def __init__(self, file_name=CREDENTIALS_FILE, cache_size=DEFAULT_CACHE_SIZE):
+        self.file_name = file_name
+        self.db_name = os.path.splitext(file_name)[0] + CREDENTIALS_DB_SUFFIX
+        self.cache_size = cache_size
+
+        self.lock = Lock()
+        self.db = None
+        # maps username to password (None for unknown users), least recently used first
+        self.cache = OrderedDict()
+        self.signature = None
+        self.hits = 0
+        self.misses = 0
+
+        self.stopped = Event()
+        self.reload_thread = None
+
+    def __contains__(self, username):
+        return self.get(username) is not None
+
+    def get(self, username):
+        """The password of username, or None if there is no such account."""
+        with self.lock:
+            password = self.cache.get(username, MISSING)
+            if password is not MISSING:
+                self.cache.move_to_end(username)
+                self.hits += 1
+                return password
+
+            self.misses += 1
+            row = self.db.execute("SELECT password FROM credentials WHERE username = ?", (username,)).fetchone()
+            password = row[0] if row else None
+            self.cache[username] = password
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            return password
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM credentials").fetchone()[0]
+
+    #################### DATABASE ####################
+    def open(self):
+        signature = self.file_signature()
+        db = self.connect(self.db_name) if os.path.exists(self.db_name) else None
+        if db is None or self.compiled_signature(db) != signature:
+            if db is not None:
+                db.close()
+            db = self.build(signature)
+        self.swap(db, signature)
+
+    def close(self):
+        self.stop()
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+    def file_signature(self):
+        stat = os.stat(self.file_name)
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    def connect(self, db_name):
+        # shared by every session thread; self.lock serialises access
+        return sqlite3.connect(db_name, check_same_thread=False)
+
+    def compiled_signature(self, db):
+        try:
+            row = db.execute("SELECT value FROM meta WHERE key = 'signature'").fetchone()
+        except sqlite3.DatabaseError:
+            return None
+        return row[0] if row else None
+
+    def build(self, signature):
+        """Compile credentials.txt into a fresh database and move it into place."""
+        # per process, as several server processes may share one credentials file
+        tmp_name = f"{self.db_name}.{os.getpid()}.tmp"
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+
+        db = self.connect(tmp_name)
+        # the database can always be rebuilt from the text file, so skip the journal
+        db.execute("PRAGMA journal_mode = OFF")
+        db.execute("PRAGMA synchronous = OFF")
+        db.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        db.execute("CREATE TABLE credentials (username TEXT PRIMARY KEY, password TEXT NOT NULL) WITHOUT ROWID")
+
+        with open(self.file_name) as file:
+            batch = []
+            for line in file:
+                parts = line.split()
+                if len(parts) < 2:
+                    continue
+                batch.append((parts[0], parts[1]))
+                if len(batch) >= BUILD_BATCH_SIZE:
+                    db.executemany("INSERT OR REPLACE INTO credentials VALUES (?, ?)", batch)
+                    batch = []
+            db.executemany("INSERT OR REPLACE INTO credentials VALUES (?, ?)", batch)
+
+        db.execute("INSERT INTO meta VALUES ('signature', ?)", (signature,))
+        db.commit()
+        db.close()
+
+        os.replace(tmp_name, self.db_name)
+        return self.connect(self.db_name)
+
+    def swap(self, db, signature):
+        with self.lock:
+            old_db = self.db
+            self.db = db
+            self.signature = signature
+            self.cache.clear()
+        if old_db is not None:
+            old_db.close()
+
+    #################### RELOADING ####################
+    def start(self, interval=DEFAULT_RELOAD_INTERVAL):
+        if interval <= 0:
+            return
+        self.stopped.clear()
+        self.reload_thread = Thread(target=self.run, args=(interval,), name="credential-reload", daemon=True)
+        self.reload_thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.reload_thread is not None:
+            self.reload_thread.join()
+            self.reload_thread = None
+
+    def run(self, interval):
+        while not self.stopped.wait(interval):
+            try:
+                self.reload()
+            except (OSError, sqlite3.Error) as e:
+                log.error("Could not reload %s: %s", self.file_name, e)
+
+    def reload(self):
+        """Recompile and swap in the database if credentials.txt has changed."""
+        signature = self.file_signature()
+        if signature == self.signature:
+            return False
+        # another process sharing the file may have compiled it already
+        db = self.connect(self.db_name)
+        if self.compiled_signature(db) != signature:
+            db.close()
+            db = self.build(signature)
+        self.swap(db, signature)
+        log.info("Reloaded %s", self.file_name)
+        return True
@@ -0,0 +1,183 @@
+"""
+    Persistent group chats for TCPServer3.py
+    Python 3
+    coding: utf-8
+
+    Every change to a group is appended to a journal as it happens:
+
+        C <tab> group name <tab> user:1 user:0 ...    created (1 = joined, 0 = invited)
+        J <tab> group name <tab> username             an invited user joined
+
+    and a background thread periodically writes all groups to a compact
+    snapshot. Journals are numbered: taking a snapshot switches appends to the
+    next journal, writes the snapshot naming that journal as the first one to
+    replay, and then deletes the older ones. At startup, open() loads the
+    snapshot and replays the journals from there on, so a crash at any point
+    of a snapshot loses nothing. A torn line at the end of a journal is
+    ignored.
+"""
+import os
+import json
+import time
+import logging
+from threading import Thread, Lock, Event
+
+
+##################################################
+#                    CONSTANTS                   #
+##################################################
+GROUP_STATE_DIR = 'groups'
+SNAPSHOT_FILE = 'groups.snapshot'
+JOURNAL_PREFIX = 'groups-'
+JOURNAL_SUFFIX = '.journal'
+
+# Seconds between snapshots (only when something changed)
+SNAPSHOT_INTERVAL = 30.0
+
+# Journal record kinds
+CREATE = "C"
+JOIN = "J"
+
+log = logging.getLogger(__name__)
+
+
+##################################################
+#                GroupStore Class                #
+##################################################
+class GroupStore():
+    def __init__(self, directory=GROUP_STATE_DIR):
+        self.directory = directory
+        # maps group name to {username: joined}, the owner first
+        self.groups = {}
+        self.lock = Lock()
+        self.generation = 0    # number of the journal being appended to
+        self.journal = None
+        self.changes = 0       # records appended since the last snapshot
+        self.stopped = Event()
+        self.snapshot_thread = None
+
+    #################### STARTUP ####################
+    def open(self):
+        """Load the snapshot and replay the journals after it; returns the groups
+        as {name: {username: joined}}."""
+        started = time.perf_counter()
+        os.makedirs(self.directory, exist_ok=True)
+        first = 0
+        try:
+            with open(self.path(SNAPSHOT_FILE)) as file:
+                snapshot = json.load(file)
+            first = snapshot["journal"]
+            self.groups = snapshot["groups"]
+        except FileNotFoundError:
+            pass
+
+        generations = sorted(generation for generation in self.journal_generations() if generation >= first)
+        replayed = 0
+        for generation in generations:
+            replayed += self.replay(generation)
+
+        # appends go to a fresh journal, whatever state the last one was left in
+        self.generation = max(generations + [first]) + 1
+        self.journal = open(self.journal_path(self.generation), 'a')
+        self.changes = replayed
+        log.info("Loaded %d group(s), %d journal record(s) replayed, in %.3fs",
+                 len(self.groups), replayed, time.perf_counter() - started)
+        return self.groups
+
+    def replay(self, generation):
+        groups = self.groups
+        replayed = 0
+        with open(self.journal_path(generation)) as file:
+            for line in file:
+                if not line.endswith("\n"):
+                    # torn write at the tail
+                    break
+                fields = line[:-1].split("\t")
+                if len(fields) != 3:
+                    log.warning("Skipping a malformed record in group journal %d", generation)
+                    continue
+                kind, name, value = fields
+                if kind == CREATE:
+                    groups[name] = {member[:-2]: member[-1] == "1" for member in value.split(" ")}
+                elif kind == JOIN and name in groups:
+                    groups[name][value] = True
+                replayed += 1
+        return replayed
+
+    #################### PUBLIC API ####################
+    def create(self, name, users_joined):
+        with self.lock:
+            self.groups[name] = dict(users_joined)
+            members = " ".join(f"{username}:{int(joined)}" for username, joined in users_joined.items())
+            self.append_journal(f"{CREATE}\t{name}\t{members}\n")
+
+    def join(self, name, username):
+        with self.lock:
+            members = self.groups.get(name)
+            if members is None or members.get(username):
+                return
+            members[username] = True
+            self.append_journal(f"{JOIN}\t{name}\t{username}\n")
+
+    def append_journal(self, line):
+        # called with self.lock held
+        if self.journal is not None:
+            self.journal.write(line)
+            self.journal.flush()
+            self.changes += 1
+
+    #################### SNAPSHOTS ####################
+    def snapshot(self):
+        with self.lock:
+            if not self.changes or self.journal is None:
+                return
+            # later changes go to the next journal, which the snapshot names as the first to replay
+            groups = {name: dict(members) for name, members in self.groups.items()}
+            self.journal.close()
+            self.generation += 1
+            self.journal = open(self.journal_path(self.generation), 'a')
+            self.changes = 0
+            generation = self.generation
+
+        temp_file_name = self.path(SNAPSHOT_FILE + ".tmp")
+        with open(temp_file_name, 'w') as file:
+            json.dump({"journal": generation, "groups": groups}, file, separators=(",", ":"))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_file_name, self.path(SNAPSHOT_FILE))
+
+        for old in self.journal_generations():
+            if old < generation:
+                os.remove(self.journal_path(old))
+
+    def start(self, interval=SNAPSHOT_INTERVAL):
+        def run():
+            while not self.stopped.wait(interval):
+                try:
+                    self.snapshot()
+                except OSError as e:
+                    log.error("Could not write the group snapshot: %s", e)
+
+        self.snapshot_thread = Thread(target=run, name="group-snapshots", daemon=True)
+        self.snapshot_thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.snapshot_thread is not None:
+            self.snapshot_thread.join()
+        self.snapshot()
+        with self.lock:
+            self.journal.close()
+            self.journal = None
+
+    #################### FILES ####################
+    def path(self, file_name):
+        return os.path.join(self.directory, file_name)
+
+    def journal_path(self, generation):
+        return self.path(f"{JOURNAL_PREFIX}{generation}{JOURNAL_SUFFIX}")
+
+    def journal_generations(self):
+        return [int(name[len(JOURNAL_PREFIX):-len(JOURNAL_SUFFIX)])
+                for name in os.listdir(self.directory)
+                if name.startswith(JOURNAL_PREFIX) and name.endswith(JOURNAL_SUFFIX)]
@@ -0,0 +1,149 @@
+"""
+    Batched links between server processes
+    Python 3
+    coding: utf-8
+
+    Server processes (the broker and its workers) talk to each other with
+    small JSON operations such as ["login", username, ...] or
+    ["deliver", usernames, payload]. An OpLink carries them over a stream:
+    send() only queues an op, and everything queued during one turn of the
+    event loop goes out together as a single frame holding a JSON list, so a
+    burst of deliveries costs one write instead of one per message.
+
+    Batches are cut at MAX_BATCH_BYTES, and one that is still larger (a
+    single huge op, such as the broker's snapshot) is spread over several
+    frames, all but the last flagged FLAG_CONTINUED, so no frame comes near
+    MAX_FRAME_SIZE. A batch is only written once the previous one has
+    drained, and the loops reading ops await drain() on the links they feed,
+    so a slow peer holds up whoever is sending to it instead of filling the
+    transport buffers.
+"""
+import asyncio
+import json
+import logging
+
+from protocol import FrameDecoder, FrameError, encode_frame, RECV_BUFFER_SIZE
+
+
+##################################################
+#                    CONSTANTS                   #
+##################################################
+# Ops and encoded bytes per batch; a larger batch is split in several
+MAX_BATCH_OPS = 4096
+MAX_BATCH_BYTES = 1024 * 1024
+
+# Frame flag: the payload carries on in the next frame
+FLAG_CONTINUED = 0x08
+
+log = logging.getLogger(__name__)
+
+
+##################################################
+#                  OpLink Class                  #
+##################################################
+class OpLink():
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.decoder = FrameDecoder()
+        # payloads of a batch whose last frame has not arrived yet
+        self.continued = []
+        self.pending = []
+        # writes the queued batches, waiting for the peer between them
+        self.flush_task = None
+        self.closed = False
+        # ops and frames sent, to see how well batching works
+        self.ops_sent = 0
+        self.frames_sent = 0
+
+    def send(self, op):
+        if self.closed:
+            return
+        self.pending.append(op)
+        if self.flush_task is None:
+            self.flush_task = asyncio.get_running_loop().create_task(self.flush_batches())
+
+    async def flush_batches(self):
+        try:
+            while self.pending:
+                self.flush()
+                # ops sent while the peer catches up go out as the next batch
+                await self.writer.drain()
+        except ConnectionError:
+            # receive() notices the link is gone
+            self.closed = True
+            self.pending = []
+        except FrameError as e:
+            log.error("Dropped a batch of ops that could not be framed: %s", e)
+        finally:
+            self.flush_task = None
+
+    def flush(self):
+        if self.closed or not self.pending:
+            self.pending = []
+            return
+        pending = self.pending
+        self.pending = []
+        batch = []
+        size = 0
+        for op in pending:
+            try:
+                encoded = json.dumps(op).encode()
+            except (TypeError, ValueError) as e:
+                log.error("Dropped a %s op that cannot be encoded: %s", op[0], e)
+                continue
+            if batch and (len(batch) == MAX_BATCH_OPS or size + len(encoded) > MAX_BATCH_BYTES):
+                self.write_batch(batch)
+                batch = []
+                size = 0
+            batch.append(encoded)
+            size += len(encoded) + 1
+        if batch:
+            self.write_batch(batch)
+
+    def write_batch(self, batch):
+        payload = b'[' + b','.join(batch) + b']'
+        last = (len(payload) - 1) // MAX_BATCH_BYTES * MAX_BATCH_BYTES
+        for start in range(0, last, MAX_BATCH_BYTES):
+            self.writer.write(encode_frame(payload[start:start + MAX_BATCH_BYTES], flags=FLAG_CONTINUED))
+            self.frames_sent += 1
+        self.writer.write(encode_frame(payload[last:]))
+        self.frames_sent += 1
+        self.ops_sent += len(batch)
+
+    async def receive(self):
+        """Wait for the next ops from the peer; None once the link is closed."""
+        while True:
+            try:
+                data = await self.reader.read(RECV_BUFFER_SIZE)
+            except ConnectionError:
+                data = b''
+            if not data:
+                self.closed = True
+                return None
+            ops = []
+            for _, flags, payload in self.decoder.feed(data):
+                if flags & FLAG_CONTINUED:
+                    self.continued.append(payload)
+                    continue
+                if self.continued:
+                    self.continued.append(payload)
+                    payload = b''.join(self.continued)
+                    self.continued = []
+                ops.extend(json.loads(payload))
+            if ops:
+                return ops
+
+    async def drain(self):
+        """Wait until the ops sent so far are written and the peer is keeping up."""
+        if self.flush_task is not None:
+            await asyncio.shield(self.flush_task)
+
+    def close(self):
+        self.flush()
+        self.closed = True
+        self.writer.close()
+
+async def drain_links(links):
+    for link in list(links):
+        await link.drain()
@@ -0,0 +1,421 @@
+"""
+    Batched background writer for the server's message logs
+    Python 3
+    coding: utf-8
+
+    Request handlers call LogWriter.append() which only queues the line. One
+    writer thread drains the queue in batches, groups the lines by file, and
+    writes each file's share with a single write() on a handle it keeps open.
+    Durability is controlled by the fsync policy:
+
+        never     leave flushing to disk up to the OS (default)
+        batch     group commit - fsync every file touched by a batch, once
+        interval  fsync touched files at most once every fsync_interval seconds
+
+    append() returns as soon as the line is queued, and the server answers the
+    request without waiting for the write, so the policies bound what a crash
+    can lose (the lines of the batch in progress, or of the last interval)
+    rather than making acknowledged messages durable. stop() writes out
+    everything still queued and fsyncs it.
+
+    Lines appended with a sequence number (the group logs, numbered from 1)
+    are records: backslashes and newlines in them are escaped, so each takes
+    exactly one line that starts with its number, whatever the message says,
+    and read_page() hands them back unescaped. They are also indexed: the
+    byte offset of every INDEX_INTERVAL-th line is kept in a SparseIndex, in
+    memory and in a .idx file next to the log. read_page() uses it to fetch
+    a page of history with one seek and one read of at most a page plus two
+    index intervals, however long the log has grown.
+"""
+import os
+import re
+import time
+import logging
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from itertools import chain
+from threading import Thread, Condition, Lock
+
+
+##################################################
+#                    CONSTANTS                   #
+##################################################
+# Seconds the writer waits for more records after the first one of a batch
+DEFAULT_FLUSH_INTERVAL = 0.05
+DEFAULT_FSYNC_POLICY = "never"
+DEFAULT_FSYNC_INTERVAL = 1.0
+FSYNC_POLICIES = ("never", "batch", "interval")
+
+# Lines written per batch, and log files kept open between batches
+MAX_BATCH_SIZE = 8192
+MAX_OPEN_FILES = 256
+
+# Queue record kinds
+APPEND = 0
+RESET = 1
+
+# Indexed lines between two offsets kept in a log's index
+INDEX_INTERVAL = 64
+INDEX_SUFFIX = ".idx"
+
+ESCAPED_CHARACTER = re.compile(r"\\(.)")
+
+log = logging.getLogger(__name__)
+
+
+##################################################
+#                 LogWriter Class                #
+##################################################
+class LogWriter():
+    def __init__(self, flush_interval=DEFAULT_FLUSH_INTERVAL, fsync_policy=DEFAULT_FSYNC_POLICY,
+                 fsync_interval=DEFAULT_FSYNC_INTERVAL):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"fsync policy must be one of {', '.join(FSYNC_POLICIES)}")
+        self.flush_interval = flush_interval
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+
+        self.condition = Condition()
+        self.queue = []
+        self.enqueued = 0   # records ever queued
+        self.written = 0    # records ever written
+        self.oldest_pending = None  # enqueue time of the oldest unwritten record
+        self.writing = []   # the batch being written, still visible to read_page()
+        self.running = False
+        self.thread = None
+
+        # maps file name to an open handle, least recently used first
+        self.files = OrderedDict()
+        self.unsynced = set()
+        self.last_fsync = time.monotonic()
+
+        # maps file name to its SparseIndex, loaded when first needed
+        self.indexes = {}
+        self.index_lock = Lock()
+
+    #################### PRODUCER SIDE ####################
+    def append(self, file_name, line, sequence=None):
+        """Queue line for file_name; with a sequence number, line is a record that
+        is escaped onto a single line and indexed."""
+        if sequence is not None:
+            line = escape_record(line) + "\n"
+        self.put((APPEND, file_name, line, sequence))
+
+    def reset(self, file_name):
+        """Truncate file_name, ordered with respect to earlier and later appends."""
+        self.put((RESET, file_name, None, None))
+
+    def put(self, record):
+        with self.condition:
+            if not self.queue:
+                self.oldest_pending = time.monotonic()
+            self.queue.append(record)
+            self.enqueued += 1
+            if len(self.queue) == 1 or len(self.queue) >= MAX_BATCH_SIZE:
+                self.condition.notify_all()
+
+    def sync(self, timeout=None):
+        """Block until every record queued before this call has been written."""
+        with self.condition:
+            target = self.enqueued
+            self.condition.notify_all()
+            return self.condition.wait_for(lambda: self.written >= target or not self.running, timeout)
+
+    def lag(self):
+        """Seconds the oldest queued record has been waiting to be written."""
+        oldest = self.oldest_pending
+        return 0.0 if oldest is None else time.monotonic() - oldest
+
+    def backlog(self):
+        return self.enqueued - self.written
+
+    #################### HISTORY ####################
+    def read_page(self, file_name, before=None, limit=INDEX_INTERVAL):
+        """Up to limit (sequence, text) records of an indexed log, oldest first,
+        numbered below before (or the newest ones when before is None).
+
+        Lines still queued or being written are included, so a page reflects
+        every append made before the call.
+        """
+        # take the unwritten lines first: any line missing from them is already in the file
+        with self.condition:
+            pending = {}
+            truncated = False
+            for kind, name, line, sequence in chain(self.writing, self.queue):
+                if name != file_name:
+                    continue
+                if kind == RESET:
+                    # what the file holds now is about to go
+                    pending.clear()
+                    truncated = True
+                elif sequence is not None:
+                    pending[sequence] = unescape_record(line[:-1])
+
+        with self.index_lock:
+            index = SparseIndex() if truncated else self.load_index(file_name)
+            if before is None:
+                before = max(chain(pending, (index.last,))) + 1
+            first = max(1, before - limit)
+            start, end = index.span(first, before)
+
+        records = {}
+        if end > start:
+            try:
+                with open(file_name, 'rb') as file:
+                    file.seek(start)
+                    records = parse_records(file.read(end - start).decode(errors="replace"))
+            except OSError as e:
+                log.error("Could not read %s: %s", file_name, e)
+        records.update(pending)
+        return [(sequence, records[sequence]) for sequence in sorted(records) if first <= sequence < before]
+
+    def last_sequence(self, file_name):
+        """The sequence number of the newest indexed line written to file_name, 0 if none."""
+        with self.index_lock:
+            return self.load_index(file_name).last
+
+    def load_index(self, file_name):
+        # called with index_lock held
+        index = self.indexes.get(file_name)
+        if index is None:
+            index = self.indexes[file_name] = SparseIndex.load(file_name)
+        return index
+
+    def update_index(self, file_name, offset, encoded, sequences):
+        """Index lines just written at offset, encoded and numbered as given."""
+        entries = []
+        with self.index_lock:
+            index = self.load_index(file_name)
+            for line, sequence in zip(encoded, sequences):
+                if sequence is not None:
+                    if (sequence - 1) % INDEX_INTERVAL == 0:
+                        entries.append((sequence, offset))
+                    index.last = sequence
+                offset += len(line)
+            index.add(entries)
+            index.size = offset
+        if entries:
+            try:
+                with open(index_file_name(file_name), 'a') as file:
+                    file.write(''.join(f"{sequence} {offset}\n" for sequence, offset in entries))
+            except OSError as e:
+                # the index is rebuilt from the log if it is found to be wrong
+                log.error("Could not write the index of %s: %s", file_name, e)
+
+    def drop_index(self, file_name):
+        with self.index_lock:
+            self.indexes[file_name] = SparseIndex()
+        try:
+            os.remove(index_file_name(file_name))
+        except FileNotFoundError:
+            pass
+
+    #################### WRITER THREAD ####################
+    def start(self):
+        self.running = True
+        self.thread = Thread(target=self.run, name="log-writer", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        for file_name in list(self.files):
+            self.close_file(file_name)
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.queue or not self.running)
+                if not self.queue and not self.running:
+                    return
+                # give a burst of records the chance to join this batch
+                if self.running and self.flush_interval > 0 and len(self.queue) < MAX_BATCH_SIZE:
+                    self.condition.wait_for(lambda: len(self.queue) >= MAX_BATCH_SIZE or not self.running,
+                                            self.flush_interval)
+                batch = self.writing = self.queue
+                self.queue = []
+                self.oldest_pending = None
+
+            self.write_batch(batch)
+
+            with self.condition:
+                self.writing = []
+                self.written += len(batch)
+                self.condition.notify_all()
+
+    def write_batch(self, batch):
+        # group lines by file, preserving order, and cut at resets
+        chunks = OrderedDict()
+        for kind, file_name, line, sequence in batch:
+            if kind == RESET:
+                self.flush_chunks(chunks)
+                chunks.clear()
+                self.close_file(file_name)
+                with open(file_name, 'w'):
+                    pass
+                self.drop_index(file_name)
+            else:
+                chunks.setdefault(file_name, []).append((line, sequence))
+        self.flush_chunks(chunks)
+
+        if self.fsync_policy == "batch":
+            self.fsync_unsynced()
+        elif self.fsync_policy == "interval" and time.monotonic() - self.last_fsync >= self.fsync_interval:
+            self.fsync_unsynced()
+
+    def flush_chunks(self, chunks):
+        for file_name, records in chunks.items():
+            encoded = [line.encode() for line, _ in records]
+            try:
+                file = self.open_file(file_name)
+                offset = file.tell()
+                file.write(b''.join(encoded))
+                file.flush()
+            except OSError as e:
+                log.error("Could not write %s: %s", file_name, e)
+                self.close_file(file_name)
+                continue
+            sequences = [sequence for _, sequence in records]
+            if any(sequence is not None for sequence in sequences):
+                self.update_index(file_name, offset, encoded, sequences)
+            if self.fsync_policy != "never":
+                self.unsynced.add(file_name)
+
+    def fsync_unsynced(self):
+        for file_name in self.unsynced:
+            file = self.files.get(file_name)
+            if file is not None:
+                os.fsync(file.fileno())
+        self.unsynced.clear()
+        self.last_fsync = time.monotonic()
+
+    def open_file(self, file_name):
+        file = self.files.get(file_name)
+        if file is not None:
+            self.files.move_to_end(file_name)
+            return file
+
+        if len(self.files) >= MAX_OPEN_FILES:
+            oldest_name, _ = next(iter(self.files.items()))
+            self.close_file(oldest_name)
+        # binary, so tell() gives the byte offsets the index needs
+        file = open(file_name, 'ab')
+        self.files[file_name] = file
+        return file
+
+    def close_file(self, file_name):
+        # fsynced first unless the policy is never, whatever the interval says
+        file = self.files.pop(file_name, None)
+        if file is not None:
+            if file_name in self.unsynced:
+                file.flush()
+                os.fsync(file.fileno())
+                self.unsynced.discard(file_name)
+            file.close()
+
+
+##################################################
+#                SparseIndex Class               #
+##################################################
+class SparseIndex():
+    """Byte offsets of every INDEX_INTERVAL-th line of a log, by sequence number."""
+    def __init__(self):
+        self.sequences = []
+        self.offsets = []
+        self.last = 0   # newest sequence number written
+        self.size = 0   # bytes of the log written so far
+
+    def add(self, entries):
+        for sequence, offset in entries:
+            self.sequences.append(sequence)
+            self.offsets.append(offset)
+
+    def span(self, first, end):
+        """The byte range of the log holding the lines numbered first up to end."""
+        before = bisect_right(self.sequences, first) - 1
+        after = bisect_left(self.sequences, end)
+        start = self.offsets[before] if before >= 0 else 0
+        stop = self.offsets[after] if after < len(self.offsets) else self.size
+        return start, stop
+
+    @classmethod
+    def load(cls, file_name):
+        """The index of file_name from its .idx file, checked against the log,
+        or rebuilt with one pass over the log if the two do not agree."""
+        index = cls()
+        try:
+            index.size = os.path.getsize(file_name)
+        except OSError:
+            return index
+        try:
+            with open(index_file_name(file_name)) as file:
+                entries = [(int(sequence), int(offset)) for sequence, offset in (line.split() for line in file)]
+        except (OSError, ValueError):
+            entries = []
+
+        with open(file_name, 'rb') as log_file:
+            # entries past the end of the log were written for lines that never made it to disk
+            kept = [(sequence, offset) for sequence, offset in entries if offset < index.size]
+            if kept:
+                sequence, offset = kept[-1]
+                log_file.seek(offset)
+                if line_sequence(log_file.readline()) != sequence:
+                    log.warning("Index of %s does not match the log, rebuilding it", file_name)
+                    kept = []
+            index.add(kept)
+            # whatever follows the last entry is read to find the newest line
+            index.scan(log_file, kept[-1][1] if kept else 0)
+        if list(zip(index.sequences, index.offsets)) != entries:
+            index.save(file_name)
+        return index
+
+    def scan(self, log_file, offset):
+        """Index the lines of log_file from offset on."""
+        log_file.seek(offset)
+        for line in log_file:
+            sequence = line_sequence(line)
+            if sequence is not None:
+                if (sequence - 1) % INDEX_INTERVAL == 0 and (not self.sequences or sequence > self.sequences[-1]):
+                    self.add([(sequence, offset)])
+                self.last = sequence
+            offset += len(line)
+
+    def save(self, file_name):
+        try:
+            with open(index_file_name(file_name), 'w') as file:
+                file.write(''.join(f"{sequence} {offset}\n" for sequence, offset in zip(self.sequences, self.offsets)))
+        except OSError as e:
+            log.error("Could not write the index of %s: %s", file_name, e)
+
+def index_file_name(file_name):
+    return os.path.splitext(file_name)[0] + INDEX_SUFFIX
+
+def line_sequence(line):
+    # indexed lines start with their sequence number and a semicolon
+    head, separator, _ = line.partition(b";")
+    return int(head) if separator and head.isdigit() else None
+
+def escape_record(record):
+    return record.replace("\\", "\\\\").replace("\n", "\\n")
+
+def unescape_record(line):
+    return ESCAPED_CHARACTER.sub(lambda match: "\n" if match.group(1) == "n" else match.group(1), line)
+
+def parse_records(text):
+    """Map sequence number to unescaped record for a run of log lines; a line
+    that does not start with a number continues the record before it, as in
+    logs written before records were escaped."""
+    records = {}
+    sequence = None
+    for line in text.split("\n"):
+        head, separator, _ = line.partition(";")
+        if separator and head.isdigit():
+            sequence = int(head)
+            records[sequence] = unescape_record(line)
+        elif sequence is not None and line:
+            records[sequence] += "\n" + line
+    return records
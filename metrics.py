@@ -0,0 +1,173 @@
+"""
+    Metrics for TCPServer3.py
+    Python 3
+    coding: utf-8
+
+    The server counts what it does as it does it: requests and their latency
+    per command, group fan-out sizes, bytes in and out, connections and
+    dropped pushes. Recording is an increment or a histogram bucket bump under
+    one uncontended lock, cheap enough to leave on. Values that already exist
+    elsewhere (outbound queue depths, log writer lag, rate limiter counters)
+    are not recorded again but collected by functions called when the metrics
+    are rendered.
+
+    render() produces the plain-text exposition format scrapers understand.
+    It is served over HTTP on 127.0.0.1 with --metrics-port, and returned
+    without the histogram buckets by the /metrics admin command.
+"""
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Lock
+
+
+##################################################
+#                    CONSTANTS                   #
+##################################################
+METRIC_PREFIX = "tessenger_"
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+FANOUT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+
+METRIC_KINDS = ("counter", "gauge", "histogram")
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+##################################################
+#                 Histogram Class                #
+##################################################
+class Histogram():
+    __slots__ = ("bounds", "counts", "total", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # one count per bound, plus one for values above the last bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def render(self, name, labels, buckets=True):
+        lines = []
+        if buckets:
+            cumulative = 0
+            for bound, count in zip(self.bounds, self.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{format_labels(labels + [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{format_labels(labels + [('le', '+Inf')])} {self.count}")
+        lines.append(f"{name}_sum{format_labels(labels)} {self.total:g}")
+        lines.append(f"{name}_count{format_labels(labels)} {self.count}")
+        return lines
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+##################################################
+#                  Metrics Class                 #
+##################################################
+class Metrics():
+    def __init__(self):
+        self.lock = Lock()
+        # maps name to (kind, help, label name, bucket bounds)
+        self.described = {}
+        # maps name to {label value: number or Histogram}; None is the unlabelled value
+        self.values = {}
+        # maps name to a function returning a number or {label value: number}
+        self.collected = {}
+        self.started = time.time()
+
+    def describe(self, name, kind, help_text, label=None, buckets=None):
+        if kind not in METRIC_KINDS:
+            raise ValueError(f"metric kind must be one of {', '.join(METRIC_KINDS)}")
+        self.described[name] = (kind, help_text, label, buckets)
+        # a counter nothing has happened to yet still shows up, as 0
+        self.values.setdefault(name, {} if label or kind == "histogram" else {None: 0})
+
+    def collect(self, name, kind, help_text, function, label=None):
+        """Register a metric whose value is read from function when rendering."""
+        self.describe(name, kind, help_text, label)
+        self.collected[name] = function
+
+    #################### RECORDING ####################
+    def increment(self, name, label_value=None, amount=1):
+        with self.lock:
+            values = self.values[name]
+            values[label_value] = values.get(label_value, 0) + amount
+
+    def observe(self, name, value, label_value=None):
+        with self.lock:
+            values = self.values[name]
+            histogram = values.get(label_value)
+            if histogram is None:
+                histogram = values[label_value] = Histogram(self.described[name][3])
+            histogram.observe(value)
+
+    #################### RENDERING ####################
+    def render(self, buckets=True):
+        """Everything in the text exposition format; buckets=False leaves out
+        histogram buckets for reading by eye, keeping their sums and counts."""
+        lines = []
+        for name, (kind, help_text, label, _) in self.described.items():
+            full_name = METRIC_PREFIX + name
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            for label_value, value in self.read(name):
+                labels = [] if label_value is None else [(label, label_value)]
+                if isinstance(value, Histogram):
+                    lines.extend(value.render(full_name, labels, buckets))
+                else:
+                    lines.append(f"{full_name}{format_labels(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def read(self, name):
+        function = self.collected.get(name)
+        if function is not None:
+            value = function()
+            return sorted(value.items()) if isinstance(value, dict) else [(None, value)]
+        with self.lock:
+            # histograms are copied so rendering does not race with observe()
+            return sorted(((label_value, copy_value(value)) for label_value, value in self.values[name].items()),
+                          key=lambda item: "" if item[0] is None else str(item[0]))
+
+    #################### HTTP ENDPOINT ####################
+    def serve(self, port, host="127.0.0.1"):
+        """Serve render() at http://host:port/metrics from a background thread."""
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # scrapes are not worth a line in the server output
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        server.daemon_threads = True
+        Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        return server
+
+def copy_value(value):
+    if not isinstance(value, Histogram):
+        return value
+    histogram = Histogram(value.bounds)
+    histogram.counts = list(value.counts)
+    histogram.total = value.total
+    histogram.count = value.count
+    return histogram
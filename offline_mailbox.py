@@ -0,0 +1,273 @@
+"""
+    Persistent offline mailbox for TCPServer3.py
+    Python 3
+    coding: utf-8
+
+    Messages for users who are not logged in are appended to segment files in
+    MAILBOX_DIR. Each record is
+
+        kind (1 byte) | seq (8 bytes) | name length (2 bytes) | body length (4 bytes) | name | body
+
+    where a MESSAGE record's body is the push payload to deliver and an ACK record
+    says every message for that user up to and including seq has been consumed.
+    The per-user index (seq, segment, offset, length) lives in memory and is
+    rebuilt by scanning the segments at startup. Before segments whose messages
+    have all been consumed are deleted, the seq each user has consumed up to is
+    written to a checkpoint file, which stands in for the ACKs that go with
+    them; so they can be deleted in any order, and only the segments holding
+    pending messages stay on disk. Each user keeps at most max_per_user
+    messages (the oldest are trimmed with an ACK). Startup carries on appending
+    to the last segment while it has room.
+"""
+import os
+import json
+import struct
+from collections import deque
+from threading import Lock
+
+
+##################################################
+#                    CONSTANTS                   #
+##################################################
+MAILBOX_DIR = 'mailbox'
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.log'
+CHECKPOINT_FILE = 'checkpoint.json'
+
+# Roll over to a new segment file after this many bytes
+SEGMENT_SIZE = 16 * 1024 * 1024
+
+# Pending messages kept per user before the oldest are dropped
+MAX_PENDING_PER_USER = 50000
+
+# Replay reads a whole span of a segment at once unless it is mostly other users' records
+MAX_SPAN_READ = 8 * 1024 * 1024
+
+RECORD_HEADER = struct.Struct("!BQHI")
+MESSAGE = 1
+ACK = 2
+
+
+class MailboxError(Exception):
+    pass
+
+
+##################################################
+#                  Mailbox Class                 #
+##################################################
+class Mailbox():
+    def __init__(self, directory=MAILBOX_DIR, segment_size=SEGMENT_SIZE, max_per_user=MAX_PENDING_PER_USER):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_per_user = max_per_user
+        self.lock = Lock()
+
+        # maps username to deque of (seq, segment id, offset, length) for pending bodies
+        self.index = {}
+        # next seq to hand out per user; seqs keep growing so old ACKs stay valid
+        self.next_seq = {}
+        # maps username to the seq their messages have been consumed up to
+        self.acked = {}
+        # pending message count per segment id
+        self.live = {}
+
+        self.active_id = 0
+        self.active_file = None
+        self.active_size = 0
+        self.read_fds = {}
+
+    #################### STARTUP ####################
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            with open(self.path(CHECKPOINT_FILE)) as file:
+                self.acked = json.load(file)
+        except FileNotFoundError:
+            pass
+        for username, seq in self.acked.items():
+            self.next_seq[username] = seq + 1
+
+        segment_ids = sorted(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+                             for name in os.listdir(self.directory)
+                             if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX))
+        end = 0
+        for segment_id in segment_ids:
+            end = self.scan_segment(segment_id)
+
+        if segment_ids and end < self.segment_size:
+            # appends carry on after the last whole record of the last segment
+            os.truncate(self.segment_path(segment_ids[-1]), end)
+            self.roll_segment(segment_ids[-1])
+        else:
+            self.roll_segment((segment_ids[-1] if segment_ids else 0) + 1)
+        self.collect_segments()
+
+    def scan_segment(self, segment_id):
+        # returns the offset just past the last whole record
+        self.live.setdefault(segment_id, 0)
+        with open(self.segment_path(segment_id), 'rb') as file:
+            data = file.read()
+
+        offset = 0
+        while offset + RECORD_HEADER.size <= len(data):
+            kind, seq, name_length, body_length = RECORD_HEADER.unpack_from(data, offset)
+            name_start = offset + RECORD_HEADER.size
+            body_start = name_start + name_length
+            end = body_start + body_length
+            if end > len(data):
+                break  # torn write at the tail, ignore it
+            username = data[name_start:body_start].decode()
+
+            self.next_seq[username] = max(self.next_seq.get(username, 1), seq + 1)
+            if kind == MESSAGE and seq > self.acked.get(username, 0):
+                self.index.setdefault(username, deque()).append((seq, segment_id, body_start, body_length))
+                self.live[segment_id] += 1
+            elif kind == ACK:
+                self.discard_upto(username, seq)
+            offset = end
+        return offset
+
+    def close(self):
+        with self.lock:
+            if self.active_file is not None:
+                self.active_file.close()
+                self.active_file = None
+            for fd in self.read_fds.values():
+                os.close(fd)
+            self.read_fds.clear()
+
+    #################### PUBLIC API ####################
+    def store(self, username, body):
+        """Queue body (bytes) for username, dropping their oldest if over the limit."""
+        with self.lock:
+            seq = self.next_seq.get(username, 1)
+            self.next_seq[username] = seq + 1
+            body_start = self.append_record(MESSAGE, seq, username, body)
+            entries = self.index.setdefault(username, deque())
+            entries.append((seq, self.active_id, body_start, len(body)))
+            self.live[self.active_id] += 1
+
+            if len(entries) > self.max_per_user:
+                oldest_seq = entries[len(entries) - self.max_per_user - 1][0]
+                self.append_record(ACK, oldest_seq, username, b'')
+                self.discard_upto(username, oldest_seq)
+                self.collect_segments()
+            self.active_file.flush()
+
+    def pending(self, username):
+        entries = self.index.get(username)
+        return len(entries) if entries else 0
+
+    def take(self, username):
+        """Return every pending body for username, oldest first, and mark them consumed."""
+        with self.lock:
+            entries = self.index.get(username)
+            if not entries:
+                return []
+
+            self.active_file.flush()
+            bodies = self.read_bodies(entries)
+            self.append_record(ACK, entries[-1][0], username, b'')
+            self.active_file.flush()
+            self.discard_upto(username, entries[-1][0])
+            self.collect_segments()
+            return bodies
+
+    #################### HELPER FUNCTIONS ####################
+    def path(self, file_name):
+        return os.path.join(self.directory, file_name)
+
+    def segment_path(self, segment_id):
+        return self.path(f"{SEGMENT_PREFIX}{segment_id:08d}{SEGMENT_SUFFIX}")
+
+    def roll_segment(self, segment_id):
+        if self.active_file is not None:
+            self.active_file.close()
+        self.active_id = segment_id
+        self.active_file = open(self.segment_path(segment_id), 'ab')
+        self.active_size = self.active_file.tell()
+        self.live.setdefault(segment_id, 0)
+
+    def append_record(self, kind, seq, username, body):
+        # returns the offset of the body within the active segment
+        if self.active_size >= self.segment_size:
+            self.roll_segment(self.active_id + 1)
+
+        name = username.encode()
+        record = RECORD_HEADER.pack(kind, seq, len(name), len(body)) + name + body
+        self.active_file.write(record)
+        body_start = self.active_size + RECORD_HEADER.size + len(name)
+        self.active_size += len(record)
+        return body_start
+
+    def discard_upto(self, username, seq):
+        self.acked[username] = max(self.acked.get(username, 0), seq)
+        entries = self.index.get(username)
+        while entries and entries[0][0] <= seq:
+            _, segment_id, _, _ = entries.popleft()
+            self.live[segment_id] -= 1
+        if entries is not None and not entries:
+            del self.index[username]
+
+    def collect_segments(self):
+        consumed = [segment_id for segment_id, count in self.live.items() if not count and segment_id != self.active_id]
+        if not consumed:
+            return
+        # the checkpoint has to be on disk before the ACKs it replaces go
+        self.write_checkpoint()
+        for segment_id in consumed:
+            self.delete_segment(segment_id)
+
+    def write_checkpoint(self):
+        temp_file_name = self.path(CHECKPOINT_FILE + ".tmp")
+        with open(temp_file_name, 'w') as file:
+            json.dump(self.acked, file, separators=(",", ":"))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_file_name, self.path(CHECKPOINT_FILE))
+
+    def delete_segment(self, segment_id):
+        fd = self.read_fds.pop(segment_id, None)
+        if fd is not None:
+            os.close(fd)
+        self.live.pop(segment_id, None)
+        try:
+            os.remove(self.segment_path(segment_id))
+        except FileNotFoundError:
+            pass
+
+    def read_fd(self, segment_id):
+        fd = self.read_fds.get(segment_id)
+        if fd is None:
+            fd = os.open(self.segment_path(segment_id), os.O_RDONLY)
+            self.read_fds[segment_id] = fd
+        return fd
+
+    def read_bodies(self, entries):
+        bodies = []
+        run = []
+        # entries are in seq order, so each segment's entries are contiguous and ascending
+        for entry in entries:
+            if run and run[0][1] != entry[1]:
+                bodies.extend(self.read_run(run))
+                run = []
+            run.append(entry)
+        if run:
+            bodies.extend(self.read_run(run))
+        return bodies
+
+    def read_run(self, run):
+        fd = self.read_fd(run[0][1])
+        span_start = run[0][2]
+        span_end = run[-1][2] + run[-1][3]
+        wanted = sum(length for _, _, _, length in run)
+
+        if span_end - span_start <= MAX_SPAN_READ or span_end - span_start <= 4 * wanted:
+            # one read for the whole run, then slice the records out of it
+            span = os.pread(fd, span_end - span_start, span_start)
+            if len(span) != span_end - span_start:
+                raise MailboxError(f"Mailbox segment {run[0][1]} is shorter than its index")
+            view = memoryview(span)
+            return [bytes(view[offset - span_start:offset - span_start + length]) for _, _, offset, length in run]
+
+        return [os.pread(fd, length, offset) for _, _, offset, length in run]
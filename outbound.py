@@ -0,0 +1,171 @@
+"""
+    Per-connection outbound queues for TCPServer3.py
+    Python 3
+    coding: utf-8
+
+    Nothing but a connection's own writer ever touches its socket for sending.
+    Responses and pushes are appended to the connection's OutboundQueue and the
+    writer drains it, coalescing whatever has piled up into one send. Pushes
+    (messages fanned out from other users) are bounded; when a recipient falls
+    too far behind, the overflow policy decides what happens:
+
+        drop-oldest  discard the oldest queued pushes to make room (default)
+        disconnect   close the recipient's connection
+        mark-slow    flag the recipient as slow and drop new pushes until its
+                     queue has drained to half the limit
+
+    Responses to the connection's own requests are never dropped; the session
+    stops reading requests instead while too many of them are queued.
+"""
+import asyncio
+from collections import deque
+from threading import Condition
+
+
+##################################################
+#                    CONSTANTS                   #
+##################################################
+OVERFLOW_POLICIES = ("drop-oldest", "disconnect", "mark-slow")
+DEFAULT_OVERFLOW_POLICY = "drop-oldest"
+
+# Limits on queued pushes per connection
+DEFAULT_MAX_FRAMES = 1024
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024
+
+
+##################################################
+#               OutboundQueue Class              #
+##################################################
+class OutboundQueue():
+    """Bounded frame queue with the overflow policy; subclasses add the wake-up."""
+    def __init__(self, max_frames=DEFAULT_MAX_FRAMES, max_bytes=DEFAULT_MAX_BYTES, policy=DEFAULT_OVERFLOW_POLICY):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow policy must be one of {', '.join(OVERFLOW_POLICIES)}")
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.policy = policy
+
+        # (frame, droppable) pairs, oldest first
+        self.frames = deque()
+        self.size = 0
+        self.closed = False
+        self.slow = False
+        self.overflowed = False
+        self.dropped = 0
+
+    def is_full(self, extra_bytes):
+        return len(self.frames) >= self.max_frames or self.size + extra_bytes > self.max_bytes
+
+    def enqueue(self, frame, droppable):
+        """Queue frame and return True, or return False if the policy refused it."""
+        if self.closed:
+            return False
+
+        if droppable:
+            if self.slow:
+                if len(self.frames) > self.max_frames // 2 or self.size > self.max_bytes // 2:
+                    self.dropped += 1
+                    return False
+                self.slow = False
+            if self.is_full(len(frame)) and not self.make_room(len(frame)):
+                self.dropped += 1
+                return False
+
+        self.frames.append((frame, droppable))
+        self.size += len(frame)
+        return True
+
+    def make_room(self, extra_bytes):
+        if self.policy == "disconnect":
+            self.overflowed = True
+            self.closed = True
+            return False
+
+        if self.policy == "mark-slow":
+            self.slow = True
+            return False
+
+        # drop-oldest: only pushes may go, responses are skipped over
+        index = 0
+        while self.is_full(extra_bytes) and index < len(self.frames):
+            frame, droppable = self.frames[index]
+            if droppable:
+                del self.frames[index]
+                self.size -= len(frame)
+                self.dropped += 1
+            else:
+                index += 1
+        return not self.is_full(extra_bytes)
+
+    def take_batch(self):
+        batch = [frame for frame, _ in self.frames]
+        self.frames.clear()
+        self.size = 0
+        return batch
+
+    def depth(self):
+        return len(self.frames)
+
+class ThreadedOutboundQueue(OutboundQueue):
+    """Queue drained by a dedicated writer thread (ClientThread)."""
+    def __init__(self, *args, **kwargs):
+        OutboundQueue.__init__(self, *args, **kwargs)
+        self.condition = Condition()
+
+    def put(self, frame, droppable=True):
+        with self.condition:
+            queued = self.enqueue(frame, droppable)
+            if queued or self.closed:
+                self.condition.notify_all()
+            return queued
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def wait_batch(self):
+        """Block for the next batch of frames; None once closed and drained."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.frames or self.closed)
+            if not self.frames:
+                return None
+            batch = self.take_batch()
+            self.condition.notify_all()
+            return batch
+
+    def wait_below(self, limit):
+        with self.condition:
+            self.condition.wait_for(lambda: self.size <= limit or self.closed)
+
+class AsyncOutboundQueue(OutboundQueue):
+    """Queue drained by a writer coroutine; only used from the event loop thread."""
+    def __init__(self, *args, **kwargs):
+        OutboundQueue.__init__(self, *args, **kwargs)
+        self.ready = asyncio.Event()
+        self.drained = asyncio.Event()
+
+    def put(self, frame, droppable=True):
+        queued = self.enqueue(frame, droppable)
+        if queued or self.closed:
+            self.ready.set()
+        return queued
+
+    def close(self):
+        self.closed = True
+        self.ready.set()
+
+    async def wait_batch(self):
+        while not self.frames:
+            if self.closed:
+                return None
+            self.ready.clear()
+            await self.ready.wait()
+        batch = self.take_batch()
+        self.drained.set()
+        return batch
+
+    async def wait_below(self, limit):
+        while self.size > limit and not self.closed:
+            self.drained.clear()
+            await self.drained.wait()
@@ -0,0 +1,655 @@
+"""
+    Reliable UDP file transfer for /p2pvideo
+    Python 3
+    coding: utf-8
+
+    Datagram types (all integers big-endian):
+
+        INIT      type | transfer id | file size (8) | chunk size (2) | filename \\0 sender
+        INIT_ACK  type | transfer id | chunk size (2)
+        DATA      type | transfer id | seq | payload
+        ACK       type | transfer id | cumulative | range count (1) | (start, end) * count
+
+    The sender retransmits INIT until it is acknowledged, then streams
+    sequence-numbered chunks under a congestion window. The receiver answers with
+    a cumulative ack (every chunk below it has arrived) plus selective-ack ranges
+    for chunks received above it. Chunks the receiver has skipped over several
+    times are retransmitted straight away; anything else unacknowledged after the
+    retransmission timeout is resent too. Sending is paced at cwnd / smoothed RTT,
+    so the rate follows the measured RTT and loss instead of a fixed sleep.
+
+    The INIT carries the chunk size the sender would like; the receiver answers
+    with the largest size it accepts up to that. The sender memory-maps the file
+    and sends memoryview slices of it with sendmsg(), so no chunk is copied into
+    a new bytes object, and where the kernel supports UDP segmentation offload it
+    hands up to 64 datagrams to a single sendmsg() call.
+
+    Anything can arrive on the receiving port, so the receiver drops datagrams
+    it cannot decode, and INITs whose names are not plain file names or whose
+    sizes are out of bounds, instead of failing on them. Files are preallocated
+    at their announced size, so INITs that would take the space reserved by
+    the transfers in progress past max_reserved go unanswered until some
+    finish.
+"""
+import errno
+import heapq
+import logging
+import mmap
+import os
+import random
+import re
+import select
+import struct
+import time
+from collections import OrderedDict
+
+
+##################################################
+#                    CONSTANTS                   #
+##################################################
+INIT = 1
+INIT_ACK = 2
+DATA = 3
+ACK = 4
+
+PACKET_HEADER = struct.Struct("!BI")
+INIT_HEADER = struct.Struct("!BIQH")
+INIT_ACK_HEADER = struct.Struct("!BIH")
+DATA_HEADER = struct.Struct("!BII")
+ACK_HEADER = struct.Struct("!BIIB")
+SACK_RANGE = struct.Struct("!II")
+MAX_SACK_RANGES = 32
+
+MAX_DATAGRAM_SIZE = 65507
+# Fits a 1500 byte Ethernet MTU after the IP, UDP and DATA headers
+DEFAULT_CHUNK_SIZE = 1400
+MIN_CHUNK_SIZE = 64
+MAX_CHUNK_SIZE = MAX_DATAGRAM_SIZE - DATA_HEADER.size
+# Largest file a peer may announce; the receiver allocates it up front
+MAX_FILE_SIZE = 4 * 1024 * 1024 * 1024
+
+# Linux UDP segmentation offload (setsockopt/cmsg option UDP_SEGMENT on SOL_UDP)
+SOL_UDP = 17
+UDP_SEGMENT = 103
+GSO_MAX_SEGMENTS = 64
+GSO_MAX_BYTES = 65000
+# What sendmsg() fails with where the kernel or the route cannot segment
+GSO_UNSUPPORTED_ERRORS = (errno.EINVAL, errno.ENOPROTOOPT, errno.EIO)
+
+# Congestion window, in chunks
+INITIAL_WINDOW = 16
+MIN_WINDOW = 2
+MAX_WINDOW = 8192
+# Chunks the receiver must have acknowledged past a gap before the gap counts as lost
+DUPLICATE_THRESHOLD = 3
+# Send a little faster than cwnd / RTT so the window, not pacing, is the limit
+PACING_GAIN = 1.25
+MAX_BURST = 32
+
+# Retransmission timeout bounds, in seconds
+INITIAL_RTO = 0.5
+MIN_RTO = 0.05
+MAX_RTO = 5.0
+HANDSHAKE_ATTEMPTS = 10
+# Give up when this many timeouts in a row pass without any progress
+MAX_CONSECUTIVE_TIMEOUTS = 10
+
+# Receiver acknowledges every ACK_EVERY in-order chunks, or after ACK_DELAY seconds
+ACK_EVERY = 2
+ACK_DELAY = 0.01
+# Completed transfers remembered so a lost final ACK can be resent
+FINISHED_TRANSFERS_KEPT = 64
+# Incoming transfers handled at once, and how long a silent one is kept
+MAX_CONCURRENT_TRANSFERS = 16
+TRANSFER_IDLE_TIMEOUT = 30.0
+# Disk space preallocated for the incoming transfers at once
+MAX_RESERVED_BYTES = MAX_FILE_SIZE
+
+# Bitmap scanning: bytes with at least one chunk received / missing
+NONZERO_BYTE = re.compile(b"[^\\x00]")
+NOT_FULL_BYTE = re.compile(b"[^\\xff]")
+
+log = logging.getLogger(__name__)
+
+
+class TransferError(Exception):
+    pass
+
+
+##################################################
+#                  Packet Helpers                #
+##################################################
+def encode_init(transfer_id, file_size, chunk_size, filename, sender):
+    names = f"{filename}\0{sender}".encode()
+    return INIT_HEADER.pack(INIT, transfer_id, file_size, chunk_size) + names
+
+def decode_init(packet):
+    # ValueError (UnicodeDecodeError included) if the packet is malformed
+    if len(packet) < INIT_HEADER.size:
+        raise ValueError("INIT packet too short")
+    _, transfer_id, file_size, chunk_size = INIT_HEADER.unpack_from(packet)
+    names = packet[INIT_HEADER.size:].decode()
+    if "\0" not in names:
+        raise ValueError("INIT packet without a sender")
+    filename, sender = names.split("\0", 1)
+    return transfer_id, file_size, chunk_size, filename, sender
+
+def encode_ack(transfer_id, cumulative, ranges):
+    ranges = ranges[:MAX_SACK_RANGES]
+    return ACK_HEADER.pack(ACK, transfer_id, cumulative, len(ranges)) + b''.join(
+        [SACK_RANGE.pack(start, end) for start, end in ranges])
+
+def encode_init_ack(transfer_id, chunk_size):
+    return INIT_ACK_HEADER.pack(INIT_ACK, transfer_id, chunk_size)
+
+def decode_ack(packet):
+    if len(packet) < ACK_HEADER.size:
+        raise ValueError("ACK packet too short")
+    _, transfer_id, cumulative, count = ACK_HEADER.unpack_from(packet)
+    if len(packet) < ACK_HEADER.size + count * SACK_RANGE.size:
+        raise ValueError("ACK packet shorter than its ranges")
+    ranges = [SACK_RANGE.unpack_from(packet, ACK_HEADER.size + i * SACK_RANGE.size) for i in range(count)]
+    return transfer_id, cumulative, ranges
+
+def chunk_count(file_size, chunk_size):
+    return (file_size + chunk_size - 1) // chunk_size
+
+def plain_name(name):
+    """name, if it is a single path component that stays in the directory it is put in."""
+    if name in ("", ".", "..") or "/" in name or "\\" in name or "\0" in name or os.path.basename(name) != name:
+        raise ValueError(f"{name!r} is not a plain file name")
+    return name
+
+
+##################################################
+#                  Sender Class                  #
+##################################################
+class ReliableSender():
+    def __init__(self, sock, address, chunk_size=DEFAULT_CHUNK_SIZE, max_window=MAX_WINDOW):
+        self.sock = sock
+        self.address = address
+        if not MIN_CHUNK_SIZE <= chunk_size <= MAX_CHUNK_SIZE:
+            raise ValueError(f"chunk size must be between {MIN_CHUNK_SIZE} and {MAX_CHUNK_SIZE}")
+        self.chunk_size = chunk_size
+        self.max_window = max_window
+        self.transfer_id = random.getrandbits(32)
+        self.use_gso = hasattr(sock, "sendmsg")
+
+        self.srtt = None
+        self.rttvar = None
+        self.rto = INITIAL_RTO
+        self.cwnd = INITIAL_WINDOW
+        self.ssthresh = max_window
+
+        self.packets_sent = 0
+        self.retransmissions = 0
+        self.send_calls = 0
+
+    #################### RTT ESTIMATION ####################
+    def add_rtt_sample(self, rtt):
+        # RFC 6298 smoothing
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(MAX_RTO, max(MIN_RTO, self.srtt + 4 * self.rttvar))
+
+    def pacing_rate(self):
+        # chunks per second
+        return PACING_GAIN * self.cwnd / max(self.srtt or INITIAL_RTO, 1e-4)
+
+    #################### TRANSFER ####################
+    def send_file(self, filename, sender_name):
+        file_size = os.path.getsize(filename)
+        if file_size > MAX_FILE_SIZE:
+            raise TransferError(f"Files over {MAX_FILE_SIZE} bytes cannot be sent")
+        self.sock.setblocking(False)
+        with open(filename, 'rb') as file:
+            try:
+                self.handshake(encode_init(self.transfer_id, file_size, self.chunk_size,
+                                           os.path.basename(filename), sender_name))
+                if file_size == 0:
+                    return
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    view = memoryview(mapped)
+                    try:
+                        self.transfer(view, chunk_count(file_size, self.chunk_size))
+                    finally:
+                        view.release()
+            except OSError as e:
+                raise TransferError(f"Sending failed: {e}") from e
+
+    def handshake(self, init_packet):
+        for _ in range(HANDSHAKE_ATTEMPTS):
+            sent_at = time.monotonic()
+            self.send_when_writable(self.sock.sendto, init_packet, self.address)
+            deadline = sent_at + self.rto
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                readable, _, _ = select.select([self.sock], [], [], remaining)
+                if not readable:
+                    break
+                packet = self.receive()
+                if packet is None or packet[0] != INIT_ACK or len(packet) < INIT_ACK_HEADER.size:
+                    continue
+                _, transfer_id, chunk_size = INIT_ACK_HEADER.unpack_from(packet)
+                if transfer_id != self.transfer_id:
+                    continue
+                if not MIN_CHUNK_SIZE <= chunk_size <= self.chunk_size:
+                    raise TransferError(f"The recipient asked for an unusable chunk size of {chunk_size} bytes")
+                # the recipient may only lower the chunk size we offered
+                self.chunk_size = chunk_size
+                self.add_rtt_sample(time.monotonic() - sent_at)
+                return
+            self.rto = min(MAX_RTO, self.rto * 2)
+        raise TransferError("The recipient did not answer the transfer request")
+
+    def send_when_writable(self, send, *args):
+        # the socket is non-blocking for reading acks, so a full send buffer
+        # raises instead of waiting; wait for room and try again
+        while True:
+            try:
+                return send(*args)
+            except BlockingIOError:
+                select.select([], [self.sock], [], self.rto)
+
+    def receive(self):
+        try:
+            packet, _ = self.sock.recvfrom(MAX_DATAGRAM_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return None
+        return packet if len(packet) >= PACKET_HEADER.size else None
+
+    def send_chunks(self, view, seqs):
+        # full-size chunks share one segment size, so the short last chunk of the
+        # file can only go at the end of a GSO batch
+        chunk_size = self.chunk_size
+        segment_size = DATA_HEADER.size + chunk_size
+        per_call = min(GSO_MAX_SEGMENTS, GSO_MAX_BYTES // segment_size) if self.use_gso else 1
+
+        start = 0
+        while start < len(seqs):
+            batch = seqs[start:start + per_call]
+            buffers = []
+            for index, seq in enumerate(batch):
+                payload = view[seq * chunk_size:(seq + 1) * chunk_size]
+                buffers.append(DATA_HEADER.pack(DATA, self.transfer_id, seq))
+                buffers.append(payload)
+                if len(payload) < chunk_size:
+                    batch = batch[:index + 1]
+                    break
+
+            if len(batch) > 1:
+                try:
+                    self.send_when_writable(self.sock.sendmsg, buffers,
+                                            [(SOL_UDP, UDP_SEGMENT, struct.pack("=H", segment_size))], 0, self.address)
+                except OSError as e:
+                    if e.errno not in GSO_UNSUPPORTED_ERRORS:
+                        raise
+                    # no segmentation offload here, send one datagram per call from now on
+                    self.use_gso = False
+                    per_call = 1
+                    continue
+            elif self.use_gso:
+                self.send_when_writable(self.sock.sendmsg, buffers, [], 0, self.address)
+            else:
+                self.send_when_writable(self.sock.sendto, b''.join(buffers), self.address)
+
+            self.send_calls += 1
+            self.packets_sent += len(batch)
+            start += len(batch)
+
+    def transfer(self, view, total):
+        acked = bytearray(total)
+        cumulative = 0
+        # seq -> (send time, retransmitted), oldest send first
+        in_flight = OrderedDict()
+        lost = []
+        next_new = 0
+        loss_scan = 0
+        recovery_point = 0
+        tokens = float(MAX_BURST)
+        last_refill = time.monotonic()
+        timeouts = 0
+
+        while cumulative < total:
+            now = time.monotonic()
+
+            # retransmission timeout on the oldest outstanding chunk
+            if in_flight:
+                oldest_seq, (sent_at, _) = next(iter(in_flight.items()))
+                if now - sent_at > self.rto:
+                    timeouts += 1
+                    if timeouts > MAX_CONSECUTIVE_TIMEOUTS:
+                        raise TransferError("The recipient stopped acknowledging the transfer")
+                    for seq in in_flight:
+                        heapq.heappush(lost, seq)
+                    in_flight.clear()
+                    self.ssthresh = max(self.cwnd / 2, MIN_WINDOW)
+                    self.cwnd = MIN_WINDOW
+                    self.rto = min(MAX_RTO, self.rto * 2)
+                    recovery_point = next_new
+
+            # paced sending within the window
+            rate = self.pacing_rate()
+            tokens = min(MAX_BURST, tokens + (now - last_refill) * rate)
+            last_refill = now
+            batch = []
+            while tokens >= 1 and len(in_flight) < self.cwnd:
+                if lost:
+                    seq = heapq.heappop(lost)
+                    if acked[seq] or seq in in_flight:
+                        continue
+                    retransmitted = True
+                    self.retransmissions += 1
+                elif next_new < total:
+                    seq = next_new
+                    next_new += 1
+                    retransmitted = False
+                else:
+                    break
+                batch.append(seq)
+                in_flight[seq] = (now, retransmitted)
+                tokens -= 1
+            if batch:
+                self.send_chunks(view, batch)
+
+            # wait for acks until the next chunk may be sent or the oldest one times out
+            can_send = len(in_flight) < self.cwnd and (lost or next_new < total)
+            timeout = self.rto
+            if in_flight:
+                timeout = max(0.0, next(iter(in_flight.values()))[0] + self.rto - now)
+            if can_send:
+                timeout = min(timeout, max(0.0, (1 - tokens) / rate))
+            readable, _, _ = select.select([self.sock], [], [], timeout)
+            if not readable:
+                continue
+
+            while True:
+                packet = self.receive()
+                if packet is None:
+                    break
+                if packet[0] != ACK:
+                    continue
+                try:
+                    transfer_id, new_cumulative, ranges = decode_ack(packet)
+                except ValueError:
+                    continue
+                if transfer_id != self.transfer_id:
+                    continue
+
+                now = time.monotonic()
+                timeouts = 0
+                newly_acked = []
+                for seq in range(cumulative, min(new_cumulative, total)):
+                    if not acked[seq]:
+                        acked[seq] = 1
+                        newly_acked.append(seq)
+                cumulative = max(cumulative, new_cumulative)
+                highest = cumulative - 1
+                for start, end in ranges:
+                    for seq in range(max(start, cumulative), min(end, total)):
+                        if not acked[seq]:
+                            acked[seq] = 1
+                            newly_acked.append(seq)
+                    highest = max(highest, end - 1)
+
+                for seq in newly_acked:
+                    entry = in_flight.pop(seq, None)
+                    # Karn's rule: only time chunks that were sent once
+                    if entry is not None and not entry[1]:
+                        self.add_rtt_sample(now - entry[0])
+                    if self.cwnd < self.ssthresh:
+                        self.cwnd += 1
+                    else:
+                        self.cwnd += 1 / self.cwnd
+                self.cwnd = min(self.cwnd, self.max_window)
+
+                # chunks passed over by DUPLICATE_THRESHOLD later acks are lost
+                for seq in range(max(loss_scan, cumulative), highest - DUPLICATE_THRESHOLD + 1):
+                    if not acked[seq] and seq in in_flight:
+                        del in_flight[seq]
+                        heapq.heappush(lost, seq)
+                        if seq >= recovery_point:
+                            # one window cut per round trip of losses
+                            self.ssthresh = max(self.cwnd / 2, MIN_WINDOW)
+                            self.cwnd = self.ssthresh
+                            recovery_point = next_new
+                loss_scan = max(loss_scan, highest - DUPLICATE_THRESHOLD + 1)
+
+
+##################################################
+#                 Receiver Class                 #
+##################################################
+class ReceivedBitmap():
+    """One bit per chunk, set once the chunk has been written."""
+    def __init__(self, total):
+        self.bits = bytearray((total + 7) // 8)
+        self.total = total
+
+    def __contains__(self, seq):
+        return self.bits[seq >> 3] & (1 << (seq & 7)) != 0
+
+    def add(self, seq):
+        self.bits[seq >> 3] |= 1 << (seq & 7)
+
+    def next_set(self, seq):
+        return self.scan(seq, NONZERO_BYTE, True)
+
+    def next_clear(self, seq):
+        return self.scan(seq, NOT_FULL_BYTE, False)
+
+    def scan(self, seq, byte_pattern, wanted):
+        # first seq >= seq whose bit equals wanted, or total if there is none;
+        # whole bytes that cannot match are skipped by the regex in C
+        while seq < self.total:
+            if seq & 7:
+                if (seq in self) == wanted:
+                    return seq
+                seq += 1
+                continue
+            match = byte_pattern.search(self.bits, seq >> 3)
+            if match is None:
+                return self.total
+            seq = max(seq, match.start() << 3)
+            for bit in range(8):
+                if seq + bit >= self.total:
+                    return self.total
+                if (seq + bit in self) == wanted:
+                    return seq + bit
+            seq += 8
+        return self.total
+
+class IncomingTransfer():
+    def __init__(self, address, transfer_id, file_size, chunk_size, filename, sender, output_name):
+        self.address = address
+        self.transfer_id = transfer_id
+        self.file_size = file_size
+        self.chunk_size = chunk_size
+        self.filename = filename
+        self.sender = sender
+        self.output_name = output_name
+        self.total = chunk_count(file_size, chunk_size)
+
+        # chunks are written straight to their offset, in whatever order they arrive
+        self.fd = os.open(output_name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        if file_size:
+            try:
+                os.posix_fallocate(self.fd, 0, file_size)
+            except (AttributeError, OSError):
+                try:
+                    os.ftruncate(self.fd, file_size)
+                except OSError:
+                    self.abandon()
+                    raise
+
+        self.received = ReceivedBitmap(self.total)
+        self.received_count = 0
+        self.cumulative = 0
+        self.highest = -1
+        self.unacked = 0
+        self.last_activity = time.monotonic()
+
+    def add_chunk(self, seq, payload):
+        """Store a chunk; returns True if it was new and in order."""
+        self.last_activity = time.monotonic()
+        if seq >= self.total or seq in self.received:
+            return False
+        expected = min(self.chunk_size, self.file_size - seq * self.chunk_size)
+        if len(payload) != expected:
+            return False
+
+        os.pwrite(self.fd, payload, seq * self.chunk_size)
+        self.received.add(seq)
+        self.received_count += 1
+        self.highest = max(self.highest, seq)
+
+        in_order = seq == self.cumulative
+        if in_order:
+            self.cumulative = self.received.next_clear(seq)
+        return in_order
+
+    def sack_ranges(self):
+        ranges = []
+        seq = self.cumulative
+        while seq <= self.highest and len(ranges) < MAX_SACK_RANGES:
+            start = self.received.next_set(seq)
+            if start > self.highest:
+                break
+            seq = self.received.next_clear(start)
+            ranges.append((start, seq))
+        return ranges
+
+    def ack_packet(self):
+        self.unacked = 0
+        return encode_ack(self.transfer_id, self.cumulative, self.sack_ranges())
+
+    def is_complete(self):
+        return self.received_count >= self.total
+
+    def close(self):
+        os.close(self.fd)
+
+    def abandon(self):
+        self.close()
+        try:
+            os.remove(self.output_name)
+        except OSError:
+            pass
+
+class TransferReceiver():
+    """Handles every datagram arriving on the client's UDP port.
+
+    Transfers are keyed by (sender address, transfer id), so any number of
+    peers can send at once without their chunks mixing. handle() returns the
+    IncomingTransfer it just completed, if any, and drops packets it cannot
+    use rather than raising.
+    """
+    def __init__(self, sock, output_name, max_chunk_size=MAX_CHUNK_SIZE, max_reserved=MAX_RESERVED_BYTES):
+        self.sock = sock
+        self.max_chunk_size = max_chunk_size
+        self.max_reserved = max_reserved
+        # output_name(sender, filename) -> path to write the received file to
+        self.output_name = output_name
+        self.transfers = {}
+        self.finished = OrderedDict()
+
+    def handle(self, packet, address):
+        try:
+            return self.handle_packet(packet, address)
+        except ValueError as e:
+            log.warning("Dropped an invalid packet from %s: %s", address, e)
+        except OSError as e:
+            log.warning("Could not handle a packet from %s: %s", address, e)
+        return None
+
+    def handle_packet(self, packet, address):
+        if len(packet) < PACKET_HEADER.size:
+            return None
+        kind, transfer_id = PACKET_HEADER.unpack_from(packet)
+        key = (address, transfer_id)
+
+        if kind == INIT:
+            return self.handle_init(packet, address)
+
+        if kind == DATA and len(packet) >= DATA_HEADER.size:
+            transfer = self.transfers.get(key)
+            if transfer is None:
+                # a retransmission after we finished: the final ACK was lost
+                if key in self.finished:
+                    self.sock.sendto(encode_ack(transfer_id, self.finished[key], []), address)
+                return None
+
+            _, _, seq = DATA_HEADER.unpack_from(packet)
+            in_order = transfer.add_chunk(seq, memoryview(packet)[DATA_HEADER.size:])
+            transfer.unacked += 1
+            if not in_order or transfer.unacked >= ACK_EVERY or transfer.is_complete():
+                self.sock.sendto(transfer.ack_packet(), address)
+            if transfer.is_complete():
+                return self.finish(key, transfer)
+        return None
+
+    def handle_init(self, packet, address):
+        transfer_id, file_size, chunk_size, filename, sender = decode_init(packet)
+        key = (address, transfer_id)
+        if file_size > MAX_FILE_SIZE:
+            raise ValueError(f"a {file_size} byte file is over the {MAX_FILE_SIZE} byte limit")
+        if chunk_size < MIN_CHUNK_SIZE:
+            raise ValueError(f"a chunk size of {chunk_size} bytes is under the {MIN_CHUNK_SIZE} byte minimum")
+        # never let a peer choose where the file lands: both names go into the output name
+        filename = plain_name(os.path.basename(filename))
+        sender = plain_name(sender)
+        # accept the offered chunk size up to what we are willing to receive
+        chunk_size = min(chunk_size, self.max_chunk_size)
+        transfer = self.transfers.get(key)
+        if transfer is not None:
+            # our INIT_ACK was lost, just repeat it
+            self.sock.sendto(encode_init_ack(transfer_id, transfer.chunk_size), address)
+            return None
+        if key in self.finished:
+            self.sock.sendto(encode_init_ack(transfer_id, chunk_size), address)
+            return None
+
+        self.expire_transfers()
+        if len(self.transfers) >= MAX_CONCURRENT_TRANSFERS:
+            # stay silent; the sender retries and eventually gives up
+            return None
+        reserved = sum(active.file_size for active in self.transfers.values())
+        if reserved + file_size > self.max_reserved:
+            log.debug("Not enough room reserved for %s from %s yet", filename, sender)
+            return None
+
+        transfer = IncomingTransfer(address, transfer_id, file_size, chunk_size, filename, sender,
+                                    self.output_name(sender, filename))
+        self.transfers[key] = transfer
+        self.sock.sendto(encode_init_ack(transfer_id, chunk_size), address)
+        if transfer.is_complete():
+            return self.finish(key, transfer)
+        return None
+
+    def flush_acks(self):
+        # called when the socket has been idle for ACK_DELAY
+        for transfer in self.transfers.values():
+            if transfer.unacked:
+                self.sock.sendto(transfer.ack_packet(), transfer.address)
+        self.expire_transfers()
+
+    def expire_transfers(self):
+        now = time.monotonic()
+        for key, transfer in list(self.transfers.items()):
+            if now - transfer.last_activity > TRANSFER_IDLE_TIMEOUT:
+                log.warning("Transfer of %s from %s timed out", transfer.filename, transfer.sender)
+                transfer.abandon()
+                del self.transfers[key]
+
+    def finish(self, key, transfer):
+        transfer.close()
+        del self.transfers[key]
+        self.finished[key] = transfer.total
+        if len(self.finished) > FINISHED_TRANSFERS_KEPT:
+            self.finished.popitem(last=False)
+        return transfer
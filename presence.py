@@ -0,0 +1,129 @@
+"""
+    In-memory presence table for TCPServer3.py
+    Python 3
+    coding: utf-8
+
+    The table is the source of truth for who is online. Logins and logouts only
+    change it in memory, and a background thread periodically rewrites
+    userlog.txt from it in the assignment's format:
+
+        active user sequence number; timestamp; username; client IP; UDP port
+
+    Nothing is replayed at startup, since every server start begins with nobody
+    online, so the file only has to catch up within COMPACTION_INTERVAL.
+
+    on_login and on_logout, when set, are called with the username after a
+    change, so indexes kept elsewhere can follow who is online.
+"""
+import os
+import time
+from collections import OrderedDict
+from threading import Thread, Lock, Event
+
+
+##################################################
+#                    CONSTANTS                   #
+##################################################
+USER_LOG_FILE = 'userlog.txt'
+
+# Seconds between background rewrites of userlog.txt (only when something changed)
+COMPACTION_INTERVAL = 1.0
+
+
+def generate_formatted_time():
+    return f"{time.strftime('%d %b %Y %H:%M:%S', time.localtime())}"
+
+
+##################################################
+#                 Presence Class                 #
+##################################################
+class PresenceEntry():
+    __slots__ = ("username", "since", "client_ip", "udp_port")
+
+    def __init__(self, username, since, client_ip, udp_port):
+        self.username = username
+        self.since = since
+        self.client_ip = client_ip
+        self.udp_port = udp_port
+
+class PresenceTable():
+    def __init__(self, log_file_name=USER_LOG_FILE):
+        self.log_file_name = log_file_name
+        # maps username to PresenceEntry, kept in login order
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.dirty = False
+        self.stopped = Event()
+        self.compaction_thread = None
+        self.on_login = None
+        self.on_logout = None
+
+    def __contains__(self, username):
+        return username in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, username):
+        return self.entries.get(username)
+
+    def login(self, username, client_ip, udp_port, since=None):
+        # since is given when replaying a login that happened in another process
+        since = since or generate_formatted_time()
+        with self.lock:
+            # a repeated login moves the user to the end, as a fresh log line would
+            self.entries.pop(username, None)
+            self.entries[username] = PresenceEntry(username, since, client_ip, udp_port)
+            self.dirty = True
+        if self.on_login is not None:
+            self.on_login(username)
+        return since
+
+    def logout(self, username):
+        with self.lock:
+            if self.entries.pop(username, None) is None:
+                return False
+            self.dirty = True
+        if self.on_logout is not None:
+            self.on_logout(username)
+        return True
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.entries.values())
+
+    #################### COMPACTION ####################
+    def compact(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            entries = list(self.entries.values())
+            self.dirty = False
+
+        lines = [f"{number}; {entry.since}; {entry.username}; {entry.client_ip}; {entry.udp_port}\n"
+                 for number, entry in enumerate(entries, start=1)]
+        temp_file_name = self.log_file_name + ".tmp"
+        with open(temp_file_name, 'w') as file:
+            file.writelines(lines)
+        os.replace(temp_file_name, self.log_file_name)
+
+    def start(self, interval=COMPACTION_INTERVAL):
+        # every server start begins with nobody online
+        with open(self.log_file_name, 'w'):
+            pass
+
+        def run():
+            while not self.stopped.wait(interval):
+                self.compact()
+
+        self.compaction_thread = Thread(target=run, name="userlog-compactor", daemon=True)
+        self.compaction_thread.start()
+
+    def stop(self):
+        if self.compaction_thread is None:
+            # never started, as in a --workers worker
+            return
+        self.stopped.set()
+        self.compaction_thread.join()
+        self.compaction_thread = None
+        self.compact()
@@ -0,0 +1,116 @@
+"""
+    Wire protocol shared by TCPServer3.py and TCPClient3.py
+    Python 3
+    coding: utf-8
+
+    Every message on the TCP connection is a frame: a 9-byte big-endian header
+    (payload length, request id, flags) followed by the payload (a UTF-8 request
+    line from the client, or a JSON response/push from the server). Frames may
+    be split across or packed into any number of recv() calls, so readers feed
+    whatever bytes arrive into a FrameDecoder and get back only complete frames.
+
+    The client picks a request id for every request and the server echoes it in
+    the response, so a connection can have many requests outstanding and match
+    replies in any order. Messages the server sends unasked (pushes) carry
+    NO_REQUEST_ID and have FLAG_PUSH set. FLAG_BINARY marks a payload in the
+    binary codec of codec.py rather than JSON, and FLAG_COMPRESSED a payload that
+    inflates to further frames (compression.py).
+"""
+import struct
+
+
+##################################################
+#                    CONSTANTS                   #
+##################################################
+# payload length, request id, flags
+FRAME_HEADER = struct.Struct("!IIB")
+FRAME_HEADER_SIZE = FRAME_HEADER.size
+
+# Frame flags
+FLAG_PUSH = 0x01
+FLAG_BINARY = 0x02
+FLAG_COMPRESSED = 0x04
+
+# Request ids are chosen by the client; 0 is never used for a request
+NO_REQUEST_ID = 0
+MAX_REQUEST_ID = 0xFFFFFFFF
+
+# Frames larger than this are treated as a protocol error rather than buffered
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+# Bytes to read per recv() call on either side of the connection
+RECV_BUFFER_SIZE = 64 * 1024
+
+# Seconds a client may go without sending anything before it sends /heartbeat;
+# the server drops connections that stay silent for a few of these
+HEARTBEAT_INTERVAL = 30.0
+
+
+##################################################
+#                     FRAMING                    #
+##################################################
+class FrameError(Exception):
+    pass
+
+def encode_frame(payload, request_id=NO_REQUEST_ID, flags=0):
+    if len(payload) > MAX_FRAME_SIZE:
+        raise FrameError(f"Frame of {len(payload)} bytes exceeds the {MAX_FRAME_SIZE} byte limit")
+    return FRAME_HEADER.pack(len(payload), request_id, flags) + payload
+
+def encode_push(payload, flags=0):
+    return encode_frame(payload, NO_REQUEST_ID, FLAG_PUSH | flags)
+
+def encode_frames(payloads, flags=0):
+    # several frames in one buffer, so they can go out in a single send
+    return b''.join([encode_frame(payload, NO_REQUEST_ID, flags) for payload in payloads])
+
+def next_request_id(request_id):
+    """The id to use after request_id, wrapping around and skipping NO_REQUEST_ID."""
+    return request_id + 1 if request_id < MAX_REQUEST_ID else 1
+
+class FrameDecoder():
+    """Incremental length-prefix decoder.
+
+    Bytes are appended to one bytearray that is kept for the lifetime of the
+    connection; consumed bytes are only compacted away once they make up most of
+    the buffer, so a steady stream of small frames does not reallocate it.
+    """
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray()
+        self._start = 0
+
+    def feed(self, data):
+        """Add received bytes and return the (request_id, flags, payload) tuples
+        of the frames they completed."""
+        buffer = self._buffer
+        buffer += data
+        frames = []
+        start = self._start
+        end = len(buffer)
+
+        while end - start >= FRAME_HEADER_SIZE:
+            length, request_id, flags = FRAME_HEADER.unpack_from(buffer, start)
+            if length > self.max_frame_size:
+                raise FrameError(f"Incoming frame of {length} bytes exceeds the {self.max_frame_size} byte limit")
+            if end - start - FRAME_HEADER_SIZE < length:
+                break
+
+            start += FRAME_HEADER_SIZE
+            frames.append((request_id, flags, bytes(buffer[start:start + length])))
+            start += length
+
+        # drop consumed bytes once they are the bulk of the buffer
+        if start == end:
+            del buffer[:]
+            start = 0
+        elif start > len(buffer) // 2:
+            del buffer[:start]
+            start = 0
+
+        self._start = start
+        return frames
+
+    def pending(self):
+        """Number of buffered bytes belonging to a frame that is not complete yet."""
+        return len(self._buffer) - self._start
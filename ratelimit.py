@@ -0,0 +1,158 @@
+"""
+    Token-bucket rate limiting for TCPServer3.py
+    Python 3
+    coding: utf-8
+
+    Every request is charged against a bucket for its command class before the
+    handler runs. Buckets refill at a steady rate up to a burst size; a request
+    that finds its bucket empty is refused with TOO_MANY_REQUESTS and told how
+    long until a token is available. Login requests are limited per
+    connection, everything else per user, so reconnecting does not reset a
+    user's buckets.
+
+    Nothing is limited unless asked for: limits are given per class as
+    CLASS=RATE/BURST, e.g. group=20/50, and a class without one (or with a
+    rate of 0) is let through.
+"""
+import time
+from threading import Lock
+
+
+##################################################
+#                    CONSTANTS                   #
+##################################################
+TOO_MANY_REQUESTS = 429
+
+# Command classes and the requests in them
+COMMAND_CLASSES = {
+    "[loginusername]": "login",
+    "[loginpassword]": "login",
+    "/msgto": "message",
+    "/groupmsg": "group",
+    "/activeuser": "query",
+    "/grouphistory": "query",
+    "/metrics": "query",
+    "/creategroup": "membership",
+    "/joingroup": "membership",
+    "/logout": None,    # leaving is never limited
+    "/heartbeat": None,
+}
+OTHER_CLASS = "other"
+
+# Classes limited per connection rather than per user
+PER_CONNECTION_CLASSES = ("login",)
+
+# Classes a limit can be set for
+LIMIT_CLASSES = ("login", "message", "group", "query", "membership", OTHER_CLASS)
+
+# Seconds between sweeps that forget users whose buckets have refilled
+PRUNE_INTERVAL = 60.0
+
+
+def parse_limit(spec):
+    """Parse CLASS=RATE/BURST into (class, (rate, burst))."""
+    command_class, _, value = spec.partition("=")
+    rate, _, burst = value.partition("/")
+    if command_class not in LIMIT_CLASSES or not rate:
+        raise ValueError(f"expected CLASS=RATE/BURST with CLASS one of {', '.join(LIMIT_CLASSES)}")
+    rate = float(rate)
+    burst = int(burst) if burst else max(1, int(rate))
+    return command_class, (rate, burst)
+
+def command_class(command):
+    return COMMAND_CLASSES.get(command, OTHER_CLASS)
+
+
+##################################################
+#                TokenBucket Class               #
+##################################################
+class TokenBucket():
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def take(self, now):
+        """Take a token and return 0, or return the seconds until one is available."""
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self, now):
+        self.refill(now)
+        return self.tokens >= self.burst
+
+
+##################################################
+#                RateLimiter Class               #
+##################################################
+class RateLimiter():
+    def __init__(self, limits=None):
+        # maps class to (tokens per second, burst); a rate of 0 is no limit
+        self.limits = {command_class: (0.0, 0) for command_class in LIMIT_CLASSES}
+        self.limits.update(limits or {})
+
+        self.lock = Lock()
+        # maps username to {class: TokenBucket}
+        self.users = {}
+        self.last_prune = time.monotonic()
+        # per class: requests let through and requests refused
+        self.allowed = {command_class: 0 for command_class in self.limits}
+        self.limited = {command_class: 0 for command_class in self.limits}
+
+    def check(self, command, username, connection_buckets):
+        """Charge one request; returns 0 if it may run, else the seconds to wait.
+
+        connection_buckets is a dict owned by the connection, used for classes
+        limited per connection and before the user has logged in."""
+        limited_class = command_class(command)
+        if limited_class is None:
+            return 0.0
+        rate, burst = self.limits[limited_class]
+        if rate <= 0:
+            return 0.0
+
+        now = time.monotonic()
+        with self.lock:
+            if username is None or limited_class in PER_CONNECTION_CLASSES:
+                buckets = connection_buckets
+            else:
+                buckets = self.users.get(username)
+                if buckets is None:
+                    buckets = self.users[username] = {}
+                if now - self.last_prune >= PRUNE_INTERVAL:
+                    self.prune(now)
+
+            bucket = buckets.get(limited_class)
+            if bucket is None:
+                bucket = buckets[limited_class] = TokenBucket(rate, burst, now)
+            retry_after = bucket.take(now)
+
+            if retry_after:
+                self.limited[limited_class] += 1
+            else:
+                self.allowed[limited_class] += 1
+            return retry_after
+
+    def prune(self, now):
+        # a user whose buckets are all full is no different from one never seen
+        idle = [username for username, buckets in self.users.items()
+                if all(bucket.is_full(now) for bucket in buckets.values())]
+        for username in idle:
+            del self.users[username]
+        self.last_prune = now
+
+    def counters(self):
+        with self.lock:
+            return {command_class: {"allowed": self.allowed[command_class], "limited": self.limited[command_class]}
+                    for command_class in self.limits}
@@ -0,0 +1,347 @@
+"""
+    Asyncio client library for the Tessenger server
+    Python 3
+    coding: utf-8
+
+    TessengerClient speaks the framed protocol of TCPServer3.py and exposes the
+    commands as awaitables, so bots and services can use the server without the
+    interactive prompt:
+
+        client = TessengerClient("127.0.0.1", 12000, udp_port=0)
+        await client.connect()
+        await client.login("alice", "password")
+        await asyncio.gather(client.msgto("bob", "hi"), client.groupmsg("team", "hello"))
+        async for push in client.pushes():
+            print(push.message)
+
+    Any number of requests can be in flight on the connection: every request is
+    sent with a fresh request id and the server echoes it in the response.
+    Pushes (incoming messages, marked with FLAG_PUSH, and received p2p files) are
+    handed to the on_push callback, or queued for pushes() when there is no
+    callback.
+
+    Responses come in the compact binary codec (codec.py) unless the client is
+    created with codec="json"; the codec is requested when logging in, and a
+    server that does not know it keeps answering in JSON. With compress=True
+    the client also asks for zlib compression, worth it on slow links; frames
+    say whether they are compressed, so either answer works.
+
+    The server drops connections that go quiet for too long, so once nothing
+    has been sent for heartbeat_interval seconds the client sends /heartbeat
+    by itself. Pass heartbeat_interval=0 to turn that off.
+"""
+import asyncio
+import os
+import threading
+from socket import socket, gethostname, gethostbyname, AF_INET, SOCK_DGRAM
+
+from protocol import (FrameDecoder, encode_frame, next_request_id, FLAG_PUSH, NO_REQUEST_ID, RECV_BUFFER_SIZE,
+                      HEARTBEAT_INTERVAL)
+from codec import decode_payload, BINARY_CODEC
+from compression import FrameDecompressor, COMPRESSORS
+from p2p_transfer import (ReliableSender, TransferReceiver, TransferError, ACK_DELAY, MAX_DATAGRAM_SIZE,
+                          DEFAULT_CHUNK_SIZE)
+
+
+##################################################
+#                    CONSTANTS                   #
+##################################################
+# Status Code Constants:
+SUCCESS = 200
+CLIENT_ERROR = 400
+UNAUTHORIZED = 401
+FORBIDDEN = 403
+NOT_FOUND = 404
+CONFLICT = 409
+TOO_MANY_REQUESTS = 429
+INTERNAL_SERVER_ERROR = 500
+
+# Command of the push generated locally when a p2p file has been received
+INCOMING_FILE = "incomingfile"
+
+
+##################################################
+#                  Response Class                #
+##################################################
+class Response():
+    __slots__ = ("command", "status", "message", "data")
+
+    def __init__(self, command, status, message="", data=None):
+        self.command = command
+        self.status = status
+        self.message = message
+        self.data = data if data is not None else {}
+
+    @classmethod
+    def from_frame(cls, flags, payload):
+        response = decode_payload(flags, payload)
+        return cls(response.get("command"), response.get("statusCode"),
+                   response.get("clientMessage", ""), response.get("data"))
+
+    @property
+    def ok(self):
+        return self.status == SUCCESS
+
+    def __repr__(self):
+        return f"Response({self.command!r}, {self.status}, {self.message!r})"
+
+class ConnectionClosed(ConnectionError):
+    """The server connection ended while requests were still waiting."""
+
+def as_line(message):
+    # messages are sent, logged and pushed as typed lines, newline included
+    return message if message.endswith("\n") else message + "\n"
+
+
+##################################################
+#              TessengerClient Class             #
+##################################################
+class TessengerClient():
+    def __init__(self, host, port, udp_port=0, on_push=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                 received_file_name=None, codec=BINARY_CODEC.name, compress=False,
+                 heartbeat_interval=HEARTBEAT_INTERVAL):
+        self.host = host
+        self.port = port
+        self.udp_port = udp_port
+        self.on_push = on_push
+        self.chunk_size = chunk_size
+        # maps (sender, filename) to the path a received p2p file is written to; the
+        # receiver only passes plain file names, so the default stays in the working directory
+        self.received_file_name = received_file_name or (lambda sender, filename: f"{sender}_{filename}")
+        # codec asked for at login; response frames say which one they are in
+        self.codec = codec
+        self.compress = compress
+        self.heartbeat_interval = heartbeat_interval
+
+        self.username = None
+        self.reader = None
+        self.writer = None
+        self.decoder = FrameDecoder()
+        self.decompressor = FrameDecompressor()
+        # maps request id to the future waiting for its response
+        self.waiting = {}
+        self.last_request_id = NO_REQUEST_ID
+        self.push_queue = asyncio.Queue()
+        self.reader_task = None
+        self.closed = False
+        # loop time of the last request sent, so heartbeats only fill the silences
+        self.last_sent = 0.0
+        self.heartbeat_task = None
+
+        self.udp_socket = None
+        self.udp_thread = None
+        self.loop = None
+
+    #################### CONNECTION ####################
+    async def connect(self):
+        self.loop = asyncio.get_running_loop()
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.reader_task = asyncio.create_task(self.read_loop())
+        self.last_sent = self.loop.time()
+        if self.heartbeat_interval:
+            self.heartbeat_task = asyncio.create_task(self.heartbeat_loop())
+
+        # p2p files are received on a UDP port the server advertises to other users
+        self.udp_socket = socket(AF_INET, SOCK_DGRAM)
+        self.udp_socket.bind(('', self.udp_port))
+        self.udp_port = self.udp_socket.getsockname()[1]
+        self.udp_thread = threading.Thread(target=self.listen_for_files, daemon=True)
+        self.udp_thread.start()
+
+    async def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+        if self.reader_task is not None:
+            await self.reader_task
+        if self.udp_socket is not None:
+            self.udp_socket.close()
+            await asyncio.to_thread(self.udp_thread.join)
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def read_loop(self):
+        try:
+            while True:
+                data = await self.reader.read(RECV_BUFFER_SIZE)
+                if not data:
+                    break
+                for request_id, flags, payload in self.decompressor.expand(self.decoder.feed(data)):
+                    self.dispatch(request_id, flags, Response.from_frame(flags, payload))
+        except ConnectionError:
+            pass
+        finally:
+            self.closed = True
+            for future in self.waiting.values():
+                if not future.done():
+                    future.set_exception(ConnectionClosed("connection closed by the server"))
+            self.waiting.clear()
+            # wake up anyone iterating over pushes()
+            self.push_queue.put_nowait(None)
+
+    def dispatch(self, request_id, flags, response):
+        if flags & FLAG_PUSH:
+            self.deliver_push(response)
+            return
+        future = self.waiting.pop(request_id, None)
+        if future is not None and not future.done():
+            future.set_result(response)
+
+    def deliver_push(self, push):
+        if self.on_push is None:
+            self.push_queue.put_nowait(push)
+            return
+        result = self.on_push(push)
+        if asyncio.iscoroutine(result):
+            asyncio.ensure_future(result)
+
+    async def heartbeat_loop(self):
+        try:
+            while not self.closed:
+                idle = self.loop.time() - self.last_sent
+                if idle < self.heartbeat_interval:
+                    await asyncio.sleep(self.heartbeat_interval - idle)
+                else:
+                    await self.heartbeat()
+        except ConnectionClosed:
+            pass
+
+    async def pushes(self):
+        """Yield pushes until the connection closes; only used without on_push."""
+        while True:
+            push = await self.push_queue.get()
+            if push is None:
+                return
+            yield push
+
+    #################### REQUESTS ####################
+    def request(self, line):
+        """Send one request line and return a future for its Response."""
+        if self.closed:
+            raise ConnectionClosed("connection is closed")
+        self.last_request_id = next_request_id(self.last_request_id)
+        future = self.loop.create_future()
+        self.waiting[self.last_request_id] = future
+        self.writer.write(encode_frame(line.encode(), self.last_request_id))
+        self.last_sent = self.loop.time()
+        return future
+
+    async def login_username(self, username):
+        response = await self.request(f"[loginusername] {username}")
+        if response.ok:
+            self.username = username
+        return response
+
+    async def login_password(self, password, client_ip=None):
+        client_ip = client_ip or gethostbyname(gethostname())
+        options = f"codec={self.codec}" + (f" compress={COMPRESSORS[0]}" if self.compress else "")
+        return await self.request(f"[loginpassword] {password} {client_ip} {self.udp_port} {options}")
+
+    async def login(self, username, password):
+        """Log in, returning the first unsuccessful response or the final one."""
+        response = await self.login_username(username)
+        if not response.ok:
+            return response
+        return await self.login_password(password)
+
+    async def msgto(self, username, message):
+        return await self.request(f"/msgto {username} {as_line(message)}")
+
+    async def activeuser(self):
+        return await self.request("/activeuser")
+
+    async def creategroup(self, group_name, usernames):
+        return await self.request(f"/creategroup {group_name} {' '.join(usernames)}")
+
+    async def joingroup(self, group_name):
+        return await self.request(f"/joingroup {group_name}")
+
+    async def groupmsg(self, group_name, message):
+        return await self.request(f"/groupmsg {group_name} {as_line(message)}")
+
+    async def grouphistory(self, group_name, before=None, limit=None):
+        """A page of the group's messages, oldest first, in data["messages"] as
+        [sequence, timestamp, sender, message]; data["before"] fetches the page before it."""
+        line = f"/grouphistory {group_name}"
+        if before is not None or limit is not None:
+            # a before_seq of 0 asks for the newest messages
+            line += f" {before or 0}"
+        if limit is not None:
+            line += f" {limit}"
+        return await self.request(line)
+
+    async def metrics(self):
+        """The server's metrics as plain text in the message; only for admin users."""
+        return await self.request("/metrics")
+
+    async def heartbeat(self):
+        """Show the server the connection is alive; sent by itself after heartbeat_interval of silence."""
+        return await self.request("/heartbeat")
+
+    async def logout(self):
+        response = await self.request("/logout")
+        await self.close()
+        return response
+
+    #################### P2P VIDEO ####################
+    async def p2pvideo(self, username, filename):
+        """Send filename to an active user over UDP; returns a Response like the server's."""
+        if not os.path.exists(filename):
+            return Response("p2pvideo", NOT_FOUND, f"Error: File '{filename}' does not exist.")
+
+        # look up the recipient's UDP details
+        response = await self.activeuser()
+        client_ips = response.data.get("client_ips", {})
+        udp_ports = response.data.get("udp_ports", {})
+        if username not in client_ips or username not in udp_ports:
+            return Response("p2pvideo", NOT_FOUND, f"Error: Recipient '{username}' is not active.")
+
+        address = (client_ips[username], int(udp_ports[username]))
+        try:
+            await asyncio.to_thread(self.send_file, filename, address)
+        except TransferError as e:
+            return Response("p2pvideo", INTERNAL_SERVER_ERROR, f"Error: {filename} could not be sent. {e}")
+        return Response("p2pvideo", SUCCESS, f"{filename} has been uploaded.")
+
+    def send_file(self, filename, address):
+        sending_socket = socket(AF_INET, SOCK_DGRAM)
+        # sequence-numbered, acknowledged and paced - see p2p_transfer.py
+        sender = ReliableSender(sending_socket, address, self.chunk_size)
+        try:
+            sender.send_file(filename, self.username)
+        finally:
+            sending_socket.close()
+
+    def listen_for_files(self):
+        receiver = TransferReceiver(self.udp_socket, self.received_file_name)
+        # wake up regularly to acknowledge chunks that arrived since the last ACK
+        self.udp_socket.settimeout(ACK_DELAY)
+        while not self.closed:
+            try:
+                data, address = self.udp_socket.recvfrom(MAX_DATAGRAM_SIZE)
+            except TimeoutError:
+                receiver.flush_acks()
+                continue
+            except OSError:
+                if self.closed:
+                    break
+                continue
+
+            transfer = receiver.handle(data, address)
+            if transfer is not None:
+                push = Response(INCOMING_FILE, SUCCESS, f"Received {transfer.filename} from {transfer.sender}",
+                                {"filename": transfer.filename, "sender": transfer.sender, "path": transfer.output_name})
+                self.loop.call_soon_threadsafe(self.deliver_push, push)
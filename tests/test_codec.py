@@ -0,0 +1,45 @@
+import pytest
+
+from codec import (BINARY_CODEC, JSON_CODEC, CodecError, EncodedPush, decode_binary, decode_payload,
+                   encode_binary, stored_push_frames, encode_json)
+from protocol import FrameDecoder
+
+
+def response(command, data):
+    return {"command": command, "statusCode": 200, "clientMessage": "ok", "data": data}
+
+RESPONSES = [
+    response("msgto", {}),
+    response("activeuser", {"users": [{"username": "alice", "since": "18 Oct 2026 10:00:00", "port": 5000}]}),
+    response("someday-command", {"flag": True, "off": False, "none": None, "ratio": 0.25, "count": -(2 ** 40)}),
+    response("grouphistory", {"records": ["é" * 200, "x" * 70000, ""], "nested": [[1, 2], {"a": []}]}),
+    # eight or more strings go out as a string map
+    response("incomingmsg", {f"key{i}": f"value {i} ✓" for i in range(10)}),
+]
+
+@pytest.mark.parametrize("codec", [JSON_CODEC, BINARY_CODEC], ids=lambda codec: codec.name)
+def test_round_trip_through_frames(codec):
+    decoder = FrameDecoder()
+    frames = decoder.feed(b''.join(codec.frame(item, request_id) for request_id, item in enumerate(RESPONSES, 1)))
+    assert [request_id for request_id, _, _ in frames] == [1, 2, 3, 4, 5]
+    assert [decode_payload(flags, payload) for _, flags, payload in frames] == RESPONSES
+
+def test_truncated_binary_is_a_codec_error():
+    payload = encode_binary(RESPONSES[3])
+    for end in (0, 2, 10, len(payload) // 2, len(payload) - 1):
+        with pytest.raises(CodecError):
+            decode_binary(payload[:end])
+    with pytest.raises(CodecError):
+        encode_binary(response("msgto", {"bad": object()}))
+
+def test_encoded_push_is_encoded_once_per_codec():
+    push = EncodedPush(RESPONSES[1])
+    assert push.frame(BINARY_CODEC) is push.frame(BINARY_CODEC)
+    assert push.frame(JSON_CODEC) == JSON_CODEC.push_frame(RESPONSES[1])
+    assert set(push.frames) == {"json", "binary"}
+
+def test_stored_pushes_in_either_codec():
+    bodies = [encode_json(item) for item in RESPONSES]
+    for codec in (JSON_CODEC, BINARY_CODEC):
+        frames = FrameDecoder().feed(stored_push_frames(bodies, codec))
+        assert [decode_payload(flags, payload) for _, flags, payload in frames] == RESPONSES
@@ -0,0 +1,74 @@
+import random
+import zlib
+
+from codec import JSON_CODEC
+from compression import FrameCompressor, FrameDecompressor, MAX_COMPRESSED_CHUNK, WINDOW_BITS
+from protocol import FLAG_COMPRESSED, FrameDecoder
+
+
+def push(number, text="hello"):
+    return JSON_CODEC.push_frame({"command": "incominggroupmsg", "statusCode": 200,
+                                  "clientMessage": f"18 Oct 2026 10:00:{number % 60:02d}, team, alice: {text} {number}\n",
+                                  "data": {}})
+
+def test_connection_long_stream_round_trip():
+    rng = random.Random(5)
+    compressor = FrameCompressor(threshold=256)
+    batches = []
+    for number in range(300):
+        if number % 7 == 0:
+            batches.append([push(number)])                                  # under the threshold
+        elif number == 150:
+            batches.append([push(n, "x" * 5000) for n in range(300)])       # over one chunk
+        else:
+            batches.append([push(number * 10 + n) for n in range(rng.randrange(2, 20))])
+
+    wire = []
+    for batch in batches:
+        written, compressed = compressor.compress(batch)
+        if not compressed:
+            assert written is batch
+        wire.append(b''.join(written))
+
+    # the client gets the bytes in arbitrary pieces, and must inflate every frame as it comes
+    stream = b''.join(wire)
+    decoder = FrameDecoder()
+    decompressor = FrameDecompressor()
+    received = []
+    offset = 0
+    while offset < len(stream):
+        size = rng.randrange(1, 4096)
+        received.extend(decompressor.expand(decoder.feed(stream[offset:offset + size])))
+        offset += size
+
+    expected = FrameDecoder().feed(b''.join(frame for batch in batches for frame in batch))
+    assert received == expected
+
+def test_each_batch_inflates_on_arrival():
+    compressor = FrameCompressor(threshold=0)
+    decompressor = FrameDecompressor()
+    for number in range(20):
+        batch = [push(number), push(number + 1)]
+        written, _ = compressor.compress(batch)
+        frames = FrameDecoder().feed(b''.join(written))
+        assert [flags for _, flags, _ in frames] == [FLAG_COMPRESSED]
+        assert list(decompressor.expand(frames)) == FrameDecoder().feed(b''.join(batch))
+
+def test_dictionary_and_history_shrink_frames():
+    batch = [push(1)]
+    first, _ = FrameCompressor(threshold=0).compress(batch)
+    plain = zlib.compressobj(6, zlib.DEFLATED, WINDOW_BITS)
+    without_dictionary = plain.compress(b''.join(batch)) + plain.flush(zlib.Z_SYNC_FLUSH)
+    assert len(first[0]) < len(without_dictionary)
+
+    # a batch like an earlier one on the same connection costs far less
+    compressor = FrameCompressor(threshold=0)
+    compressor.compress([push(n) for n in range(10)])
+    again, _ = compressor.compress([push(n) for n in range(10)])
+    assert len(again[0]) < len(first[0]) * 2
+
+def test_oversized_batch_is_split():
+    compressor = FrameCompressor(threshold=0)
+    data = [random.Random(6).randbytes(MAX_COMPRESSED_CHUNK + 10)]
+    written, size = compressor.compress(data)
+    assert size == len(data[0]) and len(written) == 2
@@ -0,0 +1,113 @@
+import os
+
+import pytest
+
+import TCPServer3 as server
+from credential_store import CredentialStore
+from outbound import ThreadedOutboundQueue
+from presence import PresenceTable
+
+
+def write_credentials(path, lines, bump=0):
+    path.write_text("".join(line + "\n" for line in lines))
+    # mtimes can be coarse, make sure a rewrite is seen as a change
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + bump * 1_000_000_000))
+
+def open_store(path, **kwargs):
+    store = CredentialStore(str(path), **kwargs)
+    builds = []
+    build = store.build
+    store.build = lambda signature: builds.append(signature) or build(signature)
+    store.open()
+    return store, builds
+
+def test_database_rebuilt_only_when_the_file_changes(tmp_path):
+    path = tmp_path / "credentials.txt"
+    write_credentials(path, ["alice pw1", "bob pw2"])
+    store, builds = open_store(path)
+    assert len(builds) == 1 and store.get("alice") == "pw1"
+    store.close()
+
+    store, builds = open_store(path)
+    assert builds == [] and store.get("bob") == "pw2"
+    store.close()
+
+    write_credentials(path, ["alice pw1", "bob pw2", "carol pw3"], bump=1)
+    store, builds = open_store(path)
+    assert len(builds) == 1 and store.get("carol") == "pw3" and len(store) == 3
+    store.close()
+
+def test_reload_swaps_the_database_and_clears_the_cache(tmp_path):
+    path = tmp_path / "credentials.txt"
+    write_credentials(path, ["alice pw1"])
+    store, _ = open_store(path)
+    assert store.get("alice") == "pw1"
+    assert store.get("dave") is None
+    assert not store.reload()
+
+    write_credentials(path, ["alice changed", "dave pw4"], bump=1)
+    old_db = store.db
+    assert store.reload()
+    assert store.db is not old_db and not store.cache
+    assert store.get("alice") == "changed"
+    assert "dave" in store
+    store.close()
+
+def test_unknown_names_are_cached_negatively(tmp_path):
+    path = tmp_path / "credentials.txt"
+    write_credentials(path, ["alice pw1"])
+    store, _ = open_store(path, cache_size=2)
+    assert store.get("nobody") is None
+    assert store.get("nobody") is None
+    assert (store.misses, store.hits) == (1, 1)
+    assert store.cache == {"nobody": None}
+
+    # least recently used goes first
+    store.get("alice")
+    store.get("zed")
+    assert list(store.cache) == ["alice", "zed"]
+    store.close()
+
+
+class LoginSession(server.ClientSession):
+    def create_outbound_queue(self):
+        return ThreadedOutboundQueue()
+
+    def close(self):
+        pass
+
+    def abort(self):
+        pass
+
+@pytest.fixture
+def login(tmp_path, monkeypatch):
+    path = tmp_path / "credentials.txt"
+    write_credentials(path, ["alice pw1"])
+    store, _ = open_store(path)
+    monkeypatch.setattr(server, "credentials", store)
+    monkeypatch.setattr(server, "attempts_cap", 3)
+    monkeypatch.setattr(server, "failed_attempts", {})
+    monkeypatch.setattr(server, "blocked_users", {})
+    monkeypatch.setattr(server, "threads", {})
+    monkeypatch.setattr(server, "active_users", PresenceTable(str(tmp_path / "userlog.txt")))
+
+    def attempt(password):
+        session = LoginSession(("127.0.0.1", 0))
+        session.process_username("alice")
+        return session.process_password(f"/password {password} 127.0.0.1 5000")["statusCode"]
+
+    yield attempt
+    store.close()
+
+def test_failed_attempts_cleared_on_success(login):
+    assert server.failed_attempts == {}
+    assert login("wrong") == server.UNAUTHORIZED
+    assert server.failed_attempts == {"alice": 1}
+    assert login("pw1") == server.SUCCESS
+    assert server.failed_attempts == {}
+
+def test_failed_attempts_cleared_on_block(login):
+    assert [login("wrong") for _ in range(3)] == [server.UNAUTHORIZED, server.UNAUTHORIZED, server.FORBIDDEN]
+    assert server.failed_attempts == {}
+    assert "alice" in server.blocked_users
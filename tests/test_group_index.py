@@ -0,0 +1,56 @@
+import pytest
+
+import TCPServer3 as server
+from presence import PresenceTable
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(tmp_path, monkeypatch):
+    presence = PresenceTable(str(tmp_path / "userlog.txt"))
+    presence.on_login = server.member_online
+    presence.on_logout = server.member_offline
+    monkeypatch.setattr(server, "active_users", presence)
+    monkeypatch.setattr(server, "groups", {})
+    monkeypatch.setattr(server, "joined_groups", {})
+
+def check_index():
+    # every group's online set is exactly its joined members who are online
+    for group in server.groups.values():
+        assert group.online == {user for user, joined in group.users_joined.items()
+                                if joined and user in server.active_users}, group.name
+
+def login(username):
+    server.active_users.login(username, "127.0.0.1", 5000)
+
+def test_online_members_follow_every_transition():
+    login("alice")
+    team = server.add_group(server.GroupChat("team", "alice", ["bob", "carol"]))
+    pair = server.add_group(server.GroupChat("pair", "bob", ["alice"]))
+    check_index()
+    assert team.online == {"alice"} and pair.online == set()
+
+    login("bob")                      # invited to team but not joined
+    check_index()
+    team.accept_invite("bob")
+    pair.accept_invite("alice")
+    check_index()
+    assert team.online == {"alice", "bob"} == pair.online
+
+    login("carol")
+    server.active_users.logout("alice")
+    check_index()
+    team.accept_invite("carol")       # joins while online
+    check_index()
+    assert team.online == {"bob", "carol"} and pair.online == {"bob"}
+
+    # a group rebuilt from its members while they are online, as a worker does on a broker update
+    rebuilt = server.add_group(server.GroupChat.from_members("team", team.users_joined))
+    server.restore_groups([("pair", pair.users_joined)])
+    check_index()
+    assert rebuilt.online == {"bob", "carol"}
+    assert server.joined_groups == {"alice": {"team", "pair"}, "bob": {"team", "pair"}, "carol": {"team"}}
+
+    server.active_users.logout("bob")
+    login("alice")
+    check_index()
+    assert server.groups["team"].online == {"alice", "carol"} and server.groups["pair"].online == {"alice"}
@@ -0,0 +1,58 @@
+import os
+
+from group_store import GroupStore
+
+
+def test_groups_survive_a_clean_restart(tmp_path):
+    store = GroupStore(str(tmp_path))
+    assert store.open() == {}
+    store.create("team", {"alice": True, "bob": False, "carol": False})
+    store.join("team", "bob")
+    store.snapshot()
+    store.create("pair", {"bob": True, "carol": False})
+    store.stop()
+
+    store = GroupStore(str(tmp_path))
+    assert store.open() == {"team": {"alice": True, "bob": True, "carol": False},
+                            "pair": {"bob": True, "carol": False}}
+    store.stop()
+
+def test_journal_replayed_after_a_crash(tmp_path):
+    store = GroupStore(str(tmp_path))
+    store.open()
+    store.create("team", {"alice": True, "bob": False})
+    store.snapshot()
+    store.join("team", "bob")
+    store.create("solo", {"carol": True})
+    # no stop(): the process died with the journal still open
+
+    restarted = GroupStore(str(tmp_path))
+    assert restarted.open() == {"team": {"alice": True, "bob": True}, "solo": {"carol": True}}
+    restarted.stop()
+    store.journal.close()
+
+def test_torn_and_malformed_records_are_skipped(tmp_path):
+    store = GroupStore(str(tmp_path))
+    store.open()
+    store.create("team", {"alice": True, "bob": False})
+    store.journal.write("garbage\n")
+    store.join("team", "bob")
+    # a write cut short by the crash
+    store.journal.write("C\tlost\talice:1")
+    store.journal.close()
+
+    restarted = GroupStore(str(tmp_path))
+    assert restarted.open() == {"team": {"alice": True, "bob": True}}
+    # and the next restart still sees the same groups
+    restarted.create("later", {"carol": True})
+    restarted.stop()
+    assert GroupStore(str(tmp_path)).open() == {"team": {"alice": True, "bob": True}, "later": {"carol": True}}
+
+def test_snapshot_removes_old_journals(tmp_path):
+    store = GroupStore(str(tmp_path))
+    store.open()
+    for n in range(3):
+        store.create(f"group{n}", {"alice": True})
+        store.snapshot()
+    store.stop()
+    assert sorted(os.listdir(tmp_path)) == ["groups-4.journal", "groups.snapshot"]
@@ -0,0 +1,124 @@
+import asyncio
+import socket
+
+from interconnect import OpLink
+
+
+async def open_pair():
+    left, right = socket.socketpair()
+    sender = OpLink(*await asyncio.open_connection(sock=left))
+    receiver = OpLink(*await asyncio.open_connection(sock=right))
+    return sender, receiver
+
+def test_ops_of_one_turn_share_a_frame():
+    async def scenario():
+        sender, receiver = await open_pair()
+        for n in range(100):
+            sender.send(["deliver", [f"user{n}"], {"n": n}])
+        await sender.drain()
+        received = []
+        while len(received) < 100:
+            received.extend(await receiver.receive())
+        sender.close()
+        receiver.close()
+        return sender, received
+
+    sender, received = asyncio.run(scenario())
+    assert [op[2]["n"] for op in received] == list(range(100))
+    assert (sender.ops_sent, sender.frames_sent) == (100, 1)
+
+def test_slow_peer_holds_up_the_sender():
+    async def scenario():
+        sender, receiver = await open_pair()
+        payload = "x" * 65536
+        # nobody reads the other end: later batches wait instead of piling up in the transport
+        for _ in range(200):
+            sender.send(["deliver", ["bob"], payload])
+            await asyncio.sleep(0)
+        buffered = sender.writer.transport.get_write_buffer_size()
+        try:
+            await asyncio.wait_for(sender.drain(), 0.2)
+            blocked = False
+        except asyncio.TimeoutError:
+            blocked = True
+
+        # once the peer reads again everything gets through
+        reading = asyncio.create_task(read_ops(receiver, 200))
+        await sender.drain()
+        received = await reading
+        sender.close()
+        receiver.close()
+        return blocked, buffered, received
+
+    blocked, buffered, received = asyncio.run(scenario())
+    assert blocked
+    assert buffered < 4 * 65536
+    assert received == 200
+
+async def read_ops(link, count, keep=False):
+    received = []
+    while len(received) < count:
+        received.extend(await link.receive())
+    return received if keep else len(received)
+
+def test_oversized_op_is_spread_over_frames():
+    async def scenario():
+        sender, receiver = await open_pair()
+        snapshot = ["snapshot", [["user%d" % n, "x" * 100] for n in range(200000)], [], {}]
+        sender.send(["login", "alice"])
+        sender.send(snapshot)
+        sender.send(["login", "bob"])
+        reading = asyncio.create_task(read_ops(receiver, 3, keep=True))
+        await sender.drain()
+        received = await reading
+        # the link carries on after it
+        sender.send(["logout", "alice"])
+        await sender.drain()
+        after = await receiver.receive()
+        sender.close()
+        receiver.close()
+        return sender, snapshot, received, after
+
+    sender, snapshot, received, after = asyncio.run(scenario())
+    assert received == [["login", "alice"], snapshot, ["login", "bob"]]
+    assert after == [["logout", "alice"]]
+    assert sender.frames_sent > 3
+
+def test_op_that_cannot_be_encoded_is_dropped():
+    async def scenario():
+        sender, receiver = await open_pair()
+        sender.send(["login", "alice"])
+        sender.send(["block", object()])
+        sender.send(["login", "bob"])
+        await sender.drain()
+        received = await read_ops(receiver, 2, keep=True)
+        sender.close()
+        receiver.close()
+        return received
+
+    assert asyncio.run(scenario()) == [["login", "alice"], ["login", "bob"]]
+
+def test_cluster_fanout_over_the_frame_limit():
+    async def scenario():
+        # cluster nodes link over TCP
+        accepted = asyncio.get_running_loop().create_future()
+        server = await asyncio.start_server(lambda reader, writer: accepted.set_result(OpLink(reader, writer)), "127.0.0.1", 0)
+        sender = OpLink(*await asyncio.open_connection(*server.sockets[0].getsockname()[:2]))
+        receiver = await accepted
+        push = {"command": "incominggroupmsg", "statusCode": 200, "clientMessage": "y" * 4000, "data": {}}
+        members = [f"user{n}" for n in range(1000)]
+        for _ in range(5000):
+            sender.send(["deliver", members[:50], push])
+        sender.send(["login", "alice", "127.0.0.1", 5000, "18 Oct 2026 10:00:00"])
+        reading = asyncio.create_task(read_ops(receiver, 5001, keep=True))
+        await sender.drain()
+        received = await reading
+        sender.close()
+        receiver.close()
+        server.close()
+        return sender, received
+
+    sender, received = asyncio.run(scenario())
+    assert sender.ops_sent == 5001 and sender.frames_sent > 16
+    assert received[-1][:2] == ["login", "alice"]
+    assert all(op[0] == "deliver" and len(op[1]) == 50 for op in received[:-1])
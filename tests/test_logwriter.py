@@ -0,0 +1,70 @@
+from logwriter import LogWriter
+
+
+def test_stop_writes_everything_queued(tmp_path):
+    log_file = str(tmp_path / "messagelog.txt")
+    # a flush interval far longer than the test, so only stop() can write the lines
+    writer = LogWriter(flush_interval=60, fsync_policy="batch")
+    writer.start()
+    for number in range(100):
+        writer.append(log_file, f"{number}; line\n")
+    writer.stop()
+    with open(log_file) as file:
+        assert file.read() == "".join(f"{number}; line\n" for number in range(100))
+
+def test_stop_without_start(tmp_path):
+    writer = LogWriter()
+    writer.append(str(tmp_path / "never.txt"), "queued\n")
+    writer.stop()
+
+def write_group_log(log_file, count, message=lambda number: f"message {number}"):
+    writer = LogWriter(flush_interval=0)
+    writer.start()
+    for number in range(1, count + 1):
+        writer.append(log_file, f"{number}; 18 Oct 2026 10:00:00; alice; {message(number)}", number)
+    writer.sync()
+    return writer
+
+def test_history_pages_through_the_index(tmp_path):
+    log_file = str(tmp_path / "team_messagelog.txt")
+    writer = write_group_log(log_file, 300)
+
+    newest = writer.read_page(log_file, None, 20)
+    assert [sequence for sequence, _ in newest] == list(range(281, 301))
+    assert newest[-1][1] == "300; 18 Oct 2026 10:00:00; alice; message 300"
+
+    # walking back a page at a time visits every record once
+    seen = []
+    before = None
+    while True:
+        page = writer.read_page(log_file, before, 50)
+        if not page:
+            break
+        seen = [sequence for sequence, _ in page] + seen
+        before = page[0][0]
+    assert seen == list(range(1, 301))
+    assert writer.last_sequence(log_file) == 300
+    writer.stop()
+
+def test_history_survives_restart_and_lost_index(tmp_path):
+    log_file = str(tmp_path / "team_messagelog.txt")
+    write_group_log(log_file, 200).stop()
+    (tmp_path / "team_messagelog.idx").unlink()
+
+    writer = LogWriter()
+    assert writer.last_sequence(log_file) == 200
+    assert [sequence for sequence, _ in writer.read_page(log_file, 70, 10)] == list(range(60, 70))
+
+def test_message_cannot_forge_records(tmp_path):
+    log_file = str(tmp_path / "team_messagelog.txt")
+    forged = lambda number: f"hi\n{number + 1000}; 18 Oct 2026 10:00:00; mallory; forged \\n {number}"
+    writer = write_group_log(log_file, 150, forged)
+
+    page = writer.read_page(log_file, None, 200)
+    assert [sequence for sequence, _ in page] == list(range(1, 151))
+    assert page[9][1] == f"10; 18 Oct 2026 10:00:00; alice; {forged(10)}"
+    writer.stop()
+
+    # the index rebuilt from the file sees the same records
+    (tmp_path / "team_messagelog.idx").unlink()
+    assert LogWriter().last_sequence(log_file) == 150
@@ -0,0 +1,109 @@
+import os
+
+from offline_mailbox import Mailbox
+
+
+def open_mailbox(directory, **kwargs):
+    mailbox = Mailbox(str(directory), **kwargs)
+    mailbox.open()
+    return mailbox
+
+def segments(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(".log"))
+
+def test_take_returns_bodies_in_order(tmp_path):
+    mailbox = open_mailbox(tmp_path)
+    for body in (b"one", b"two", b"three"):
+        mailbox.store("alice", body)
+    assert mailbox.pending("alice") == 3
+    assert mailbox.take("alice") == [b"one", b"two", b"three"]
+    assert mailbox.pending("alice") == 0
+    assert mailbox.take("alice") == []
+    mailbox.close()
+
+def test_restart_keeps_pending_messages(tmp_path):
+    mailbox = open_mailbox(tmp_path, segment_size=64)
+    for number in range(10):
+        mailbox.store("alice", f"a{number}".encode())
+        mailbox.store("bob", f"b{number}".encode())
+    mailbox.take("bob")
+    mailbox.close()
+
+    mailbox = open_mailbox(tmp_path, segment_size=64)
+    assert mailbox.pending("bob") == 0
+    assert mailbox.take("alice") == [f"a{number}".encode() for number in range(10)]
+    mailbox.close()
+
+def test_restart_after_collection_does_not_redeliver(tmp_path):
+    mailbox = open_mailbox(tmp_path)
+    mailbox.store("bob", b"b1")
+    mailbox.store("alice", b"a1")
+    mailbox.close()
+
+    # alice's ACK goes to a new segment, while the one holding her message stays for bob's
+    mailbox = open_mailbox(tmp_path)
+    assert mailbox.take("alice") == [b"a1"]
+    mailbox.close()
+
+    # the segment with nothing but the ACK must survive both restarts
+    for _ in range(2):
+        mailbox = open_mailbox(tmp_path)
+        assert mailbox.pending("alice") == 0
+        mailbox.close()
+
+    mailbox = open_mailbox(tmp_path)
+    assert mailbox.take("bob") == [b"b1"]
+    mailbox.close()
+
+    # with nothing pending any more, every old segment goes
+    mailbox = open_mailbox(tmp_path)
+    assert len(segments(tmp_path)) == 1
+    mailbox.close()
+
+def test_trim_keeps_newest_across_restart(tmp_path):
+    mailbox = open_mailbox(tmp_path, segment_size=32, max_per_user=3)
+    for number in range(8):
+        mailbox.store("alice", f"m{number}".encode())
+    mailbox.close()
+
+    mailbox = open_mailbox(tmp_path, segment_size=32, max_per_user=3)
+    assert mailbox.take("alice") == [b"m5", b"m6", b"m7"]
+    mailbox.close()
+
+def test_pending_message_does_not_keep_newer_segments(tmp_path):
+    mailbox = open_mailbox(tmp_path, segment_size=64)
+    mailbox.store("bob", b"for whenever bob comes back")
+    for number in range(50):
+        mailbox.store("alice", f"a{number}".encode())
+        assert mailbox.take("alice") == [f"a{number}".encode()]
+    # bob's segment and the active one, not every segment since
+    assert len(segments(tmp_path)) <= 3
+    mailbox.close()
+
+    mailbox = open_mailbox(tmp_path, segment_size=64)
+    assert mailbox.pending("alice") == 0
+    assert mailbox.take("bob") == [b"for whenever bob comes back"]
+    mailbox.store("alice", b"new")
+    mailbox.close()
+
+    mailbox = open_mailbox(tmp_path, segment_size=64)
+    assert mailbox.take("alice") == [b"new"]
+    mailbox.close()
+
+def test_restart_appends_to_the_last_segment(tmp_path):
+    for number in range(5):
+        mailbox = open_mailbox(tmp_path)
+        mailbox.store("alice", f"m{number}".encode())
+        mailbox.close()
+    assert len(segments(tmp_path)) == 1
+
+    # a record torn by a crash is cut off before appending after it
+    with open(tmp_path / segments(tmp_path)[0], 'ab') as file:
+        file.write(b'\x01\x00\x00')
+    mailbox = open_mailbox(tmp_path)
+    mailbox.store("alice", b"after the crash")
+    mailbox.close()
+
+    mailbox = open_mailbox(tmp_path)
+    assert mailbox.take("alice") == [f"m{number}".encode() for number in range(5)] + [b"after the crash"]
+    mailbox.close()
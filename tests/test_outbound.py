@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from outbound import OutboundQueue, ThreadedOutboundQueue, AsyncOutboundQueue
+
+
+def fill(queue, count, prefix=b"push"):
+    return [queue.enqueue(prefix + b"%d" % number, True) for number in range(count)]
+
+def test_drop_oldest_keeps_the_newest_pushes():
+    queue = OutboundQueue(max_frames=4, max_bytes=1 << 20, policy="drop-oldest")
+    assert all(fill(queue, 6))
+    assert queue.take_batch() == [b"push2", b"push3", b"push4", b"push5"]
+    assert queue.dropped == 2 and not queue.closed
+
+def test_drop_oldest_never_drops_responses():
+    queue = OutboundQueue(max_frames=3, max_bytes=1 << 20, policy="drop-oldest")
+    queue.enqueue(b"response0", False)
+    queue.enqueue(b"response1", False)
+    queue.enqueue(b"response2", False)
+    # nothing may go to make room, so the push is refused
+    assert not queue.enqueue(b"push", True)
+    # responses are queued past the limit
+    assert queue.enqueue(b"response3", False)
+    assert queue.take_batch() == [b"response0", b"response1", b"response2", b"response3"]
+    assert queue.dropped == 1
+
+def test_byte_limit():
+    queue = OutboundQueue(max_frames=100, max_bytes=10, policy="drop-oldest")
+    queue.enqueue(b"aaaa", True)
+    queue.enqueue(b"bbbb", True)
+    queue.enqueue(b"cccc", True)
+    assert queue.take_batch() == [b"bbbb", b"cccc"]
+    assert queue.size == 0
+
+def test_disconnect_closes_the_queue():
+    queue = OutboundQueue(max_frames=2, max_bytes=1 << 20, policy="disconnect")
+    assert fill(queue, 3) == [True, True, False]
+    assert queue.overflowed and queue.closed
+    assert not queue.enqueue(b"response", False)
+
+def test_mark_slow_drops_new_pushes_until_half_drained():
+    queue = OutboundQueue(max_frames=4, max_bytes=1 << 20, policy="mark-slow")
+    assert fill(queue, 5) == [True, True, True, True, False]
+    assert queue.slow
+    # responses still go through while slow
+    assert queue.enqueue(b"response", False)
+    assert queue.take_batch() == [b"push0", b"push1", b"push2", b"push3", b"response"]
+    # drained: the next push clears the flag
+    assert queue.enqueue(b"later", True)
+    assert not queue.slow and queue.dropped == 1
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        OutboundQueue(policy="drop-newest")
+
+def test_threaded_queue_hands_batches_over():
+    queue = ThreadedOutboundQueue(max_frames=2, max_bytes=1 << 20)
+    fill(queue, 3)
+    assert queue.wait_batch() == [b"push1", b"push2"]
+    queue.close()
+    assert queue.wait_batch() is None
+
+def test_async_queue_wakes_the_writer():
+    async def scenario():
+        queue = AsyncOutboundQueue(max_frames=2, max_bytes=1 << 20)
+        waiting = asyncio.create_task(queue.wait_batch())
+        await asyncio.sleep(0)
+        queue.put(b"push")
+        batch = await waiting
+        queue.put(b"a" * 10, droppable=False)
+        below = asyncio.create_task(queue.wait_below(5))
+        await asyncio.sleep(0)
+        assert not below.done()
+        await queue.wait_batch()
+        await below
+        queue.close()
+        return batch, await queue.wait_batch()
+
+    assert asyncio.run(scenario()) == ([b"push"], None)
@@ -0,0 +1,175 @@
+import errno
+import os
+import socket
+import threading
+
+import pytest
+
+from p2p_transfer import (ReliableSender, TransferReceiver, encode_init, decode_init, decode_ack, encode_ack,
+                          plain_name, INIT, INIT_ACK, INIT_HEADER, DATA, DATA_HEADER, MAX_FILE_SIZE,
+                          DEFAULT_CHUNK_SIZE, MAX_DATAGRAM_SIZE, ACK_DELAY)
+
+PEER = ("127.0.0.1", 40000)
+
+
+class FakeSocket():
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, address):
+        self.sent.append((bytes(data), address))
+
+
+class FlakySocket(socket.socket):
+    """A real UDP socket whose next sendmsg() calls raise the given exceptions."""
+    def __init__(self, *errors):
+        super().__init__(socket.AF_INET, socket.SOCK_DGRAM)
+        self.errors = list(errors)
+        self.calls = 0
+
+    def sendmsg(self, *args):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return super().sendmsg(*args)
+
+
+@pytest.fixture
+def receiver(tmp_path, monkeypatch):
+    # received files land in the working directory, as with the client's default output name
+    monkeypatch.chdir(tmp_path)
+    return TransferReceiver(FakeSocket(), lambda sender, filename: f"{sender}_{filename}")
+
+def files_under(directory):
+    return sorted(os.path.relpath(os.path.join(root, name), directory)
+                  for root, _, names in os.walk(directory) for name in names)
+
+def test_init_round_trip():
+    packet = encode_init(7, 1234, DEFAULT_CHUNK_SIZE, "clip.mp4", "alice")
+    assert decode_init(packet) == (7, 1234, DEFAULT_CHUNK_SIZE, "clip.mp4", "alice")
+
+def test_ack_round_trip():
+    assert decode_ack(encode_ack(7, 10, [(12, 14), (20, 21)])) == (7, 10, [(12, 14), (20, 21)])
+
+def test_truncated_ack_is_invalid():
+    with pytest.raises(ValueError):
+        decode_ack(encode_ack(7, 10, [(12, 14)])[:-1])
+
+def test_empty_file_completes_on_init(receiver, tmp_path):
+    transfer = receiver.handle(encode_init(1, 0, DEFAULT_CHUNK_SIZE, "empty.txt", "alice"), PEER)
+    assert transfer is not None and transfer.output_name == "alice_empty.txt"
+    assert receiver.sock.sent[0][0][0] == INIT_ACK
+    assert files_under(tmp_path) == ["alice_empty.txt"]
+
+def test_filename_path_is_stripped(receiver, tmp_path):
+    receiver.handle(encode_init(1, 0, DEFAULT_CHUNK_SIZE, "../../etc/passwd", "alice"), PEER)
+    assert files_under(tmp_path) == ["alice_passwd"]
+
+@pytest.mark.parametrize("sender", ["../../x", "..", "a/b", "a\\b", ""])
+def test_hostile_sender_is_dropped(receiver, tmp_path, monkeypatch, sender):
+    (tmp_path / "inside").mkdir()
+    monkeypatch.chdir(tmp_path / "inside")
+    assert receiver.handle(encode_init(1, 0, DEFAULT_CHUNK_SIZE, "f.txt", sender), PEER) is None
+    assert receiver.sock.sent == []
+    assert files_under(tmp_path) == []
+
+@pytest.mark.parametrize("packet", [
+    bytes([INIT]),                                                     # shorter than any header
+    bytes([INIT]) + bytes(INIT_HEADER.size - 1),                       # short INIT header
+    INIT_HEADER.pack(INIT, 1, 10, DEFAULT_CHUNK_SIZE) + b"\xff\xfe\0a",  # not UTF-8
+    INIT_HEADER.pack(INIT, 1, 10, DEFAULT_CHUNK_SIZE) + b"nosender",    # no separator
+    encode_init(1, MAX_FILE_SIZE + 1, DEFAULT_CHUNK_SIZE, "big", "alice"),
+    encode_init(1, 10, 0, "small", "alice"),
+])
+def test_malformed_init_is_dropped(receiver, tmp_path, packet):
+    assert receiver.handle(packet, PEER) is None
+    assert receiver.sock.sent == []
+    assert receiver.transfers == {}
+    assert files_under(tmp_path) == []
+
+def test_unwritable_output_is_dropped(tmp_path):
+    receiver = TransferReceiver(FakeSocket(), lambda sender, filename: str(tmp_path / "missing" / filename))
+    assert receiver.handle(encode_init(1, 10, DEFAULT_CHUNK_SIZE, "f.txt", "alice"), PEER) is None
+    assert receiver.transfers == {}
+
+def test_plain_name():
+    assert plain_name("alice") == "alice"
+    for name in ("", ".", "..", "../x", "x/y", "x\\y", "x\0y"):
+        with pytest.raises(ValueError):
+            plain_name(name)
+
+@pytest.fixture
+def sink():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    yield sock
+    sock.close()
+
+def test_full_send_buffer_keeps_gso(sink):
+    sock = FlakySocket(BlockingIOError(errno.EAGAIN, "busy"), BlockingIOError(errno.EAGAIN, "busy"))
+    sock.setblocking(False)
+    sender = ReliableSender(sock, sink.getsockname(), chunk_size=1000)
+    sender.send_chunks(memoryview(bytes(10000)), list(range(10)))
+    assert sender.use_gso
+    assert sender.packets_sent == 10
+    sock.close()
+
+def test_unsupported_gso_falls_back(sink):
+    sock = FlakySocket(OSError(errno.EINVAL, "no GSO"))
+    sock.setblocking(False)
+    sender = ReliableSender(sock, sink.getsockname(), chunk_size=1000)
+    sender.send_chunks(memoryview(bytes(10000)), list(range(10)))
+    assert not sender.use_gso
+    assert sender.packets_sent == 10
+    sock.close()
+
+def test_transfer_round_trip(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data = os.urandom(300000)
+    (tmp_path / "clip.bin").write_bytes(data)
+
+    receiving = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiving.bind(("127.0.0.1", 0))
+    receiving.settimeout(ACK_DELAY)
+    receiver = TransferReceiver(receiving, lambda sender, filename: f"{sender}_{filename}")
+    finished = []
+
+    def receive():
+        while not finished:
+            try:
+                packet, address = receiving.recvfrom(MAX_DATAGRAM_SIZE)
+            except TimeoutError:
+                receiver.flush_acks()
+                continue
+            transfer = receiver.handle(packet, address)
+            if transfer is not None:
+                finished.append(transfer)
+
+    thread = threading.Thread(target=receive, daemon=True)
+    thread.start()
+    sending = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    ReliableSender(sending, receiving.getsockname(), chunk_size=1200).send_file("clip.bin", "alice")
+    thread.join(10)
+    sending.close()
+    receiving.close()
+
+    assert finished and finished[0].sender == "alice"
+    assert (tmp_path / "alice_clip.bin").read_bytes() == data
+
+def test_reserved_space_is_capped(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    receiver = TransferReceiver(FakeSocket(), lambda sender, filename: f"{sender}_{filename}", max_reserved=3000)
+    other_peer = ("127.0.0.1", 40001)
+    receiver.handle(encode_init(1, 2000, 1000, "a.bin", "alice"), PEER)
+    # bob's file would take the reservation past the cap: no answer, no file
+    receiver.handle(encode_init(2, 2000, 1000, "b.bin", "bob"), other_peer)
+    assert [packet[0] for packet, _ in receiver.sock.sent] == [INIT_ACK]
+    assert files_under(tmp_path) == ["alice_a.bin"]
+
+    for seq in range(2):
+        receiver.handle(DATA_HEADER.pack(DATA, 1, seq) + b"a" * 1000, PEER)
+    # alice's transfer is done, so bob's retried INIT gets through
+    receiver.handle(encode_init(2, 2000, 1000, "b.bin", "bob"), other_peer)
+    packet, address = receiver.sock.sent[-1]
+    assert packet[0] == INIT_ACK and address == other_peer
+    assert files_under(tmp_path) == ["alice_a.bin", "bob_b.bin"]
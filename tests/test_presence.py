@@ -0,0 +1,28 @@
+from presence import PresenceTable
+
+
+def test_userlog_follows_the_table(tmp_path):
+    log_file = tmp_path / "userlog.txt"
+    table = PresenceTable(str(log_file))
+    table.start(interval=60)
+    table.login("alice", "127.0.0.1", 5000, since="18 Oct 2026 10:00:00")
+    table.login("bob", "127.0.0.1", 5001, since="18 Oct 2026 10:00:01")
+    table.logout("alice")
+    table.login("carol", "127.0.0.1", 5002, since="18 Oct 2026 10:00:02")
+    table.stop()
+
+    assert log_file.read_text().splitlines() == [
+        "1; 18 Oct 2026 10:00:01; bob; 127.0.0.1; 5001",
+        "2; 18 Oct 2026 10:00:02; carol; 127.0.0.1; 5002",
+    ]
+    assert list(tmp_path.iterdir()) == [log_file]
+
+def test_hooks_see_changes():
+    seen = []
+    table = PresenceTable()
+    table.on_login = lambda username: seen.append(("in", username, username in table))
+    table.on_logout = lambda username: seen.append(("out", username, username in table))
+    table.login("alice", "127.0.0.1", 5000)
+    table.logout("alice")
+    assert not table.logout("alice")
+    assert seen == [("in", "alice", True), ("out", "alice", False)]
@@ -0,0 +1,44 @@
+import random
+
+import pytest
+
+from protocol import (FLAG_PUSH, FRAME_HEADER_SIZE, MAX_REQUEST_ID, FrameDecoder, FrameError,
+                      encode_frame, encode_frames, encode_push, next_request_id)
+
+
+def test_frames_fed_byte_by_byte():
+    frames = [(1, 0, b'{"command": "msgto"}'), (0, FLAG_PUSH, b''), (7, 0, b'x' * 1000)]
+    data = b''.join(encode_frame(payload, request_id, flags) for request_id, flags, payload in frames)
+    decoder = FrameDecoder()
+    decoded = []
+    for i in range(len(data)):
+        decoded.extend(decoder.feed(data[i:i + 1]))
+        if i == FRAME_HEADER_SIZE - 2:
+            assert decoded == [] and decoder.pending() == FRAME_HEADER_SIZE - 1
+    assert decoded == frames
+    assert decoder.pending() == 0
+
+def test_frames_split_at_random_points():
+    rng = random.Random(1)
+    payloads = [bytes(rng.randrange(256) for _ in range(rng.randrange(300))) for _ in range(200)]
+    data = encode_frames(payloads)
+    decoder = FrameDecoder()
+    decoded = []
+    offset = 0
+    while offset < len(data):
+        size = rng.randrange(1, 700)
+        decoded.extend(payload for _, _, payload in decoder.feed(data[offset:offset + size]))
+        offset += size
+    assert decoded == payloads
+    assert decoder.pending() == 0
+
+def test_push_flag_and_oversized_frames():
+    assert FrameDecoder().feed(encode_push(b'hi')) == [(0, FLAG_PUSH, b'hi')]
+    decoder = FrameDecoder(max_frame_size=10)
+    assert decoder.feed(encode_frame(b'x' * 10)) == [(0, 0, b'x' * 10)]
+    with pytest.raises(FrameError):
+        decoder.feed(encode_frame(b'x' * 11)[:FRAME_HEADER_SIZE])
+
+def test_request_ids_wrap_past_no_request_id():
+    assert next_request_id(1) == 2
+    assert next_request_id(MAX_REQUEST_ID) == 1
@@ -0,0 +1,38 @@
+import pytest
+
+from ratelimit import RateLimiter, parse_limit
+
+
+def test_nothing_is_limited_by_default():
+    limiter = RateLimiter()
+    buckets = {}
+    assert all(limiter.check("/groupmsg", "alice", buckets) == 0 for _ in range(1000))
+    assert all(limiter.check("/activeuser", "alice", buckets) == 0 for _ in range(1000))
+
+def test_configured_class_refuses_past_its_burst():
+    limiter = RateLimiter(dict([parse_limit("group=1/5")]))
+    results = [limiter.check("/groupmsg", "alice", {}) for _ in range(6)]
+    assert results[:5] == [0] * 5
+    assert 0 < results[5] <= 1
+    # other users and other classes are not affected
+    assert limiter.check("/groupmsg", "bob", {}) == 0
+    assert limiter.check("/msgto", "alice", {}) == 0
+    assert limiter.counters()["group"] == {"allowed": 6, "limited": 1}
+
+def test_login_is_limited_per_connection():
+    limiter = RateLimiter(dict([parse_limit("login=1/2")]))
+    first, second = {}, {}
+    assert [limiter.check("[loginusername]", None, first) for _ in range(2)] == [0, 0]
+    assert limiter.check("[loginusername]", None, first) > 0
+    assert limiter.check("[loginusername]", None, second) == 0
+
+def test_logout_is_never_limited():
+    limiter = RateLimiter(dict([parse_limit("other=1/1")]))
+    assert all(limiter.check("/logout", "alice", {}) == 0 for _ in range(10))
+
+def test_parse_limit():
+    assert parse_limit("query=2.5/10") == ("query", (2.5, 10))
+    assert parse_limit("message=50") == ("message", (50.0, 50))
+    for spec in ("bogus=1/1", "query", "query=/5"):
+        with pytest.raises(ValueError):
+            parse_limit(spec)
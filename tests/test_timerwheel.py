@@ -0,0 +1,52 @@
+import math
+import random
+
+from timerwheel import TimerWheel
+
+
+def brute_force_check(wheel, deadlines, steps):
+    # compare against scanning every deadline at each step; timers fire on the first tick past their deadline
+    pending = dict(deadlines)
+    now = 0.0
+    for step in steps:
+        now += step
+        expired = wheel.advance(now)
+        due = {item for item, deadline in pending.items()
+               if math.ceil(deadline / wheel.tick) <= int(now / wheel.tick)}
+        assert set(expired) == due
+        assert all(deadlines[item] <= now < deadlines[item] + wheel.tick + step for item in due)
+        assert len(expired) == len(due)
+        for item in due:
+            del pending[item]
+        assert len(wheel) == len(pending)
+    assert not pending
+
+def test_expiry_matches_brute_force():
+    rng = random.Random(3)
+    wheel = TimerWheel(0.0, tick=0.5)
+    deadlines = {n: rng.uniform(0.1, 3000.0) for n in range(2000)}
+    for item, deadline in deadlines.items():
+        wheel.schedule(deadline, item)
+    brute_force_check(wheel, deadlines, [rng.uniform(0.0, 20.0) for _ in range(400)] + [3000.0])
+
+def test_cascade_and_overflow_on_a_small_wheel():
+    rng = random.Random(4)
+    # 4 slots and 2 levels only reach 16 ticks, so most timers cascade or wait in the overflow list
+    wheel = TimerWheel(0.0, slots=4, levels=2)
+    deadlines = {n: float(rng.randrange(1, 200)) for n in range(500)}
+    for item, deadline in deadlines.items():
+        wheel.schedule(deadline, item)
+    assert wheel.overflow
+    brute_force_check(wheel, deadlines, [1.0] * 200)
+
+def test_schedule_while_turning():
+    wheel = TimerWheel(100.0)
+    assert wheel.advance(150.0) == []
+    wheel.schedule(151.5, "soon")
+    wheel.schedule(100.0, "past")     # already due: fires on the next tick
+    wheel.schedule(150.0 + 64 * 64 + 10, "far")
+    assert wheel.advance(151.0) == ["past"]
+    assert wheel.advance(152.0) == ["soon"]
+    assert wheel.advance(150.0 + 64 * 64 + 9) == []
+    assert wheel.advance(150.0 + 64 * 64 + 10) == ["far"]
+    assert len(wheel) == 0
@@ -0,0 +1,92 @@
+"""
+    Hierarchical timer wheel for TCPServer3.py
+    Python 3
+    coding: utf-8
+
+    Time advances in ticks. Level 0 has one slot per tick for the next SLOTS
+    ticks, level 1 one slot per SLOTS ticks for the next SLOTS ** 2, and so
+    on. A timer goes into the lowest level whose range reaches its expiry;
+    when the wheel turns past a slot of a higher level, that slot's timers
+    are moved down a level, so each timer is touched once per level at
+    most. Scheduling is O(1), and advancing costs the timers that expire or
+    move down, however many are pending.
+
+    The server keeps one timer per connection for its idle timeout and does
+    not move it when the connection is active: when the timer fires, the
+    session compares its last activity against the timeout and either goes or
+    schedules itself again for the remaining time. Busy connections therefore
+    cost one timer per timeout period, not one update per message.
+"""
+import math
+
+
+##################################################
+#                    CONSTANTS                   #
+##################################################
+DEFAULT_TICK = 1.0  # seconds
+SLOTS = 64
+LEVELS = 4          # with 1 second ticks, timers up to 194 days away
+
+
+##################################################
+#                TimerWheel Class                #
+##################################################
+class TimerWheel():
+    """Not thread-safe; callers sharing one between threads hold a lock."""
+    def __init__(self, now, tick=DEFAULT_TICK, slots=SLOTS, levels=LEVELS):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.started = now
+        self.current = 0    # ticks the wheel has turned
+        # wheels[level][slot] is a list of (expiry tick, item)
+        self.wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        # timers further away than the top level reaches, placed again as it turns
+        self.overflow = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def schedule(self, deadline, item):
+        """Have advance() return item once the time is past deadline."""
+        expiry = max(self.current + 1, math.ceil((deadline - self.started) / self.tick))
+        self.place(expiry, item)
+        self.count += 1
+
+    def place(self, expiry, item):
+        # the lowest level where expiry and the current tick fall in the same slot of the level above
+        span = self.slots
+        for level in range(self.levels):
+            if expiry // span == self.current // span:
+                self.wheels[level][expiry // (span // self.slots) % self.slots].append((expiry, item))
+                return
+            span *= self.slots
+        self.overflow.append((expiry, item))
+
+    def advance(self, now):
+        """Turn the wheel up to now; returns the items whose deadline has passed."""
+        target = int((now - self.started) / self.tick)
+        expired = []
+        while self.current < target:
+            self.current += 1
+            # move timers down from the higher levels whose slot has come round, highest first
+            span = self.slots ** self.levels
+            if self.current % span == 0:
+                overflow, self.overflow = self.overflow, []
+                for expiry, item in overflow:
+                    self.place(expiry, item)
+            for level in range(self.levels - 1, 0, -1):
+                span = self.slots ** level
+                if self.current % span == 0:
+                    slot = self.wheels[level][self.current // span % self.slots]
+                    timers = list(slot)
+                    slot.clear()
+                    for expiry, item in timers:
+                        self.place(expiry, item)
+            slot = self.wheels[0][self.current % self.slots]
+            if slot:
+                expired.extend(item for _, item in slot)
+                self.count -= len(slot)
+                slot.clear()
+        return expired